@@ -572,6 +572,24 @@ static int foreach_sym_core(const char *path, bcc_elf_symcb callback,
   return res;
 }
 
+char *bcc_elf_find_debug_file(const char *path, int check_crc) {
+  Elf *e;
+  int fd;
+  char *debug_file;
+
+  if (openelf(path, &e, &fd) < 0)
+    return NULL;
+
+  // same lookup order as foreach_sym_core()
+  debug_file = find_debug_via_buildid(e);
+  if (!debug_file)
+    debug_file = find_debug_via_debuglink(e, path, check_crc);
+
+  elf_end(e);
+  close(fd);
+  return debug_file;
+}
+
 int bcc_elf_foreach_sym(const char *path, bcc_elf_symcb callback,
                         void *option, void *payload) {
   return foreach_sym_core(
@@ -900,15 +918,17 @@ int bcc_free_memory() {
 int bcc_elf_get_buildid(const char *path, char *buildid)
 {
   Elf *e;
-  int fd;
+  int fd, res = 0;
 
   if (openelf(path, &e, &fd) < 0)
     return -1;
 
   if (!find_buildid(e, buildid))
-    return -1;
+    res = -1;
 
-  return 0;
+  elf_end(e);
+  close(fd);
+  return res;
 }
 
 #if 0
@@ -57,6 +57,10 @@ int bcc_elf_foreach_load_section(const char *path,
 // Returns -1 on error, and 0 on success or stopped by callback
 int bcc_elf_foreach_sym(const char *path, bcc_elf_symcb callback, void *option,
                         void *payload);
+// Returns the path of the separate debuginfo file of path, located the same
+// way bcc_elf_foreach_sym does, or NULL if there is none. The caller must free
+// the returned string.
+char *bcc_elf_find_debug_file(const char *path, int check_crc);
 // Iterate over all symbols from current system's vDSO
 // Returns -1 on error, and 0 on success or stopped by callback
 int bcc_elf_foreach_vdso_sym(bcc_elf_symcb callback, void *payload);
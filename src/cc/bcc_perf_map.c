@@ -80,6 +80,35 @@ bool bcc_perf_map_path(char *map_path, size_t map_len, int pid) {
   return true;
 }
 
+// Parse one "START SIZE NAME" line, returns false for malformed lines.
+static bool perf_map_parse_line(char *line, bcc_perf_map_symcb callback,
+                                void *payload) {
+  char *cursor = line;
+  char *newline, *sep;
+  long long begin, len;
+
+  begin = strtoull(cursor, &sep, 16);
+  if (begin == 0 || *sep != ' ' || (begin == ULLONG_MAX && errno == ERANGE))
+    return false;
+  cursor = sep;
+  while (*cursor && isspace(*cursor)) cursor++;
+
+  len = strtoull(cursor, &sep, 16);
+  if (*sep != ' ' ||
+      (sep == cursor && len == 0) ||
+      (len == ULLONG_MAX && errno == ERANGE))
+    return false;
+  cursor = sep;
+  while (*cursor && isspace(*cursor)) cursor++;
+
+  newline = strchr(cursor, '\n');
+  if (newline)
+      newline[0] = '\0';
+
+  callback(cursor, begin, len, payload);
+  return true;
+}
+
 int bcc_perf_map_foreach_sym(const char *path, bcc_perf_map_symcb callback,
                              void* payload) {
   FILE* file = fopen(path, "r");
@@ -88,34 +117,46 @@ int bcc_perf_map_foreach_sym(const char *path, bcc_perf_map_symcb callback,
 
   char *line = NULL;
   size_t size = 0;
-  long long begin, len;
-  while (getline(&line, &size, file) != -1) {
-    char *cursor = line;
-    char *newline, *sep;
-
-    begin = strtoull(cursor, &sep, 16);
-    if (begin == 0 || *sep != ' ' || (begin == ULLONG_MAX && errno == ERANGE))
-      continue;
-    cursor = sep;
-    while (*cursor && isspace(*cursor)) cursor++;
-
-    len = strtoull(cursor, &sep, 16);
-    if (*sep != ' ' ||
-        (sep == cursor && len == 0) ||
-        (len == ULLONG_MAX && errno == ERANGE))
-      continue;
-    cursor = sep;
-    while (*cursor && isspace(*cursor)) cursor++;
-
-    newline = strchr(cursor, '\n');
-    if (newline)
-        newline[0] = '\0';
-
-    callback(cursor, begin, len, payload);
-  }
+  while (getline(&line, &size, file) != -1)
+    perf_map_parse_line(line, callback, payload);
 
   free(line);
   fclose(file);
 
   return 0;
 }
+
+int bcc_perf_map_foreach_sym_from(int fd, uint64_t *offset,
+                                  bcc_perf_map_symcb callback,
+                                  void *payload) {
+  int dup_fd = dup(fd);
+  if (dup_fd < 0)
+    return -1;
+  FILE *file = fdopen(dup_fd, "r");
+  if (!file) {
+    close(dup_fd);
+    return -1;
+  }
+  if (fseeko(file, *offset, SEEK_SET) < 0) {
+    fclose(file);
+    return -1;
+  }
+
+  char *line = NULL;
+  size_t size = 0;
+  ssize_t len;
+  int count = 0;
+  while ((len = getline(&line, &size, file)) != -1) {
+    // the JIT may still be writing the last line, pick it up next time
+    if (line[len - 1] != '\n')
+      break;
+    *offset += len;
+    if (perf_map_parse_line(line, callback, payload))
+      count++;
+  }
+
+  free(line);
+  fclose(file);
+
+  return count;
+}
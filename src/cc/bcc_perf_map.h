@@ -34,6 +34,11 @@ int bcc_perf_map_nstgid(int pid);
 bool bcc_perf_map_path(char *map_path, size_t map_len, int pid);
 int bcc_perf_map_foreach_sym(const char *path, bcc_perf_map_symcb callback,
                              void* payload);
+// Parse the complete lines of the perf map open as fd from *offset on, and
+// advance *offset past them. Returns the number of symbols found, or -1.
+int bcc_perf_map_foreach_sym_from(int fd, uint64_t *offset,
+                                  bcc_perf_map_symcb callback,
+                                  void *payload);
 
 #ifdef __cplusplus
 }
@@ -0,0 +1,264 @@
+/*
+ * Copyright (c) 2019 Facebook, Inc.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ * http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+#include <errno.h>
+#include <fcntl.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#include <algorithm>
+#include <mutex>
+#include <string>
+#include <vector>
+
+#include "bcc_sym_index.h"
+#include "cache_file.h"
+#include "file_desc.h"
+
+using ebpf::cache_hash;
+using ebpf::cache_put_u64;
+using ebpf::cache_write_file;
+using ebpf::FileDesc;
+using std::string;
+using std::vector;
+
+// Bump whenever the layout written by store_index() changes.
+static const char SYM_INDEX_MAGIC[8] = {'B', 'C', 'C', 'S', 'Y', 'M', 'I', '2'};
+
+// Environment variable naming the directory of the symbol index. The index
+// is disabled when it is not set.
+static const char *SYM_INDEX_ENV = "BCC_SYM_INDEX_DIR";
+
+namespace {
+
+// File layout, all integers in host byte order:
+//   header, key[key_size] padded to 8 bytes, entries[count], strtab
+struct IndexHeader {
+  char magic[8];
+  uint64_t key_size;
+  uint64_t count;
+  uint64_t strtab_size;
+};
+
+struct IndexEntry {
+  uint64_t addr;
+  uint64_t size;
+  uint64_t name;  // offset in strtab
+};
+
+struct IndexBuilder {
+  vector<IndexEntry> entries;
+  string strtab;
+};
+
+uint64_t align8(uint64_t v) { return (v + 7) & ~7ULL; }
+
+std::mutex index_dir_mutex;
+string index_dir_path;
+int index_dir_fd = -1;
+
+// Returns the fd of the index directory, or -1 when the index is disabled.
+int index_dir() {
+  std::lock_guard<std::mutex> lock(index_dir_mutex);
+  const char *dir = ::getenv(SYM_INDEX_ENV);
+
+  if (!dir || !*dir) {
+    return -1;
+  }
+  if (index_dir_fd >= 0 && index_dir_path == dir)
+    return index_dir_fd;
+  if (index_dir_fd >= 0)
+    close(index_dir_fd);
+  index_dir_path = dir;
+  if (mkdir(dir, 0700) < 0 && errno != EEXIST) {
+    index_dir_fd = -1;
+    return -1;
+  }
+  index_dir_fd = open(dir, O_RDONLY | O_DIRECTORY | O_CLOEXEC);
+  return index_dir_fd;
+}
+
+string index_key(const char *path, struct bcc_symbol_option *option) {
+  char buildid[128];
+  struct stat s;
+  string key;
+
+  cache_put_u64(key, option->use_debug_file);
+  cache_put_u64(key, option->check_debug_file_crc);
+  cache_put_u64(key, option->use_symbol_type);
+
+  // The symbols of a separate debuginfo file are merged in, so the index
+  // must go stale when that file is installed, removed or replaced, even
+  // if the binary itself did not change.
+  if (option->use_debug_file) {
+    char *debug_file =
+        bcc_elf_find_debug_file(path, option->check_debug_file_crc);
+    if (!debug_file) {
+      key += "debug:none";
+    } else {
+      int err = stat(debug_file, &s);
+      key += "debug:";
+      key += debug_file;
+      ::free(debug_file);
+      if (err < 0)
+        return string();
+      cache_put_u64(key, s.st_mtim.tv_sec);
+      cache_put_u64(key, s.st_mtim.tv_nsec);
+    }
+  }
+
+  if (bcc_elf_get_buildid(path, buildid) == 0) {
+    key += "build-id:";
+    key += buildid;
+    return key;
+  }
+  if (stat(path, &s) < 0)
+    return string();
+  key += "path:";
+  key += path;
+  cache_put_u64(key, s.st_dev);
+  cache_put_u64(key, s.st_ino);
+  cache_put_u64(key, s.st_mtim.tv_sec);
+  cache_put_u64(key, s.st_mtim.tv_nsec);
+  return key;
+}
+
+string index_name(const string &key) {
+  char name[32];
+  ::snprintf(name, sizeof(name), "%016llx.sym",
+             (unsigned long long)cache_hash(key));
+  return name;
+}
+
+// Returns 0 after replaying the whole index, 1 when the callback stopped the
+// iteration, and -1 when there is no usable index for key.
+int replay_index(int dirfd, const string &key, bcc_elf_symcb callback,
+                 void *payload) {
+  FileDesc fd(openat(dirfd, index_name(key).c_str(), O_RDONLY | O_CLOEXEC));
+  if (fd < 0)
+    return -1;
+
+  // The names end up in tool output, refuse files others could have planted.
+  struct stat st;
+  if (fstat(fd, &st) < 0 || !S_ISREG(st.st_mode) || st.st_uid != geteuid() ||
+      (st.st_mode & (S_IWGRP | S_IWOTH)) ||
+      (uint64_t)st.st_size < sizeof(IndexHeader))
+    return -1;
+
+  size_t size = st.st_size;
+  void *map = mmap(NULL, size, PROT_READ, MAP_PRIVATE, fd, 0);
+  if (map == MAP_FAILED)
+    return -1;
+
+  int res = -1;
+  const char *base = static_cast<const char *>(map);
+  const IndexHeader *hdr = static_cast<const IndexHeader *>(map);
+  uint64_t entries_off = sizeof(*hdr) + align8(hdr->key_size);
+  uint64_t strtab_off = entries_off + hdr->count * sizeof(IndexEntry);
+  if (memcmp(hdr->magic, SYM_INDEX_MAGIC, sizeof(hdr->magic)) ||
+      hdr->key_size != key.size() || hdr->count > size / sizeof(IndexEntry) ||
+      strtab_off > size || hdr->strtab_size != size - strtab_off ||
+      memcmp(base + sizeof(*hdr), key.data(), key.size()))
+    goto out;
+
+  {
+    const IndexEntry *entries =
+        reinterpret_cast<const IndexEntry *>(base + entries_off);
+    const char *strtab = base + strtab_off;
+    if (hdr->strtab_size && strtab[hdr->strtab_size - 1] != '\0')
+      goto out;
+    for (uint64_t i = 0; i < hdr->count; i++) {
+      if (entries[i].name >= hdr->strtab_size)
+        goto out;
+    }
+    res = 0;
+    for (uint64_t i = 0; i < hdr->count; i++) {
+      if (callback(strtab + entries[i].name, entries[i].addr, entries[i].size,
+                   payload) < 0) {
+        res = 1;
+        break;
+      }
+    }
+  }
+
+out:
+  munmap(map, size);
+  return res;
+}
+
+int add_symbol(const char *name, uint64_t addr, uint64_t size, void *p) {
+  IndexBuilder *b = static_cast<IndexBuilder *>(p);
+  b->entries.push_back({addr, size, b->strtab.size()});
+  b->strtab.append(name, strlen(name) + 1);
+  return 0;
+}
+
+int store_index(int dirfd, const string &key, IndexBuilder &b) {
+  std::stable_sort(b.entries.begin(), b.entries.end(),
+                   [](const IndexEntry &l, const IndexEntry &r) {
+                     return l.addr < r.addr;
+                   });
+
+  IndexHeader hdr;
+  memcpy(hdr.magic, SYM_INDEX_MAGIC, sizeof(hdr.magic));
+  hdr.key_size = key.size();
+  hdr.count = b.entries.size();
+  hdr.strtab_size = b.strtab.size();
+
+  string out(reinterpret_cast<const char *>(&hdr), sizeof(hdr));
+  out.append(key);
+  out.resize(sizeof(hdr) + align8(key.size()), '\0');
+  out.append(reinterpret_cast<const char *>(b.entries.data()),
+             b.entries.size() * sizeof(IndexEntry));
+  out.append(b.strtab);
+
+  return cache_write_file(dirfd, index_name(key), out);
+}
+
+}  // namespace
+
+void bcc_sym_index_init(void) { index_dir(); }
+
+int bcc_sym_index_foreach_sym(const char *path, bcc_elf_symcb callback,
+                              struct bcc_symbol_option *option,
+                              void *payload) {
+  int dirfd = index_dir();
+  if (dirfd < 0 || !option)
+    return bcc_elf_foreach_sym(path, callback, option, payload);
+
+  string key = index_key(path, option);
+  if (key.empty())
+    return bcc_elf_foreach_sym(path, callback, option, payload);
+
+  int res = replay_index(dirfd, key, callback, payload);
+  if (res >= 0)
+    return res;
+
+  IndexBuilder b;
+  res = bcc_elf_foreach_sym(path, add_symbol, option, &b);
+  if (res < 0)
+    return res;
+  store_index(dirfd, key, b);
+
+  // deliver in index order, so that warm and cold runs behave the same
+  for (const IndexEntry &e : b.entries) {
+    if (callback(&b.strtab[e.name], e.addr, e.size, payload) < 0)
+      return 1;
+  }
+  return 0;
+}
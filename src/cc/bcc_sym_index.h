@@ -0,0 +1,40 @@
+/*
+ * Copyright (c) 2019 Facebook, Inc.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ * http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+#ifndef LIBBCC_SYM_INDEX_H
+#define LIBBCC_SYM_INDEX_H
+
+#include "bcc_elf.h"
+#include "bcc_syms.h"
+
+// On-disk index of the symbols of ELF files, stored in the directory named
+// by BCC_SYM_INDEX_DIR. Disabled when it is not set.
+//
+// An index file holds the sorted (address, size, name) table that
+// bcc_elf_foreach_sym() produces for a file and a set of symbol options. It
+// is keyed by the build-id of the file, or by its path, device, inode and
+// mtime when it has none.
+
+// Open the index directory, so that later lookups keep using it after
+// switching to the mount namespace of another process.
+void bcc_sym_index_init(void);
+
+// Same as bcc_elf_foreach_sym(), but replays the symbols from the mmapped
+// index when there is one, and stores the index of the file otherwise.
+int bcc_sym_index_foreach_sym(const char *path, bcc_elf_symcb callback,
+                              struct bcc_symbol_option *option,
+                              void *payload);
+
+#endif
@@ -15,6 +15,7 @@
  */
 
 #include <cxxabi.h>
+#include <dirent.h>
 #include <cstring>
 #include <fcntl.h>
 #include <linux/elf.h>
@@ -23,16 +24,26 @@
 #include <sys/types.h>
 #include <unistd.h>
 #include <cstdio>
+#include <tuple>
 
 #include "bcc_elf.h"
 #include "bcc_perf_map.h"
 #include "bcc_proc.h"
+#include "bcc_sym_index.h"
 #include "bcc_syms.h"
 #include "common.h"
 #include "vendor/tinyformat.hpp"
 
 #include "syms.h"
 
+// Symbols replayed from the symbol index already come in address order, so
+// only sort when the vector is not sorted yet.
+template <typename T>
+static void sort_symbols(std::vector<T> &syms) {
+  if (!std::is_sorted(syms.begin(), syms.end()))
+    std::sort(syms.begin(), syms.end());
+}
+
 ino_t ProcStat::getinode_() {
   struct stat s;
   return (!stat(procfs_.c_str(), &s)) ? s.st_ino : -1;
@@ -46,6 +57,31 @@ bool ProcStat::is_stale() {
 ProcStat::ProcStat(int pid)
     : procfs_(tfm::format("/proc/%d/exe", pid)), inode_(getinode_()) {}
 
+const char *DemangleCache::demangle(const std::string *name) {
+  const char *mangled = name->c_str();
+  if (strncmp(mangled, "_Z", 2) && strncmp(mangled, "___Z", 4))
+    return mangled;
+
+  std::lock_guard<std::mutex> lock(mutex_);
+  auto it = names_.find(name);
+  if (it == names_.end()) {
+    char *demangled = abi::__cxa_demangle(mangled, nullptr, nullptr, nullptr);
+    it = names_.emplace(name, demangled ? demangled : "").first;
+    free(demangled);
+    size_ += sizeof(*it) + 2 * sizeof(void *) + it->second.capacity();
+  }
+  return it->second.empty() ? mangled : it->second.c_str();
+}
+
+void DemangleCache::clear() {
+  std::lock_guard<std::mutex> lock(mutex_);
+  names_.clear();
+  size_ = 0;
+}
+
+// Without the lock, the hash buckets are accounted in the size of the entries
+size_t DemangleCache::memory_size() const { return size_; }
+
 void KSyms::_add_symbol(const char *symname, uint64_t addr, void *p) {
   KSyms *ks = static_cast<KSyms *>(p);
   ks->syms_.emplace_back(symname, addr);
@@ -58,6 +94,17 @@ void KSyms::refresh() {
   }
 }
 
+size_t KSyms::memory_size() const {
+  size_t size = syms_.capacity() * sizeof(Symbol);
+  for (const Symbol &sym : syms_)
+    size += sym.name.capacity();
+  // hash nodes and buckets of the name index
+  size += symnames_.bucket_count() * sizeof(void *);
+  for (const auto &it : symnames_)
+    size += sizeof(it) + sizeof(void *) + it.first.capacity();
+  return size;
+}
+
 bool KSyms::resolve_addr(uint64_t addr, struct bcc_symbol *sym, bool demangle) {
   refresh();
 
@@ -102,7 +149,10 @@ bool KSyms::resolve_name(const char *_unused, const char *name,
 }
 
 ProcSyms::ProcSyms(int pid, struct bcc_symbol_option *option)
-    : pid_(pid), procstat_(pid), mount_ns_instance_(new ProcMountNS(pid_)) {
+    : pid_(pid),
+      procstat_(pid),
+      mount_ns_instance_(new ProcMountNS(pid_)),
+      perf_map_refresh_(BCC_PERF_MAP_REFRESH_ON_MISS) {
   if (option)
     std::memcpy(&symbol_option_, option, sizeof(bcc_symbol_option));
   else
@@ -111,6 +161,8 @@ ProcSyms::ProcSyms(int pid, struct bcc_symbol_option *option)
       .check_debug_file_crc = 1,
       .use_symbol_type = (1 << STT_FUNC) | (1 << STT_GNU_IFUNC)
     };
+  // before any symbol table is loaded from the process's mount namespace
+  bcc_sym_index_init();
   load_modules();
 }
 
@@ -148,6 +200,214 @@ void ProcSyms::refresh() {
   procstat_.reset();
 }
 
+size_t ProcSyms::memory_size() const {
+  size_t size = modules_.capacity() * sizeof(Module);
+  for (const Module &mod : modules_) {
+    size += mod.name_.capacity();
+    size += mod.ranges_.capacity() * sizeof(Module::Range);
+    // shared tables are accounted in equal parts to all their users
+    if (mod.table_)
+      size += mod.table_->memory_size() / mod.table_.use_count();
+    if (mod.perf_map_)
+      size += mod.perf_map_->memory_size();
+  }
+  return size;
+}
+
+size_t ProcSyms::SymbolTable::memory_size() const {
+  size_t size = sizeof(*this) + syms_.capacity() * sizeof(Symbol);
+  size += demangled_.memory_size();
+  size += symnames_.bucket_count() * sizeof(void *) + symnames_size_;
+  return size;
+}
+
+int ProcSyms::SymbolTable::_add_symbol(const char *symname, uint64_t start,
+                                       uint64_t size, void *p) {
+  SymbolTable *t = static_cast<SymbolTable *>(p);
+  auto res = t->symnames_.emplace(symname);
+  if (res.second)
+    t->symnames_size_ +=
+        sizeof(std::string) + sizeof(void *) + res.first->capacity();
+  t->syms_.emplace_back(&*(res.first), start, size);
+  return 0;
+}
+
+bool ProcSyms::SymbolTableKey::operator<(const SymbolTableKey &rhs) const {
+  return std::tie(dev, ino, mtime_sec, mtime_nsec, use_debug_file,
+                  check_debug_file_crc, use_symbol_type) <
+         std::tie(rhs.dev, rhs.ino, rhs.mtime_sec, rhs.mtime_nsec,
+                  rhs.use_debug_file, rhs.check_debug_file_crc,
+                  rhs.use_symbol_type);
+}
+
+std::mutex ProcSyms::symbol_tables_mutex_;
+std::map<ProcSyms::SymbolTableKey, std::weak_ptr<ProcSyms::SymbolTable>>
+    ProcSyms::symbol_tables_;
+
+// Must be called in the mount namespace of the process mapping path.
+std::shared_ptr<ProcSyms::SymbolTable> ProcSyms::load_elf_symbol_table(
+    const std::string &path, bcc_symbol_option *option) {
+  std::shared_ptr<SymbolTable> table;
+  struct stat s;
+
+  if (stat(path.c_str(), &s) < 0) {
+    // can't identify the file, load a private copy
+    table = std::make_shared<SymbolTable>();
+    bcc_sym_index_foreach_sym(path.c_str(), SymbolTable::_add_symbol, option,
+                        table.get());
+    sort_symbols(table->syms_);
+    return table;
+  }
+
+  SymbolTableKey key = {s.st_dev, s.st_ino, s.st_mtim.tv_sec,
+                        s.st_mtim.tv_nsec, option->use_debug_file,
+                        option->check_debug_file_crc, option->use_symbol_type};
+
+  {
+    std::lock_guard<std::mutex> lock(symbol_tables_mutex_);
+    auto it = symbol_tables_.find(key);
+    if (it != symbol_tables_.end()) {
+      table = it->second.lock();
+      if (table)
+        return table;
+    }
+  }
+
+  // Parse without the lock, so that threads symbolizing different processes
+  // load different files in parallel.
+  table = std::make_shared<SymbolTable>();
+  bcc_sym_index_foreach_sym(path.c_str(), SymbolTable::_add_symbol, option,
+                      table.get());
+  sort_symbols(table->syms_);
+
+  std::lock_guard<std::mutex> lock(symbol_tables_mutex_);
+  // another thread may have loaded the same file meanwhile, keep its copy
+  auto it = symbol_tables_.find(key);
+  if (it != symbol_tables_.end()) {
+    std::shared_ptr<SymbolTable> other = it->second.lock();
+    if (other)
+      return other;
+  }
+
+  // drop the entries of tables no process uses anymore
+  for (auto i = symbol_tables_.begin(); i != symbol_tables_.end();) {
+    if (i->second.expired())
+      i = symbol_tables_.erase(i);
+    else
+      ++i;
+  }
+  symbol_tables_[key] = table;
+  return table;
+}
+
+bool ProcSyms::PerfMapTable::update() {
+  struct stat s;
+
+  if (fstat(fd_, &s) < 0)
+    return false;
+  if ((uint64_t)s.st_size < offset_) {
+    // truncated, the process started over
+    ranges_.clear();
+    demangled_.clear();
+    symnames_.clear();
+    offset_ = 0;
+  }
+  if ((uint64_t)s.st_size == offset_)
+    return false;
+  return bcc_perf_map_foreach_sym_from(fd_, &offset_, _add_symbol, this) > 0;
+}
+
+int ProcSyms::PerfMapTable::_add_symbol(const char *symname, uint64_t start,
+                                        uint64_t size, void *p) {
+  static_cast<PerfMapTable *>(p)->add(symname, start, size);
+  return 0;
+}
+
+void ProcSyms::PerfMapTable::add(const char *symname, uint64_t start,
+                                 uint64_t size) {
+  uint64_t end = start + size;
+  if (end <= start)
+    return;
+
+  auto res = symnames_.emplace(symname);
+  if (res.second)
+    symnames_size_ += sizeof(std::string) + sizeof(void *) + res.first->capacity();
+  const std::string *name = &*res.first;
+
+  // cut the tail of the range starting before the new one
+  auto it = ranges_.lower_bound(start);
+  if (it != ranges_.begin()) {
+    auto prev = std::prev(it);
+    if (prev->second.end > start) {
+      Entry tail = prev->second;
+      prev->second.end = start;
+      if (tail.end > end)
+        ranges_.emplace(end, tail);
+    }
+  }
+  // drop the ranges covered by the new one, and cut the head of the last
+  while (it != ranges_.end() && it->first < end) {
+    if (it->second.end > end) {
+      Entry tail = it->second;
+      ranges_.erase(it);
+      ranges_.emplace(end, tail);
+      break;
+    }
+    it = ranges_.erase(it);
+  }
+  ranges_[start] = Entry{end, start, name};
+}
+
+bool ProcSyms::PerfMapTable::find_addr(uint64_t addr, struct bcc_symbol *sym,
+                                       bool demangle) {
+  auto it = ranges_.upper_bound(addr);
+  if (it == ranges_.begin())
+    return false;
+  --it;
+  if (addr >= it->second.end)
+    return false;
+  sym->name = it->second.name->c_str();
+  if (demangle)
+    sym->demangle_name = demangled_.demangle(it->second.name);
+  sym->offset = addr - it->second.sym_start;
+  return true;
+}
+
+bool ProcSyms::PerfMapTable::find_name(const char *symname,
+                                       uint64_t *addr) const {
+  for (const auto &it : ranges_) {
+    if (*(it.second.name) == symname) {
+      *addr = it.second.sym_start;
+      return true;
+    }
+  }
+  return false;
+}
+
+size_t ProcSyms::PerfMapTable::memory_size() const {
+  // red-black tree nodes hold three pointers and the color next to the pair
+  size_t size = sizeof(*this) +
+                ranges_.size() * (sizeof(*ranges_.begin()) + 4 * sizeof(void *));
+  size += demangled_.memory_size();
+  size += symnames_.bucket_count() * sizeof(void *) + symnames_size_;
+  return size;
+}
+
+size_t ProcSyms::shared_tables(size_t *bytes) {
+  std::lock_guard<std::mutex> lock(symbol_tables_mutex_);
+  size_t count = 0;
+
+  *bytes = 0;
+  for (auto &it : symbol_tables_) {
+    std::shared_ptr<SymbolTable> table = it.second.lock();
+    if (table) {
+      count++;
+      *bytes += table->memory_size();
+    }
+  }
+  return count;
+}
+
 int ProcSyms::_add_module(const char *modname, uint64_t start, uint64_t end,
                           uint64_t offset, bool check_mount_ns, void *payload) {
   ProcSyms *ps = static_cast<ProcSyms *>(payload);
@@ -188,11 +448,41 @@ int ProcSyms::_add_module(const char *modname, uint64_t start, uint64_t end,
   return 0;
 }
 
+void ProcSyms::update_perf_maps() {
+  for (Module &mod : modules_)
+    if (mod.perf_map_)
+      mod.perf_map_->update();
+}
+
 bool ProcSyms::resolve_addr(uint64_t addr, struct bcc_symbol *sym,
                             bool demangle) {
   if (procstat_.is_stale())
     refresh();
+  else if (perf_map_refresh_ == BCC_PERF_MAP_REFRESH_ALWAYS)
+    update_perf_maps();
+
+  return find_addr(addr, sym, demangle);
+}
+
+int ProcSyms::resolve_addrs(const uint64_t *addrs, int count,
+                            struct bcc_symbol *syms, bool demangle) {
+  int found = 0;
+
+  // Check for a refresh once for the whole batch, so that all the results
+  // point into the same module tables.
+  if (procstat_.is_stale())
+    refresh();
+  else if (perf_map_refresh_ == BCC_PERF_MAP_REFRESH_ALWAYS)
+    update_perf_maps();
 
+  for (int i = 0; i < count; i++)
+    if (find_addr(addrs[i], &syms[i], demangle))
+      found++;
+  return found;
+}
+
+bool ProcSyms::find_addr(uint64_t addr, struct bcc_symbol *sym,
+                         bool demangle) {
   memset(sym, 0, sizeof(struct bcc_symbol));
 
   const char *original_module = nullptr;
@@ -202,14 +492,13 @@ bool ProcSyms::resolve_addr(uint64_t addr, struct bcc_symbol *sym,
     if (only_perf_map && (mod.type_ != ModuleType::PERF_MAP))
       continue;
     if (mod.contains(addr, offset)) {
-      if (mod.find_addr(offset, sym)) {
-        if (demangle) {
-          if (sym->name && (!strncmp(sym->name, "_Z", 2) || !strncmp(sym->name, "___Z", 4)))
-            sym->demangle_name =
-                abi::__cxa_demangle(sym->name, nullptr, nullptr, nullptr);
-          if (!sym->demangle_name)
-            sym->demangle_name = sym->name;
-        }
+      bool found = mod.find_addr(offset, sym, demangle);
+      // the JIT may have written the symbol since the map was loaded
+      if (!found && mod.perf_map_ &&
+          perf_map_refresh_ == BCC_PERF_MAP_REFRESH_ON_MISS &&
+          mod.perf_map_->update())
+        found = mod.find_addr(offset, sym, demangle);
+      if (found) {
         return true;
       } else if (mod.type_ != ModuleType::PERF_MAP) {
         // In this case, we found the address in the range of a module, but
@@ -270,14 +559,6 @@ ProcSyms::Module::Module(const char *name, ProcMountNS *mount_ns,
   elf_so_addr_ = 0;
 }
 
-int ProcSyms::Module::_add_symbol(const char *symname, uint64_t start,
-                                  uint64_t size, void *p) {
-  Module *m = static_cast<Module *>(p);
-  auto res = m->symnames_.emplace(symname);
-  m->syms_.emplace_back(&*(res.first), start, size);
-  return 0;
-}
-
 void ProcSyms::Module::load_sym_table() {
   if (loaded_)
     return;
@@ -288,14 +569,27 @@ void ProcSyms::Module::load_sym_table() {
 
   ProcMountNSGuard g(mount_ns_);
 
-  if (type_ == ModuleType::PERF_MAP)
-    bcc_perf_map_foreach_sym(name_.c_str(), _add_symbol, this);
-  if (type_ == ModuleType::EXEC || type_ == ModuleType::SO)
-    bcc_elf_foreach_sym(name_.c_str(), _add_symbol, symbol_option_, this);
+  if (type_ == ModuleType::EXEC || type_ == ModuleType::SO) {
+    table_ = load_elf_symbol_table(name_, symbol_option_);
+    return;
+  }
+
+  if (type_ == ModuleType::PERF_MAP) {
+    // kept open, so that appended symbols are read without entering the
+    // mount namespace again
+    int fd = open(name_.c_str(), O_RDONLY | O_CLOEXEC);
+    if (fd >= 0) {
+      perf_map_ = std::make_shared<PerfMapTable>(fd);
+      perf_map_->update();
+    }
+    return;
+  }
+
+  table_ = std::make_shared<SymbolTable>();
   if (type_ == ModuleType::VDSO)
-    bcc_elf_foreach_vdso_sym(_add_symbol, this);
+    bcc_elf_foreach_vdso_sym(SymbolTable::_add_symbol, table_.get());
 
-  std::sort(syms_.begin(), syms_.end());
+  std::sort(table_->syms_.begin(), table_->syms_.end());
 }
 
 bool ProcSyms::Module::contains(uint64_t addr, uint64_t &offset) const {
@@ -320,8 +614,12 @@ bool ProcSyms::Module::contains(uint64_t addr, uint64_t &offset) const {
 
 bool ProcSyms::Module::find_name(const char *symname, uint64_t *addr) {
   load_sym_table();
+  if (perf_map_)
+    return perf_map_->find_name(symname, addr);
+  if (!table_)
+    return false;
 
-  for (Symbol &s : syms_) {
+  for (Symbol &s : table_->syms_) {
     if (*(s.name) == symname) {
       *addr = type_ == ModuleType::SO ? start() + s.start : s.start;
       return true;
@@ -330,14 +628,20 @@ bool ProcSyms::Module::find_name(const char *symname, uint64_t *addr) {
   return false;
 }
 
-bool ProcSyms::Module::find_addr(uint64_t offset, struct bcc_symbol *sym) {
+bool ProcSyms::Module::find_addr(uint64_t offset, struct bcc_symbol *sym,
+                                 bool demangle) {
   load_sym_table();
 
   sym->module = name_.c_str();
   sym->offset = offset;
+  if (perf_map_)
+    return perf_map_->find_addr(offset, sym, demangle);
+  if (!table_)
+    return false;
 
-  auto it = std::upper_bound(syms_.begin(), syms_.end(), Symbol(nullptr, offset, 0));
-  if (it == syms_.begin())
+  std::vector<Symbol> &syms = table_->syms_;
+  auto it = std::upper_bound(syms.begin(), syms.end(), Symbol(nullptr, offset, 0));
+  if (it == syms.begin())
     return false;
 
   // 'it' points to the symbol whose start address is strictly greater than
@@ -365,13 +669,15 @@ bool ProcSyms::Module::find_addr(uint64_t offset, struct bcc_symbol *sym) {
   for (; offset >= it->start; --it) {
     if (offset < it->start + it->size) {
       sym->name = it->name->c_str();
+      if (demangle)
+        sym->demangle_name = table_->demangled_.demangle(it->name);
       sym->offset = (offset - it->start);
       return true;
     }
     if (limit > it->start + it->size)
       break;
     // But don't step beyond begin()!
-    if (it == syms_.begin())
+    if (it == syms.begin())
       break;
   }
 
@@ -389,8 +695,9 @@ bool BuildSyms::Module::load_sym_table()
     .use_symbol_type = (1 << STT_FUNC) | (1 << STT_GNU_IFUNC)
   };
 
-  bcc_elf_foreach_sym(module_name_.c_str(), _add_symbol, &symbol_option_, this);
-  std::sort(syms_.begin(), syms_.end());
+  bcc_sym_index_foreach_sym(module_name_.c_str(), _add_symbol, &symbol_option_,
+                            this);
+  sort_symbols(syms_);
 
   for(std::vector<Symbol>::iterator it = syms_.begin();
       it != syms_.end(); ++it++) {
@@ -435,6 +742,11 @@ unknown_symbol:
 }
 
 bool BuildSyms::add_module(const std::string module_name)
+{
+  return add_module(module_name, true);
+}
+
+bool BuildSyms::add_module(const std::string &module_name, bool replace)
 {
   struct stat s;
   char buildid[BPF_BUILD_ID_SIZE*2+1];
@@ -446,22 +758,119 @@ bool BuildSyms::add_module(const std::string module_name)
       return false;
 
   std::string elf_buildid(buildid);
+  if (!replace && buildmap_.find(elf_buildid) != buildmap_.end())
+    return true;
   std::unique_ptr<BuildSyms::Module> ptr(new BuildSyms::Module(module_name.c_str()));
   buildmap_[elf_buildid] = std::move(ptr);
+  unknown_.erase(elf_buildid);
   return true;
 }
 
+bool BuildSyms::add_directory(const std::string &path)
+{
+  struct stat s;
+
+  if (stat(path.c_str(), &s) < 0 || !S_ISDIR(s.st_mode))
+    return false;
+
+  dirs_.emplace_back(path);
+  // the new directory may hold build-ids not found so far
+  unknown_.clear();
+  return true;
+}
+
+bool BuildSyms::add_module_if_match(const std::string &path,
+                                    const std::string &build_id)
+{
+  char buildid[BPF_BUILD_ID_SIZE*2+1];
+
+  if (access(path.c_str(), R_OK) < 0 ||
+      bcc_elf_get_buildid(path.c_str(), buildid) < 0 || build_id != buildid)
+    return false;
+
+  std::unique_ptr<BuildSyms::Module> ptr(new BuildSyms::Module(path.c_str()));
+  buildmap_[build_id] = std::move(ptr);
+  return true;
+}
+
+void BuildSyms::scan_directory(const std::string &path, int depth)
+{
+  static const int max_depth = 32;
+  DIR *dir;
+  struct dirent *ent;
+
+  if (depth > max_depth || !(dir = opendir(path.c_str())))
+    return;
+
+  while ((ent = readdir(dir)) != nullptr) {
+    if (!strcmp(ent->d_name, ".") || !strcmp(ent->d_name, ".."))
+      continue;
+
+    std::string file = path + "/" + ent->d_name;
+    struct stat s;
+    // symlinks are not followed, they would index files twice or loop
+    if (lstat(file.c_str(), &s) < 0)
+      continue;
+    if (S_ISDIR(s.st_mode)) {
+      scan_directory(file, depth + 1);
+      continue;
+    }
+    if (!S_ISREG(s.st_mode) ||
+        !scanned_files_.emplace(s.st_dev, s.st_ino).second)
+      continue;
+
+    // only hand ELF files to libelf
+    char magic[SELFMAG];
+    ebpf::FileDesc fd(open(file.c_str(), O_RDONLY | O_CLOEXEC));
+    if (fd < 0 || pread(fd, magic, SELFMAG, 0) != SELFMAG ||
+        memcmp(magic, ELFMAG, SELFMAG))
+      continue;
+    // modules added explicitly take precedence
+    add_module(file, false);
+  }
+  closedir(dir);
+}
+
+BuildSyms::Module *BuildSyms::find_module(const std::string &build_id)
+{
+  auto it = buildmap_.find(build_id);
+  if (it != buildmap_.end())
+    return it->second.get();
+  if (dirs_.empty() || unknown_.find(build_id) != unknown_.end())
+    return nullptr;
+
+  // debug file trees such as /usr/lib/debug name files after their build-id
+  std::string name = "/.build-id/" + build_id.substr(0, 2) + "/" +
+                     build_id.substr(2);
+  for (auto &dir : dirs_) {
+    if (add_module_if_match(dir.path_ + name + ".debug", build_id) ||
+        add_module_if_match(dir.path_ + name, build_id))
+      return buildmap_[build_id].get();
+  }
+
+  // otherwise index the build-ids of every ELF file of the directories, once
+  for (auto &dir : dirs_) {
+    if (dir.scanned_)
+      continue;
+    scan_directory(dir.path_, 0);
+    dir.scanned_ = true;
+    it = buildmap_.find(build_id);
+    if (it != buildmap_.end())
+      return it->second.get();
+  }
+
+  unknown_.insert(build_id);
+  return nullptr;
+}
+
 bool BuildSyms::resolve_addr(std::string build_id, uint64_t offset,
                              struct bcc_symbol *sym, bool demangle)
 {
-  std::unordered_map<std::string,std::unique_ptr<BuildSyms::Module> >::iterator it;
-
-  it = buildmap_.find(build_id);
-  if (it == buildmap_.end())
-    /*build-id not added to the BuildSym*/
+  BuildSyms::Module *mod = find_module(build_id);
+  if (!mod)
+    /*build-id not added to the BuildSym, nor found in its directories*/
     return false;
 
-  BuildSyms::Module *mod = it->second.get();
   return mod->resolve_addr(offset, sym, demangle);
 }
 
@@ -481,8 +890,7 @@ void bcc_free_symcache(void *symcache, int pid) {
 }
 
 void bcc_symbol_free_demangle_name(struct bcc_symbol *sym) {
-  if (sym->demangle_name && (sym->demangle_name != sym->name))
-    free(const_cast<char*>(sym->demangle_name));
+  // demangled names are owned by the symbol tables
 }
 
 int bcc_symcache_resolve(void *resolver, uint64_t addr,
@@ -497,6 +905,18 @@ int bcc_symcache_resolve_no_demangle(void *resolver, uint64_t addr,
   return cache->resolve_addr(addr, sym, false) ? 0 : -1;
 }
 
+int bcc_symcache_resolve_batch(void *resolver, const uint64_t *addrs,
+                               int count, int demangle,
+                               struct bcc_symbol *syms) {
+  SymbolCache *cache = static_cast<SymbolCache *>(resolver);
+  return cache->resolve_addrs(addrs, count, syms, demangle);
+}
+
+void bcc_symbol_free_demangle_names(struct bcc_symbol *syms, int count) {
+  for (int i = 0; i < count; i++)
+    bcc_symbol_free_demangle_name(&syms[i]);
+}
+
 int bcc_symcache_resolve_name(void *resolver, const char *module,
                               const char *name, uint64_t *addr) {
   SymbolCache *cache = static_cast<SymbolCache *>(resolver);
@@ -508,6 +928,28 @@ void bcc_symcache_refresh(void *resolver) {
   cache->refresh();
 }
 
+int bcc_symcache_is_stale(void *resolver) {
+  SymbolCache *cache = static_cast<SymbolCache *>(resolver);
+  return cache->is_stale() ? 1 : 0;
+}
+
+uint64_t bcc_symcache_memory_size(void *resolver) {
+  SymbolCache *cache = static_cast<SymbolCache *>(resolver);
+  return cache->memory_size();
+}
+
+void bcc_symcache_set_perf_map_refresh(void *resolver, int policy) {
+  SymbolCache *cache = static_cast<SymbolCache *>(resolver);
+  cache->set_perf_map_refresh(policy);
+}
+
+uint64_t bcc_symcache_shared_tables(uint64_t *bytes) {
+  size_t size;
+  size_t count = ProcSyms::shared_tables(&size);
+  *bytes = size;
+  return count;
+}
+
 void *bcc_buildsymcache_new(void) {
   return static_cast<void *>(new BuildSyms());
 }
@@ -522,6 +964,12 @@ int  bcc_buildsymcache_add_module(void *resolver, const char *module_name)
   return  bsym->add_module(module_name) ? 0 : -1;
 }
 
+int bcc_buildsymcache_add_directory(void *resolver, const char *path)
+{
+  BuildSyms *bsym = static_cast<BuildSyms *>(resolver);
+  return bsym->add_directory(path) ? 0 : -1;
+}
+
 int bcc_buildsymcache_resolve(void *resolver,
                               struct bpf_stack_build_id *trace,
                               struct bcc_symbol *sym)
@@ -591,7 +1039,7 @@ int bcc_foreach_function_symbol(const char *module, SYM_CB cb) {
     .use_symbol_type = (1 << STT_FUNC) | (1 << STT_GNU_IFUNC)
   };
 
-  return bcc_elf_foreach_sym(
+  return bcc_sym_index_foreach_sym(
       module, _sym_cb_wrapper, &default_option, (void *)cb);
 }
 
@@ -646,6 +1094,7 @@ int bcc_resolve_symname(const char *module, const char *symname,
   if (sym->module == NULL)
     return -1;
 
+  bcc_sym_index_init();
   ProcMountNSGuard g(pid);
 
   sym->name = symname;
@@ -654,7 +1103,7 @@ int bcc_resolve_symname(const char *module, const char *symname,
     option = &default_option;
 
   if (sym->name && sym->offset == 0x0)
-    if (bcc_elf_foreach_sym(sym->module, _find_sym, option, sym) < 0)
+    if (bcc_sym_index_foreach_sym(sym->module, _find_sym, option, sym) < 0)
       goto invalid_module;
   if (sym->offset == 0x0)
     goto invalid_module;
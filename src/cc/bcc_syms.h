@@ -53,17 +53,47 @@ struct bcc_symbol_option {
 void *bcc_symcache_new(int pid, struct bcc_symbol_option *option);
 void bcc_free_symcache(void *symcache, int pid);
 
-// The demangle_name pointer in bcc_symbol struct is returned from the
-// __cxa_demangle function call, which is supposed to be freed by caller. Call
-// this function after done using returned result of bcc_symcache_resolve.
+// The demangle_name pointer in bcc_symbol struct points to the demangled
+// names cached by the symcache, like name it stays valid until the symcache is
+// refreshed or freed. Calling this function after done using returned result
+// of bcc_symcache_resolve is no longer needed, it is kept for compatibility.
 void bcc_symbol_free_demangle_name(struct bcc_symbol *sym);
 int bcc_symcache_resolve(void *symcache, uint64_t addr, struct bcc_symbol *sym);
 int bcc_symcache_resolve_no_demangle(void *symcache, uint64_t addr,
                                      struct bcc_symbol *sym);
+// Resolve count addresses in one call, syms[i] receiving the result for
+// addrs[i]. Addresses that could not be resolved get a NULL name, their
+// module and offset are set as bcc_symcache_resolve would on failure.
+// Returns the number of addresses resolved.
+int bcc_symcache_resolve_batch(void *symcache, const uint64_t *addrs,
+                               int count, int demangle,
+                               struct bcc_symbol *syms);
+void bcc_symbol_free_demangle_names(struct bcc_symbol *syms, int count);
 
 int bcc_symcache_resolve_name(void *resolver, const char *module,
                               const char *name, uint64_t *addr);
 void bcc_symcache_refresh(void *resolver);
+// Returns 1 if the process of the symcache exec'ed or exited since its
+// symbols were loaded, 0 otherwise. Always 0 for the kernel symcache.
+int bcc_symcache_is_stale(void *resolver);
+// Approximate memory used by the symbol tables loaded so far, in bytes.
+uint64_t bcc_symcache_memory_size(void *resolver);
+// The symbol tables of ELF files are loaded once and shared by all the
+// process symcaches mapping the same file. Returns the number of such tables
+// currently loaded, and stores their total memory in bytes.
+uint64_t bcc_symcache_shared_tables(uint64_t *bytes);
+
+// When the symbols of /tmp/perf-PID.map files written by JIT compilers are
+// reloaded. Only the lines appended since the last load are parsed.
+enum bcc_perf_map_refresh {
+  // load the map once, until bcc_symcache_refresh
+  BCC_PERF_MAP_REFRESH_NEVER = 0,
+  // reload when an address is not found (default)
+  BCC_PERF_MAP_REFRESH_ON_MISS = 1,
+  // reload before every lookup, so that re-JITted code is always up to date
+  BCC_PERF_MAP_REFRESH_ALWAYS = 2,
+};
+void bcc_symcache_set_perf_map_refresh(void *resolver, int policy);
 
 int bcc_resolve_global_addr(int pid, const char *module, const uint64_t address,
                             uint64_t *global);
@@ -72,6 +102,10 @@ int bcc_resolve_global_addr(int pid, const char *module, const uint64_t address,
 void *bcc_buildsymcache_new(void);
 void bcc_free_buildsymcache(void *symcache);
 int  bcc_buildsymcache_add_module(void *resolver, const char *module_name);
+// Look up the build-ids of stack frames not found in the added modules in
+// the ELF files under path: first at .build-id/xx/yyyy[.debug], as laid out
+// by debug info packages, then by indexing every ELF file of the tree, once.
+int bcc_buildsymcache_add_directory(void *resolver, const char *path);
 int bcc_buildsymcache_resolve(void *resolver,
                               struct bpf_stack_build_id *trace,
                               struct bcc_symbol *sym);
@@ -312,9 +312,13 @@ int BPFModule::load_maps(std::map<std::string, std::tuple<uint8_t *, uintptr_t>>
     }
   }
 
-  // create maps
+  // create maps, in declaration order (fake fds decrease) so that inner maps
+  // exist before the maps of maps using them
   std::map<int, int> map_fds;
-  for (auto map : fake_fd_map_) {
+  std::map<std::string, int> inner_map_fds;
+  for (auto map_it = fake_fd_map_.rbegin(); map_it != fake_fd_map_.rend();
+       ++map_it) {
+    auto map = *map_it;
     int fd, fake_fd, map_type, key_size, value_size, max_entries, map_flags;
     const char *map_name;
 
@@ -340,6 +344,17 @@ int BPFModule::load_maps(std::map<std::string, std::tuple<uint8_t *, uintptr_t>>
       attr.btf_value_type_id = map_tids[map_name].second;
     }
 
+    const std::string &inner_map_name = get<6>(map.second);
+    if (!inner_map_name.empty()) {
+      auto inner = inner_map_fds.find(inner_map_name);
+      if (inner == inner_map_fds.end()) {
+        fprintf(stderr, "could not open bpf map: %s, inner map %s not found\n",
+                map_name, inner_map_name.c_str());
+        return -1;
+      }
+      attr.inner_map_fd = inner->second;
+    }
+
     fd = bcc_create_map_xattr(&attr, allow_rlimit_);
     if (fd < 0) {
       fprintf(stderr, "could not open bpf map: %s, error: %s\n",
@@ -348,6 +363,7 @@ int BPFModule::load_maps(std::map<std::string, std::tuple<uint8_t *, uintptr_t>>
     }
 
     map_fds[fake_fd] = fd;
+    inner_map_fds[get<1>(map.second)] = fd;
   }
 
   // update map table fd's
@@ -421,6 +437,11 @@ int BPFModule::finalize() {
 
   engine_->finalizeObject();
 
+  // Snapshot the object before map fds are patched into the instructions.
+  // Failing to populate the cache is not an error, we just compile next time.
+  if (!objcache_key_.empty())
+    store_objcache(objcache_key_, *sections_p);
+
   if (flags_ & DEBUG_SOURCE) {
     SourceDebugger src_debugger(mod, *sections_p, FN_PREFIX, mod_src_,
                                 src_dbg_fmap_);
@@ -823,6 +844,12 @@ int BPFModule::load_string(const string &text, const char *cflags[], int ncflags
     fprintf(stderr, "Program already initialized\n");
     return -1;
   }
+  if (objcache_enabled()) {
+    objcache_key_ = objcache_key(text, cflags, ncflags);
+    int rc = load_objcache(objcache_key_);
+    if (rc <= 0)
+      return rc;
+  }
   if (int rc = load_cfile(text, true, cflags, ncflags))
     return rc;
   if (rw_engine_enabled_) {
@@ -84,6 +84,13 @@ class BPFModule {
                        const void *val);
   void load_btf(std::map<std::string, std::tuple<uint8_t *, uintptr_t>> &sections);
   int load_maps(std::map<std::string, std::tuple<uint8_t *, uintptr_t>> &sections);
+  bool objcache_enabled() const;
+  std::string objcache_key(const std::string &text, const char *cflags[],
+                           int ncflags) const;
+  std::string objcache_path(const std::string &key) const;
+  int store_objcache(const std::string &key,
+                     std::map<std::string, std::tuple<uint8_t *, uintptr_t>> &sections);
+  int load_objcache(const std::string &key);
 
  public:
   BPFModule(unsigned flags, TableStorage *ts = nullptr, bool rw_engine_enabled = true,
@@ -159,6 +166,8 @@ class BPFModule {
   std::string id_;
   std::string maps_ns_;
   std::string mod_src_;
+  // key of the on-disk compiled object cache entry, empty when not caching
+  std::string objcache_key_;
   std::map<std::string, std::string> src_dbg_fmap_;
   TableStorage *ts_;
   std::unique_ptr<TableStorage> local_ts_;
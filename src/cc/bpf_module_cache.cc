@@ -0,0 +1,411 @@
+/*
+ * Copyright (c) 2019 Facebook, Inc.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ * http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+#include <errno.h>
+#include <fcntl.h>
+#include <stdio.h>
+#include <string.h>
+#include <sys/stat.h>
+#include <sys/utsname.h>
+#include <unistd.h>
+#include <map>
+#include <string>
+#include <vector>
+
+#include "bpf_module.h"
+#include "cache_file.h"
+#include "common.h"
+#include "frontends/clang/loader.h"
+#include "table_storage.h"
+
+namespace ebpf {
+
+using std::get;
+using std::make_tuple;
+using std::string;
+using std::tuple;
+using std::vector;
+
+// Bump whenever the layout written by store_objcache() changes.
+static const char OBJCACHE_MAGIC[] = "BCCOBJC2";
+
+// Environment variable naming the directory of the compiled object cache.
+// The cache is disabled when it is not set.
+static const char *OBJCACHE_ENV = "BCC_OBJ_CACHE_DIR";
+
+namespace {
+
+void put_str(string &out, const string &s) {
+  cache_put_u64(out, s.size());
+  out.append(s);
+}
+
+void put_bytes(string &out, const uint8_t *p, uint64_t size) {
+  cache_put_u64(out, size);
+  if (p)
+    out.append(reinterpret_cast<const char *>(p), size);
+}
+
+class Reader {
+ public:
+  explicit Reader(const string &buf) : buf_(buf), pos_(0), ok_(true) {}
+
+  uint64_t u64() {
+    uint64_t v = 0;
+    if (pos_ + sizeof(v) > buf_.size()) {
+      ok_ = false;
+      return 0;
+    }
+    memcpy(&v, buf_.data() + pos_, sizeof(v));
+    pos_ += sizeof(v);
+    return v;
+  }
+
+  string str() {
+    uint64_t len = u64();
+    if (!ok_ || len > buf_.size() - pos_) {
+      ok_ = false;
+      return string();
+    }
+    string s = buf_.substr(pos_, len);
+    pos_ += len;
+    return s;
+  }
+
+  bool ok() const { return ok_; }
+
+ private:
+  const string &buf_;
+  size_t pos_;
+  bool ok_;
+};
+
+// Append something that identifies a file's content without reading it. A
+// rebuilt header tree always touches these, so (inode, size, mtime) is enough
+// to notice that the kernel headers changed underneath the cache.
+void put_file_id(string &out, const string &path) {
+  struct stat st;
+  put_str(out, path);
+  if (::stat(path.c_str(), &st) < 0) {
+    cache_put_u64(out, 0);
+    return;
+  }
+  cache_put_u64(out, st.st_ino);
+  cache_put_u64(out, st.st_size);
+  cache_put_u64(out, st.st_mtime);
+}
+
+StatusTuple cached_sscanf(const char *, void *) {
+  return StatusTuple(-1, "sscanf unavailable for cached program");
+}
+StatusTuple cached_snprintf(char *, size_t, const void *) {
+  return StatusTuple(-1, "snprintf unavailable for cached program");
+}
+
+}  // namespace
+
+bool BPFModule::objcache_enabled() const {
+  // Debug output is produced as a side effect of compilation, so a cache hit
+  // would silently swallow it.
+  if (flags_ & (DEBUG_LLVM_IR | DEBUG_PREPROCESSOR | DEBUG_SOURCE))
+    return false;
+  // Programs sharing tables through an external storage depend on state that
+  // is not part of the program text.
+  if (local_ts_ == nullptr)
+    return false;
+  const char *dir = ::getenv(OBJCACHE_ENV);
+  return dir && *dir;
+}
+
+string BPFModule::objcache_key(const string &text, const char *cflags[],
+                               int ncflags) const {
+  string key;
+  struct utsname un;
+
+  uname(&un);
+  put_str(key, OBJCACHE_MAGIC);
+  put_str(key, BCC_REVISION);
+  cache_put_u64(key, flags_);
+  put_str(key, un.release);
+  put_str(key, un.version);
+  put_str(key, un.machine);
+  cache_put_u64(key, get_possible_cpus().size());
+
+  for (auto env : {"BCC_KERNEL_SOURCE", "BCC_LINUX_VERSION_CODE",
+                   "BCC_KERNEL_MODULES_SUFFIX"}) {
+    const char *v = ::getenv(env);
+    put_str(key, v ? v : "");
+  }
+
+  const char *kpath_env = ::getenv("BCC_KERNEL_SOURCE");
+  vector<string> kdirs;
+  if (kpath_env) {
+    kdirs.push_back(kpath_env);
+  } else {
+    string kdir = string(KERNEL_MODULES_DIR) + "/" + un.release;
+    kdirs.push_back(kdir + "/build");
+    kdirs.push_back(kdir + "/source");
+  }
+  for (auto &kdir : kdirs) {
+    put_file_id(key, kdir + "/Makefile");
+    put_file_id(key, kdir + "/include/generated/autoconf.h");
+    put_file_id(key, kdir + "/include/generated/uapi/linux/version.h");
+    put_file_id(key, kdir + "/include/config/kernel.release");
+  }
+
+  cache_put_u64(key, ncflags);
+  for (int i = 0; i < ncflags; ++i)
+    put_str(key, cflags[i] ? cflags[i] : "");
+  put_str(key, text);
+  return key;
+}
+
+string BPFModule::objcache_path(const string &key) const {
+  char name[32];
+  ::snprintf(name, sizeof(name), "/%016llx.o",
+             (unsigned long long)cache_hash(key));
+  return string(::getenv(OBJCACHE_ENV)) + name;
+}
+
+int BPFModule::store_objcache(
+    const string &key,
+    std::map<string, tuple<uint8_t *, uintptr_t>> &sections) {
+  // extern/shared/exported tables live outside this module's table storage
+  for (auto section : sections) {
+    if (section.first == "maps/extern" || section.first == "maps/export" ||
+        section.first == "maps/shared")
+      return -1;
+  }
+
+  string out;
+  put_str(out, OBJCACHE_MAGIC);
+  put_str(out, key);
+
+  cache_put_u64(out, sections.size());
+  for (auto section : sections) {
+    put_str(out, section.first);
+    // map sections only carry the table definitions, which are rebuilt from
+    // fake_fd_map_ on load
+    bool is_map = !strncmp("maps/", section.first.c_str(), 5);
+    cache_put_u64(out, is_map);
+    put_bytes(out, is_map ? nullptr : get<0>(section.second),
+              get<1>(section.second));
+  }
+
+  Path path({id_});
+  vector<const TableDesc *> tables;
+  for (auto it = ts_->lower_bound(path), up = ts_->upper_bound(path); it != up;
+       ++it)
+    tables.push_back(&it->second);
+  cache_put_u64(out, tables.size());
+  for (auto t : tables) {
+    put_str(out, t->name);
+    cache_put_u64(out, t->fake_fd);
+    cache_put_u64(out, t->type);
+    cache_put_u64(out, t->key_size);
+    cache_put_u64(out, t->leaf_size);
+    cache_put_u64(out, t->max_entries);
+    cache_put_u64(out, t->flags);
+    put_str(out, t->key_desc);
+    put_str(out, t->leaf_desc);
+  }
+
+  cache_put_u64(out, fake_fd_map_.size());
+  for (auto map : fake_fd_map_) {
+    cache_put_u64(out, map.first);
+    cache_put_u64(out, get<0>(map.second));
+    put_str(out, get<1>(map.second));
+    cache_put_u64(out, get<2>(map.second));
+    cache_put_u64(out, get<3>(map.second));
+    cache_put_u64(out, get<4>(map.second));
+    cache_put_u64(out, get<5>(map.second));
+    put_str(out, get<6>(map.second));
+  }
+
+  cache_put_u64(out, perf_events_.size());
+  for (auto &event : perf_events_) {
+    put_str(out, event.first);
+    cache_put_u64(out, event.second.size());
+    for (auto &field : event.second)
+      put_str(out, field);
+  }
+
+  vector<string> fns;
+  for (auto section : sections)
+    if (!strncmp(FN_PREFIX.c_str(), section.first.c_str(), FN_PREFIX.size()))
+      fns.push_back(section.first.substr(FN_PREFIX.size()));
+  cache_put_u64(out, fns.size());
+  for (auto &fn : fns) {
+    put_str(out, fn);
+    put_str(out, func_src_->src(fn));
+    put_str(out, func_src_->src_rewritten(fn));
+  }
+
+  put_str(out, mod_src_);
+
+  string dir = ::getenv(OBJCACHE_ENV);
+  if (mkdir(dir.c_str(), 0700) < 0 && errno != EEXIST)
+    return -1;
+
+  return cache_write_file(AT_FDCWD, objcache_path(key), out);
+}
+
+// Returns 0 when the module was restored from the cache, 1 on a cache miss
+// (nothing was modified, the caller should compile) and -1 when the cached
+// object was adopted but could not be loaded.
+int BPFModule::load_objcache(const string &key) {
+  string file = objcache_path(key);
+  FileDesc fd(open(file.c_str(), O_RDONLY | O_CLOEXEC));
+  if (fd < 0)
+    return 1;
+
+  // The cached bytecode is loaded into the kernel as-is, so refuse anything
+  // that another user could have planted or modified.
+  struct stat st;
+  if (fstat(fd, &st) < 0 || !S_ISREG(st.st_mode) || st.st_uid != geteuid() ||
+      (st.st_mode & (S_IWGRP | S_IWOTH)))
+    return 1;
+
+  string buf(st.st_size, '\0');
+  size_t done = 0;
+  while (done < buf.size()) {
+    ssize_t n = read(fd, &buf[done], buf.size() - done);
+    if (n <= 0)
+      return 1;
+    done += n;
+  }
+
+  Reader r(buf);
+  if (r.str() != OBJCACHE_MAGIC || r.str() != key || !r.ok())
+    return 1;
+
+  std::map<string, tuple<uint8_t *, uintptr_t>> sections;
+  auto free_sections = [&sections]() {
+    for (auto section : sections)
+      delete[] get<0>(section.second);
+  };
+  uint64_t nsections = r.u64();
+  for (uint64_t i = 0; i < nsections && r.ok(); ++i) {
+    string name = r.str();
+    bool is_map = r.u64();
+    uint64_t size;
+    uint8_t *data = nullptr;
+    if (is_map) {
+      size = r.u64();
+    } else {
+      string bytes = r.str();
+      size = bytes.size();
+      data = new uint8_t[size];
+      memcpy(data, bytes.data(), size);
+    }
+    sections[name] = make_tuple(data, size);
+  }
+
+  vector<TableDesc> tables;
+  uint64_t ntables = r.u64();
+  for (uint64_t i = 0; i < ntables && r.ok(); ++i) {
+    TableDesc t;
+    t.name = r.str();
+    t.fake_fd = r.u64();
+    t.type = r.u64();
+    t.key_size = r.u64();
+    t.leaf_size = r.u64();
+    t.max_entries = r.u64();
+    t.flags = r.u64();
+    t.key_desc = r.str();
+    t.leaf_desc = r.str();
+    t.key_sscanf = cached_sscanf;
+    t.leaf_sscanf = cached_sscanf;
+    t.key_snprintf = cached_snprintf;
+    t.leaf_snprintf = cached_snprintf;
+    tables.push_back(std::move(t));
+  }
+
+  fake_fd_map_def fake_fd_map;
+  uint64_t nmaps = r.u64();
+  for (uint64_t i = 0; i < nmaps && r.ok(); ++i) {
+    int fake_fd = r.u64();
+    int type = r.u64();
+    string name = r.str();
+    int key_size = r.u64();
+    int leaf_size = r.u64();
+    int max_entries = r.u64();
+    int flags = r.u64();
+    string inner_map_name = r.str();
+    fake_fd_map[fake_fd] = make_tuple(type, name, key_size, leaf_size,
+                                      max_entries, flags, inner_map_name);
+  }
+
+  std::map<string, vector<string>> perf_events;
+  uint64_t nevents = r.u64();
+  for (uint64_t i = 0; i < nevents && r.ok(); ++i) {
+    string name = r.str();
+    uint64_t nfields = r.u64();
+    for (uint64_t j = 0; j < nfields && r.ok(); ++j)
+      perf_events[name].push_back(r.str());
+  }
+
+  vector<tuple<string, string, string>> srcs;
+  uint64_t nfns = r.u64();
+  for (uint64_t i = 0; i < nfns && r.ok(); ++i) {
+    string fn = r.str();
+    string src = r.str();
+    string src_rewritten = r.str();
+    srcs.push_back(make_tuple(fn, src, src_rewritten));
+  }
+
+  string mod_src = r.str();
+  if (!r.ok()) {
+    free_sections();
+    return 1;
+  }
+
+  // Everything was read back fine, adopt it as if it came out of finalize().
+  // The sections are owned by us now, not by an llvm execution engine.
+  rw_engine_enabled_ = false;
+  sections_ = sections;
+  fake_fd_map_ = fake_fd_map;
+  perf_events_ = perf_events;
+  mod_src_ = mod_src;
+  for (auto &s : srcs) {
+    func_src_->set_src(get<0>(s), get<1>(s));
+    func_src_->set_src_rewritten(get<0>(s), get<2>(s));
+  }
+  for (auto &t : tables) {
+    string name = t.name;
+    ts_->Insert(Path({id_, name}), std::move(t));
+  }
+
+  size_t id = 0;
+  Path path({id_});
+  for (auto it = ts_->lower_bound(path), up = ts_->upper_bound(path); it != up;
+       ++it) {
+    TableDesc &table = it->second;
+    tables_.push_back(&it->second);
+    table_names_[table.name] = id++;
+  }
+
+  load_btf(sections_);
+  if (load_maps(sections_))
+    return -1;
+
+  for (auto section : sections_)
+    if (!strncmp(FN_PREFIX.c_str(), section.first.c_str(), FN_PREFIX.size()))
+      function_names_.push_back(section.first);
+
+  return 0;
+}
+
+}  // namespace ebpf
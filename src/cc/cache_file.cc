@@ -0,0 +1,64 @@
+/*
+ * Copyright (c) 2019 Facebook, Inc.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ * http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+#include <fcntl.h>
+#include <stdio.h>
+#include <unistd.h>
+#include <atomic>
+
+#include "cache_file.h"
+#include "file_desc.h"
+
+namespace ebpf {
+
+uint64_t cache_hash(const std::string &s) {
+  uint64_t h = 0xcbf29ce484222325ULL;
+  for (unsigned char c : s) {
+    h ^= c;
+    h *= 0x100000001b3ULL;
+  }
+  return h;
+}
+
+void cache_put_u64(std::string &out, uint64_t v) {
+  out.append(reinterpret_cast<const char *>(&v), sizeof(v));
+}
+
+int cache_write_file(int dirfd, const std::string &name,
+                     const std::string &data) {
+  static std::atomic<unsigned> tmp_seq(0);
+  std::string tmp_name = name + ".tmp." + std::to_string(getpid()) + "." +
+                         std::to_string(tmp_seq++);
+  FileDesc fd(openat(dirfd, tmp_name.c_str(),
+                     O_CREAT | O_EXCL | O_WRONLY | O_CLOEXEC, 0600));
+  if (fd < 0)
+    return -1;
+  size_t done = 0;
+  while (done < data.size()) {
+    ssize_t n = write(fd, data.data() + done, data.size() - done);
+    if (n <= 0) {
+      unlinkat(dirfd, tmp_name.c_str(), 0);
+      return -1;
+    }
+    done += n;
+  }
+  if (renameat(dirfd, tmp_name.c_str(), dirfd, name.c_str()) < 0) {
+    unlinkat(dirfd, tmp_name.c_str(), 0);
+    return -1;
+  }
+  return 0;
+}
+
+}  // namespace ebpf
@@ -0,0 +1,40 @@
+/*
+ * Copyright (c) 2019 Facebook, Inc.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ * http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+#pragma once
+
+#include <stdint.h>
+#include <string>
+
+// Helpers shared by the on-disk caches: the compiled object cache and the
+// symbol index.
+namespace ebpf {
+
+// 64-bit FNV-1a hash, used to name cache files after their key.
+uint64_t cache_hash(const std::string &s);
+
+// Append v to out in host byte order.
+void cache_put_u64(std::string &out, uint64_t v);
+
+// Write data to name, relative to dirfd (or AT_FDCWD), through a temporary
+// file renamed over it, so that concurrent readers never observe a partially
+// written file. The temporary name is unique per call, as several threads of
+// one process can store the same entry at once. Returns 0 on success and -1
+// on error.
+int cache_write_file(int dirfd, const std::string &name,
+                     const std::string &data);
+
+}  // namespace ebpf
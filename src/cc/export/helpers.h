@@ -163,6 +163,12 @@ struct _name##_table_t _name = { .max_entries = (_max_entries) }
 #define BPF_HASH(...) \
   BPF_HASHX(__VA_ARGS__, BPF_HASH4, BPF_HASH3, BPF_HASH2, BPF_HASH1)(__VA_ARGS__)
 
+// Count the entries of the hash table _table in the per-cpu array
+// _table__count, kept up to date by the insert(), update(), delete(),
+// increment() and lookup_or_init() methods of _table
+#define BPF_TABLE_COUNTER(_table) \
+  BPF_TABLE("percpu_array", int, s64, _table##__count, 1)
+
 #define BPF_ARRAY1(_name) \
   BPF_TABLE("array", int, u64, _name, 10240)
 #define BPF_ARRAY2(_name, _leaf_type) \
@@ -257,6 +263,40 @@ struct _name##_table_t _name = { .max_entries = (_max_entries) }
 #define BPF_CPUMAP(_name, _max_entries) \
   BPF_XDP_REDIRECT_MAP("cpumap", u32, _name, _max_entries)
 
+// Maps of maps, the inner map being a table declared before, as a string.
+// From BPF programs, lookup() returns the inner map stored at a key, to be
+// passed to bpf_map_lookup_elem() and friends.
+#define BPF_ARRAY_OF_MAPS(_name, _inner_map_name, _max_entries) \
+  BPF_TABLE("array_of_maps$" _inner_map_name, int, int, _name, _max_entries)
+
+#define BPF_HASH_OF_MAPS(_name, _inner_map_name, _max_entries) \
+  BPF_TABLE("hash_of_maps$" _inner_map_name, int, int, _name, _max_entries)
+
+// Two tables _name_0 and _name_1, and a map of maps _name holding the one BPF
+// programs update, the other one being read and cleared by user space:
+//   int zero = 0;
+//   void *active = _name.lookup(&zero);
+//   if (active)
+//     bpf_map_increment(active, &key, 1);
+// See SwappableTable in the Python API.
+#define BPF_SWAPPABLE_TABLE(_table_type, _key_type, _leaf_type, _name, _max_entries) \
+BPF_TABLE(_table_type, _key_type, _leaf_type, _name##_0, _max_entries); \
+BPF_TABLE(_table_type, _key_type, _leaf_type, _name##_1, _max_entries); \
+BPF_ARRAY_OF_MAPS(_name, #_name "_0", 1)
+
+#define BPF_SWAPPABLE_HIST1(_name) \
+  BPF_SWAPPABLE_TABLE("histogram", int, u64, _name, 64)
+#define BPF_SWAPPABLE_HIST2(_name, _key_type) \
+  BPF_SWAPPABLE_TABLE("histogram", _key_type, u64, _name, 64)
+#define BPF_SWAPPABLE_HIST3(_name, _key_type, _size) \
+  BPF_SWAPPABLE_TABLE("histogram", _key_type, u64, _name, _size)
+
+// Define a swappable histogram, some arguments optional
+// BPF_SWAPPABLE_HISTOGRAM(name, key_type=int, size=64)
+#define BPF_SWAPPABLE_HISTOGRAM(...) \
+  BPF_HISTX(__VA_ARGS__, BPF_SWAPPABLE_HIST3, BPF_SWAPPABLE_HIST2, \
+            BPF_SWAPPABLE_HIST1)(__VA_ARGS__)
+
 // packet parsing state machine helpers
 #define cursor_advance(_cursor, _len) \
   ({ void *_tmp = _cursor; _cursor += _len; _tmp; })
@@ -805,6 +845,21 @@ int bpf_usdt_readarg_p(int argc, struct pt_regs *ctx, void *buf, u64 len) asm("l
 
 #define lock_xadd(ptr, val) ((void)__sync_fetch_and_add(ptr, val))
 
+// Add increment to the u64 value of key in map, e.g. the active table of a
+// BPF_SWAPPABLE_TABLE(), inserting it first in hash maps
+static inline __attribute__((always_inline))
+void bpf_map_increment(void *map, void *key, u64 increment) {
+  u64 *leaf = bpf_map_lookup_elem(map, key);
+  if (!leaf) {
+    u64 zero = 0;
+    bpf_map_update_elem(map, key, &zero, BPF_NOEXIST);
+    leaf = bpf_map_lookup_elem(map, key);
+    if (!leaf)
+      return;
+  }
+  lock_xadd(leaf, increment);
+}
+
 #define TRACEPOINT_PROBE(category, event) \
 int tracepoint__##category##__##event(struct tracepoint__##category##__##event *args)
 
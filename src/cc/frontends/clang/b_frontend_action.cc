@@ -767,6 +767,28 @@ bool BTypeVisitor::VisitCallExpr(CallExpr *Call) {
           }
         }
         string fd = to_string(desc->second.fd >= 0 ? desc->second.fd : desc->second.fake_fd);
+
+        // BPF_TABLE_COUNTER(table) declares table__count, which the methods
+        // adding or removing entries update
+        string count_fd;
+        string count_name = Ref->getDecl()->getName();
+        count_name += "__count";
+        TableStorage::iterator count_desc;
+        if (fe_.table_storage().Find(Path({fe_.id(), count_name}), count_desc) ||
+            fe_.table_storage().Find(Path({count_name}), count_desc)) {
+          if (desc->second.type != BPF_MAP_TYPE_HASH &&
+              desc->second.type != BPF_MAP_TYPE_PERCPU_HASH) {
+            error(GET_BEGINLOC(Call), "BPF_TABLE_COUNTER only supports hash tables");
+            return false;
+          }
+          count_fd = to_string(count_desc->second.fd >= 0 ? count_desc->second.fd
+                                                          : count_desc->second.fake_fd);
+        }
+        auto count_add = [&count_fd](const string &delta) {
+          return "{ int _czero = 0; s64 *_cnt = bpf_map_lookup_elem_(bpf_pseudo_fd(1, " +
+                 count_fd + "), &_czero); if (_cnt) *_cnt += " + delta + "; }";
+        };
+
         string prefix, suffix;
         string txt;
         auto rewrite_start = GET_BEGINLOC(Call);
@@ -779,7 +801,10 @@ bool BTypeVisitor::VisitCallExpr(CallExpr *Call) {
           string update = "bpf_map_update_elem_(bpf_pseudo_fd(1, " + fd + ")";
           txt  = "({typeof(" + name + ".leaf) *leaf = " + lookup + ", " + arg0 + "); ";
           txt += "if (!leaf) {";
-          txt += " " + update + ", " + arg0 + ", " + arg1 + ", BPF_NOEXIST);";
+          if (count_fd.empty())
+            txt += " " + update + ", " + arg0 + ", " + arg1 + ", BPF_NOEXIST);";
+          else
+            txt += " if (!" + update + ", " + arg0 + ", " + arg1 + ", BPF_NOEXIST)) " + count_add("1");
           txt += " leaf = " + lookup + ", " + arg0 + ");";
           txt += " if (!leaf) return 0;";
           txt += "}";
@@ -803,7 +828,10 @@ bool BTypeVisitor::VisitCallExpr(CallExpr *Call) {
           if (desc->second.type == BPF_MAP_TYPE_HASH) {
             txt += "else { typeof(" + name + ".leaf) _zleaf; __builtin_memset(&_zleaf, 0, sizeof(_zleaf)); ";
             txt += "_zleaf += " + increment_value + ";";
-            txt += update + ", &_key, &_zleaf, BPF_NOEXIST); } ";
+            if (count_fd.empty())
+              txt += update + ", &_key, &_zleaf, BPF_NOEXIST); } ";
+            else
+              txt += "if (!" + update + ", &_key, &_zleaf, BPF_NOEXIST)) " + count_add("1") + " } ";
           }
           txt += "})";
         } else if (memb_name == "perf_submit") {
@@ -890,6 +918,21 @@ bool BTypeVisitor::VisitCallExpr(CallExpr *Call) {
           prefix += "((void *)bpf_pseudo_fd(1, " + fd + "), ";
 
           txt = prefix + args + suffix;
+          if (!count_fd.empty() && memb_name == "update") {
+            // only count the entry when it did not exist yet
+            string arg0 = rewriter_.getRewrittenText(expansionRange(Call->getArg(0)->getSourceRange()));
+            string arg1 = rewriter_.getRewrittenText(expansionRange(Call->getArg(1)->getSourceRange()));
+            txt  = "({ void *_ckey = (void *)(" + arg0 + "); ";
+            txt += "void *_cleaf = (void *)(" + arg1 + "); ";
+            txt += "int _ret = " + prefix + "_ckey, _cleaf, BPF_NOEXIST); ";
+            txt += "if (!_ret) " + count_add("1");
+            txt += " else _ret = " + prefix + "_ckey, _cleaf, BPF_ANY); ";
+            txt += "_ret; })";
+          } else if (!count_fd.empty() && (memb_name == "insert" || memb_name == "delete")) {
+            txt = "({ int _ret = " + txt + "; ";
+            txt += "if (!_ret) " + count_add(memb_name == "insert" ? "1" : "-1");
+            txt += " _ret; })";
+          }
         }
         if (!rewriter_.isRewritable(rewrite_start) || !rewriter_.isRewritable(rewrite_end)) {
           error(GET_BEGINLOC(Call), "cannot use map function inside a macro");
@@ -1168,6 +1211,10 @@ bool BTypeVisitor::VisitVarDecl(VarDecl *Decl) {
       ++i;
     }
 
+    // map-in-map sections name their inner map: maps/array_of_maps$inner
+    StringRef section_attr, inner_map_name;
+    std::tie(section_attr, inner_map_name) = A->getName().split('$');
+
     bpf_map_type map_type = BPF_MAP_TYPE_UNSPEC;
     if (A->getName() == "maps/hash") {
       map_type = BPF_MAP_TYPE_HASH;
@@ -1207,6 +1254,21 @@ bool BTypeVisitor::VisitVarDecl(VarDecl *Decl) {
       map_type = BPF_MAP_TYPE_DEVMAP;
     } else if (A->getName() == "maps/cpumap") {
       map_type = BPF_MAP_TYPE_CPUMAP;
+    } else if (section_attr == "maps/array_of_maps" ||
+               section_attr == "maps/hash_of_maps") {
+      map_type = section_attr == "maps/array_of_maps" ?
+                 BPF_MAP_TYPE_ARRAY_OF_MAPS : BPF_MAP_TYPE_HASH_OF_MAPS;
+      // the inner map is created first and gives the kernel the type of
+      // the maps that can be stored
+      TableStorage::iterator inner_it;
+      if (inner_map_name.empty() ||
+          !fe_.table_storage().Find(Path({fe_.id(), inner_map_name.str()}),
+                                    inner_it)) {
+        error(GET_BEGINLOC(Decl),
+              "inner map %0 of %1 must be a table declared before it")
+            << inner_map_name << table.name;
+        return false;
+      }
     } else if (A->getName() == "maps/extern") {
       if (!fe_.table_storage().Find(maps_ns_path, table_it)) {
         if (!fe_.table_storage().Find(global_path, table_it)) {
@@ -1250,7 +1312,8 @@ bool BTypeVisitor::VisitVarDecl(VarDecl *Decl) {
       table.fake_fd = fe_.get_next_fake_fd();
       fe_.add_map_def(table.fake_fd, std::make_tuple((int)map_type, std::string(table.name),
                       (int)table.key_size, (int)table.leaf_size,
-                      (int)table.max_entries, table.flags));
+                      (int)table.max_entries, table.flags,
+                      inner_map_name.str()));
     }
 
     if (!table.is_extern)
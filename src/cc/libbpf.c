@@ -319,6 +319,66 @@ int bpf_get_next_key(int fd, void *key, void *next_key)
   return bpf_map_get_next_key(fd, key, next_key);
 }
 
+// The BPF_MAP_*_BATCH commands (5.6+) are newer than the uapi headers we may be
+// built against, so issue them through our own copy of the attr layout.
+enum {
+  BCC_BPF_MAP_LOOKUP_BATCH = 24,
+  BCC_BPF_MAP_LOOKUP_AND_DELETE_BATCH = 25,
+  BCC_BPF_MAP_DELETE_BATCH = 27,
+};
+
+struct bcc_map_batch_attr {
+  uint64_t in_batch;
+  uint64_t out_batch;
+  uint64_t keys;
+  uint64_t values;
+  uint32_t count;
+  uint32_t map_fd;
+  uint64_t elem_flags;
+  uint64_t flags;
+};
+
+static int bpf_map_batch_common(int cmd, int fd, void *in_batch,
+                                void *out_batch, void *keys, void *values,
+                                uint32_t *count)
+{
+  struct bcc_map_batch_attr attr = {};
+  int ret;
+
+  attr.map_fd = fd;
+  attr.in_batch = ptr_to_u64(in_batch);
+  attr.out_batch = ptr_to_u64(out_batch);
+  attr.keys = ptr_to_u64(keys);
+  attr.values = ptr_to_u64(values);
+  attr.count = *count;
+
+  ret = syscall(__NR_bpf, cmd, &attr, sizeof(attr));
+  // the kernel reports how many elements were processed even on failure,
+  // e.g. with ENOENT once the end of the map is reached
+  *count = attr.count;
+  return ret;
+}
+
+int bpf_lookup_batch(int fd, void *in_batch, void *out_batch, void *keys,
+                     void *values, uint32_t *count)
+{
+  return bpf_map_batch_common(BCC_BPF_MAP_LOOKUP_BATCH, fd, in_batch,
+                              out_batch, keys, values, count);
+}
+
+int bpf_lookup_and_delete_batch(int fd, void *in_batch, void *out_batch,
+                                void *keys, void *values, uint32_t *count)
+{
+  return bpf_map_batch_common(BCC_BPF_MAP_LOOKUP_AND_DELETE_BATCH, fd,
+                              in_batch, out_batch, keys, values, count);
+}
+
+int bpf_delete_batch(int fd, void *keys, uint32_t *count)
+{
+  return bpf_map_batch_common(BCC_BPF_MAP_DELETE_BATCH, fd, NULL, NULL, keys,
+                              NULL, count);
+}
+
 static void bpf_print_hints(int ret, char *log)
 {
   if (ret < 0)
@@ -1148,6 +1208,20 @@ int bpf_attach_raw_tracepoint(int progfd, char *tp_name)
 void * bpf_open_perf_buffer(perf_reader_raw_cb raw_cb,
                             perf_reader_lost_cb lost_cb, void *cb_cookie,
                             int pid, int cpu, int page_cnt) {
+  struct bcc_perf_buffer_opts opts = {
+    .pid = pid,
+    .cpu = cpu,
+    .wakeup_events = 1,
+  };
+
+  return bpf_open_perf_buffer_opts(raw_cb, lost_cb, cb_cookie, page_cnt,
+                                   &opts);
+}
+
+void * bpf_open_perf_buffer_opts(perf_reader_raw_cb raw_cb,
+                                 perf_reader_lost_cb lost_cb, void *cb_cookie,
+                                 int page_cnt,
+                                 struct bcc_perf_buffer_opts *opts) {
   int pfd;
   struct perf_event_attr attr = {};
   struct perf_reader *reader = NULL;
@@ -1160,8 +1234,15 @@ void * bpf_open_perf_buffer(perf_reader_raw_cb raw_cb,
   attr.type = PERF_TYPE_SOFTWARE;
   attr.sample_type = PERF_SAMPLE_RAW;
   attr.sample_period = 1;
-  attr.wakeup_events = 1;
-  pfd = syscall(__NR_perf_event_open, &attr, pid, cpu, -1, PERF_FLAG_FD_CLOEXEC);
+  if (opts->wakeup_bytes > 0) {
+    // wake up once this many bytes are pending in the ring
+    attr.watermark = 1;
+    attr.wakeup_watermark = opts->wakeup_bytes;
+  } else {
+    attr.wakeup_events = opts->wakeup_events > 0 ? opts->wakeup_events : 1;
+  }
+  pfd = syscall(__NR_perf_event_open, &attr, opts->pid, opts->cpu, -1,
+                PERF_FLAG_FD_CLOEXEC);
   if (pfd < 0) {
     fprintf(stderr, "perf_event_open: %s\n", strerror(errno));
     fprintf(stderr, "   (check your kernel for PERF_COUNT_SW_BPF_OUTPUT support, 4.4 or newer)\n");
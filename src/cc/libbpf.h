@@ -45,6 +45,22 @@ int bpf_delete_elem(int fd, void *key);
 int bpf_get_first_key(int fd, void *key, size_t key_size);
 int bpf_get_next_key(int fd, void *key, void *next_key);
 
+/*
+ * Batched map operations, available on 5.6 and newer kernels.
+ *
+ * in_batch/out_batch are opaque cursors of the map's batch cursor size (u32
+ * for hash and array maps). Pass NULL as in_batch to start from the beginning
+ * and feed out_batch back as in_batch to continue. On entry *count is the
+ * capacity of keys/values in elements, on return it holds the number of
+ * elements processed. Once the whole map has been walked the call fails with
+ * errno ENOENT, still reporting the elements of the last batch in *count.
+ */
+int bpf_lookup_batch(int fd, void *in_batch, void *out_batch, void *keys,
+                     void *values, uint32_t *count);
+int bpf_lookup_and_delete_batch(int fd, void *in_batch, void *out_batch,
+                                void *keys, void *values, uint32_t *count);
+int bpf_delete_batch(int fd, void *keys, uint32_t *count);
+
 /*
  * Load a BPF program, and return the FD of the loaded program.
  *
@@ -77,6 +93,12 @@ int bpf_open_raw_sock(const char *name);
 
 typedef void (*perf_reader_raw_cb)(void *cb_cookie, void *raw, int raw_size);
 typedef void (*perf_reader_lost_cb)(void *cb_cookie, uint64_t lost);
+/*
+ * Called once per ring drain in batch mode. The raw data of count samples is
+ * packed back to back in buf, sample i spans [index[i], index[i + 1]).
+ */
+typedef void (*perf_reader_batch_cb)(void *cb_cookie, void *buf,
+                                     uint32_t *index, int count);
 
 int bpf_attach_kprobe(int progfd, enum bpf_probe_attach_type attach_type,
                       const char *ev_name, const char *fn_name, uint64_t fn_offset);
@@ -97,6 +119,20 @@ void * bpf_open_perf_buffer(perf_reader_raw_cb raw_cb,
                             perf_reader_lost_cb lost_cb, void *cb_cookie,
                             int pid, int cpu, int page_cnt);
 
+struct bcc_perf_buffer_opts {
+  int pid;
+  int cpu;
+  // wake up the reader every wakeup_events samples, or once wakeup_bytes
+  // bytes are pending when wakeup_bytes is non zero
+  int wakeup_events;
+  int wakeup_bytes;
+};
+
+void * bpf_open_perf_buffer_opts(perf_reader_raw_cb raw_cb,
+                                 perf_reader_lost_cb lost_cb, void *cb_cookie,
+                                 int page_cnt,
+                                 struct bcc_perf_buffer_opts *opts);
+
 /* attached a prog expressed by progfd to the device specified in dev_name */
 int bpf_attach_xdp(const char *dev_name, int progfd, uint32_t flags);
 
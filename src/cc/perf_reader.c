@@ -21,6 +21,8 @@
 #include <stdlib.h>
 #include <string.h>
 #include <syscall.h>
+#include <time.h>
+#include <sys/epoll.h>
 #include <sys/ioctl.h>
 #include <sys/mman.h>
 #include <sys/types.h>
@@ -39,9 +41,18 @@ enum {
 struct perf_reader {
   perf_reader_raw_cb raw_cb;
   perf_reader_lost_cb lost_cb;
+  perf_reader_batch_cb batch_cb;
   void *cb_cookie; // to be returned in the cb
   void *buf; // for keeping segmented data
   size_t buf_size;
+  // batch mode: samples of the current drain and their start offsets
+  uint8_t *batch_buf;
+  size_t batch_buf_size;
+  size_t batch_len;
+  uint32_t *batch_index;
+  int batch_index_size;
+  int batch_cnt;
+  struct perf_reader_stats stats;
   void *base;
   int rb_use_state;
   pid_t rb_read_tid;
@@ -80,6 +91,8 @@ void perf_reader_free(void *ptr) {
       close(reader->fd);
     }
     free(reader->buf);
+    free(reader->batch_buf);
+    free(reader->batch_index);
     free(ptr);
   }
 }
@@ -98,6 +111,18 @@ int perf_reader_mmap(struct perf_reader *reader) {
     return -1;
   }
 
+  // A record can never be larger than the ring, so a ring sized buffer for
+  // the records that wrap around its end is allocated once here instead of
+  // being realloc'ed on every wrap. perf only maps the ring at page offset 0,
+  // header page included, so the data pages cannot be mapped a second time
+  // right after the first copy to make wrapping records contiguous.
+  reader->buf_size = (size_t)reader->page_size * reader->page_cnt;
+  reader->buf = malloc(reader->buf_size);
+  if (!reader->buf) {
+    fprintf(stderr, "%s: out of memory\n", __FUNCTION__);
+    return -1;
+  }
+
   return 0;
 }
 
@@ -113,6 +138,106 @@ struct perf_sample_trace_kprobe {
   uint64_t ip;
 };
 
+static uint64_t monotonic_ns(void) {
+  struct timespec ts;
+  clock_gettime(CLOCK_MONOTONIC, &ts);
+  return (uint64_t)ts.tv_sec * 1000000000 + ts.tv_nsec;
+}
+
+static void batch_flush(struct perf_reader *reader) {
+  uint64_t start;
+
+  if (reader->batch_cnt == 0)
+    return;
+  reader->batch_index[reader->batch_cnt] = reader->batch_len;
+  reader->stats.events += reader->batch_cnt;
+  reader->stats.bytes += reader->batch_len;
+  start = monotonic_ns();
+  reader->batch_cb(reader->cb_cookie, reader->batch_buf, reader->batch_index,
+                   reader->batch_cnt);
+  reader->stats.callback_ns += monotonic_ns() - start;
+  reader->batch_cnt = 0;
+  reader->batch_len = 0;
+}
+
+// Append a sample of the given size to the batch, returning where its data
+// must be written, or NULL if out of memory.
+static uint8_t * batch_reserve(struct perf_reader *reader, uint32_t size) {
+  uint8_t *ptr;
+
+  // keep one spare slot in the index for the end offset
+  if (reader->batch_cnt + 1 >= reader->batch_index_size) {
+    int cnt = reader->batch_index_size ? reader->batch_index_size * 2 : 256;
+    uint32_t *index = realloc(reader->batch_index, cnt * sizeof(*index));
+    if (!index) {
+      fprintf(stderr, "%s: out of memory, dropping sample\n", __FUNCTION__);
+      return NULL;
+    }
+    reader->batch_index = index;
+    reader->batch_index_size = cnt;
+  }
+  if (reader->batch_len + size > reader->batch_buf_size) {
+    size_t len = reader->batch_buf_size ? reader->batch_buf_size : 4096;
+    while (len < reader->batch_len + size)
+      len *= 2;
+    uint8_t *buf = realloc(reader->batch_buf, len);
+    if (!buf) {
+      fprintf(stderr, "%s: out of memory, dropping sample\n", __FUNCTION__);
+      return NULL;
+    }
+    reader->batch_buf = buf;
+    reader->batch_buf_size = len;
+  }
+  ptr = reader->batch_buf + reader->batch_len;
+  reader->batch_index[reader->batch_cnt++] = reader->batch_len;
+  reader->batch_len += size;
+  return ptr;
+}
+
+static void batch_add(struct perf_reader *reader, void *data, uint32_t size) {
+  uint8_t *ptr = batch_reserve(reader, size);
+  if (ptr)
+    memcpy(ptr, data, size);
+}
+
+// Copy len bytes starting at offset off of the ring data area, wrapping
+// around its end.
+static void ring_copy(void *dst, uint8_t *base, uint64_t buffer_size,
+                      uint64_t off, size_t len) {
+  size_t first = buffer_size - off;
+
+  if (first >= len) {
+    memcpy(dst, base + off, len);
+  } else {
+    memcpy(dst, base + off, first);
+    memcpy((uint8_t *)dst + first, base, len - first);
+  }
+}
+
+// Batch mode: a sample record that wraps around the ring is copied from the
+// two ring segments straight into the batch buffer, instead of first being
+// made contiguous in reader->buf.
+static int batch_add_wrapped(struct perf_reader *reader, uint8_t *base,
+                             uint64_t buffer_size, uint64_t off,
+                             uint32_t size) {
+  uint32_t raw_size;
+  uint8_t *ptr;
+
+  // records are 8 byte aligned and the ring is a multiple of pages, so the
+  // u32 raw size that follows the 8 byte header never straddles the end
+  raw_size = *(uint32_t *)(base + (off + sizeof(struct perf_event_header)) %
+                           buffer_size);
+  if (sizeof(struct perf_event_header) + sizeof(raw_size) + raw_size > size)
+    return -1;
+  ptr = batch_reserve(reader, raw_size);
+  if (ptr)
+    ring_copy(ptr, base, buffer_size,
+              (off + sizeof(struct perf_event_header) + sizeof(raw_size)) %
+                  buffer_size,
+              raw_size);
+  return 0;
+}
+
 static void parse_sw(struct perf_reader *reader, void *data, int size) {
   uint8_t *ptr = data;
   struct perf_event_header *header = (void *)data;
@@ -141,8 +266,15 @@ static void parse_sw(struct perf_reader *reader, void *data, int size) {
     return;
   }
 
-  if (reader->raw_cb)
+  if (reader->batch_cb) {
+    batch_add(reader, raw->data, raw->size);
+  } else if (reader->raw_cb) {
+    uint64_t start = monotonic_ns();
     reader->raw_cb(reader->cb_cookie, raw->data, raw->size);
+    reader->stats.callback_ns += monotonic_ns() - start;
+    reader->stats.events++;
+    reader->stats.bytes += raw->size;
+  }
 }
 
 static uint64_t read_data_head(volatile struct perf_event_mmap_page *perf_header) {
@@ -176,17 +308,35 @@ void perf_reader_event_read(struct perf_reader *reader) {
     uint64_t data_tail = perf_header->data_tail;
     uint8_t *ptr;
 
+    if (data_head - data_tail > reader->stats.max_occupancy)
+      reader->stats.max_occupancy = data_head - data_tail;
+
     begin = base + data_tail % buffer_size;
     // event header is u64, won't wrap
     struct perf_event_header *e = (void *)begin;
     ptr = begin;
-    end = base + (data_tail + e->size) % buffer_size;
-    if (end < begin) {
-      // perf event wraps around the ring, make a contiguous copy
-      reader->buf = realloc(reader->buf, e->size);
-      size_t len = sentinel - begin;
-      memcpy(reader->buf, begin, len);
-      memcpy((void *)((unsigned long)reader->buf + len), base, e->size - len);
+    end = begin + e->size;
+    if (end > sentinel) {
+      // perf event wraps around the ring, batched samples are copied in two
+      // parts straight into the batch buffer
+      if (reader->batch_cb && e->type == PERF_RECORD_SAMPLE &&
+          batch_add_wrapped(reader, base, buffer_size,
+                            data_tail % buffer_size, e->size) == 0)
+        goto consumed;
+      // make a contiguous copy
+      if (e->size > reader->buf_size) {
+        void *buf = realloc(reader->buf, e->size);
+        if (!buf) {
+          fprintf(stderr, "%s: out of memory, dropping record\n",
+                  __FUNCTION__);
+          write_data_tail(perf_header, perf_header->data_tail + e->size);
+          continue;
+        }
+        reader->buf = buf;
+        reader->buf_size = e->size;
+      }
+      ring_copy(reader->buf, base, buffer_size, data_tail % buffer_size,
+                e->size);
       ptr = reader->buf;
     }
 
@@ -200,8 +350,15 @@ void perf_reader_event_read(struct perf_reader *reader) {
        * };
        */
       uint64_t lost = *(uint64_t *)(ptr + sizeof(*e) + sizeof(uint64_t));
+      // deliver the samples preceding the loss first to keep them in order
+      if (reader->batch_cb)
+        batch_flush(reader);
+      reader->stats.lost += lost;
+      reader->stats.lost_records++;
       if (reader->lost_cb) {
+        uint64_t start = monotonic_ns();
         reader->lost_cb(reader->cb_cookie, lost);
+        reader->stats.callback_ns += monotonic_ns() - start;
       } else {
         fprintf(stderr, "Possibly lost %" PRIu64 " samples\n", lost);
       }
@@ -211,8 +368,16 @@ void perf_reader_event_read(struct perf_reader *reader) {
       fprintf(stderr, "%s: unknown sample type %d\n", __FUNCTION__, e->type);
     }
 
+consumed:
     write_data_tail(perf_header, perf_header->data_tail + e->size);
+
+    // bound the batch to one ring's worth of data when the producer keeps up
+    // with us, so a drain cannot grow without limit
+    if (reader->batch_cb && reader->batch_len >= buffer_size)
+      batch_flush(reader);
   }
+  if (reader->batch_cb)
+    batch_flush(reader);
   reader->rb_use_state = RB_NOT_USED;
   __sync_synchronize();
   reader->rb_read_tid = 0;
@@ -236,6 +401,157 @@ int perf_reader_poll(int num_readers, struct perf_reader **readers, int timeout)
   return 0;
 }
 
+struct perf_reader_epoll {
+  int epfd;
+  int num_readers;
+  // ready list for epoll_wait, sized to the number of readers
+  struct epoll_event *events;
+  int events_size;
+  // all readers, swept every flush_ms for rings below their wakeup watermark
+  struct perf_reader **readers;
+  int flush_ms;
+  uint64_t last_flush_ms;
+};
+
+static uint64_t monotonic_ms(void) {
+  struct timespec ts;
+  clock_gettime(CLOCK_MONOTONIC, &ts);
+  return (uint64_t)ts.tv_sec * 1000 + ts.tv_nsec / 1000000;
+}
+
+struct perf_reader_epoll * perf_reader_epoll_new(void) {
+  struct perf_reader_epoll *ep = calloc(1, sizeof(struct perf_reader_epoll));
+  if (!ep)
+    return NULL;
+  ep->events_size = 16;
+  ep->events = calloc(ep->events_size, sizeof(*ep->events));
+  ep->readers = calloc(ep->events_size, sizeof(*ep->readers));
+  if (!ep->events || !ep->readers) {
+    free(ep->events);
+    free(ep->readers);
+    free(ep);
+    return NULL;
+  }
+  ep->epfd = epoll_create1(EPOLL_CLOEXEC);
+  if (ep->epfd < 0) {
+    perror("epoll_create1");
+    free(ep->events);
+    free(ep->readers);
+    free(ep);
+    return NULL;
+  }
+  return ep;
+}
+
+void perf_reader_epoll_free(struct perf_reader_epoll *ep) {
+  if (ep) {
+    close(ep->epfd);
+    free(ep->events);
+    free(ep->readers);
+    free(ep);
+  }
+}
+
+int perf_reader_epoll_add(struct perf_reader_epoll *ep,
+                          struct perf_reader *reader) {
+  struct epoll_event event = {};
+
+  if (ep->num_readers + 1 > ep->events_size) {
+    int size = ep->events_size * 2;
+    struct epoll_event *events = realloc(ep->events, size * sizeof(*events));
+    if (!events)
+      return -1;
+    ep->events = events;
+    struct perf_reader **readers = realloc(ep->readers,
+                                           size * sizeof(*readers));
+    if (!readers)
+      return -1;
+    ep->readers = readers;
+    ep->events_size = size;
+  }
+
+  event.events = EPOLLIN;
+  event.data.ptr = reader;
+  if (epoll_ctl(ep->epfd, EPOLL_CTL_ADD, reader->fd, &event) < 0) {
+    perror("epoll_ctl(EPOLL_CTL_ADD)");
+    return -1;
+  }
+  ep->readers[ep->num_readers++] = reader;
+  return 0;
+}
+
+int perf_reader_epoll_remove(struct perf_reader_epoll *ep,
+                             struct perf_reader *reader) {
+  int i;
+
+  if (epoll_ctl(ep->epfd, EPOLL_CTL_DEL, reader->fd, NULL) < 0) {
+    perror("epoll_ctl(EPOLL_CTL_DEL)");
+    return -1;
+  }
+  for (i = 0; i < ep->num_readers; i++) {
+    if (ep->readers[i] == reader) {
+      ep->readers[i] = ep->readers[--ep->num_readers];
+      break;
+    }
+  }
+  return 0;
+}
+
+void perf_reader_epoll_set_flush(struct perf_reader_epoll *ep, int flush_ms) {
+  ep->flush_ms = flush_ms;
+  ep->last_flush_ms = monotonic_ms();
+}
+
+int perf_reader_epoll_poll(struct perf_reader_epoll *ep, int timeout) {
+  int i, cnt, wait = timeout;
+  uint64_t now;
+
+  if (ep->flush_ms > 0) {
+    // don't sleep past the next flush
+    now = monotonic_ms();
+    int64_t left = (int64_t)(ep->last_flush_ms + ep->flush_ms - now);
+    if (left < 0)
+      left = 0;
+    if (wait < 0 || wait > left)
+      wait = left;
+  }
+
+  // only the readers on the ready list are visited
+  cnt = epoll_wait(ep->epfd, ep->events, ep->events_size, wait);
+  for (i = 0; i < cnt; i++)
+    perf_reader_event_read(ep->events[i].data.ptr);
+
+  if (ep->flush_ms > 0) {
+    now = monotonic_ms();
+    if (now >= ep->last_flush_ms + ep->flush_ms) {
+      // rings that have not reached their wakeup watermark yet never show
+      // up on the ready list, drain everything to bound their latency
+      for (i = 0; i < ep->num_readers; i++)
+        perf_reader_event_read(ep->readers[i]);
+      ep->last_flush_ms = now;
+    }
+  }
+  return cnt;
+}
+
+int perf_reader_epoll_fd(struct perf_reader_epoll *ep) {
+  return ep->epfd;
+}
+
+void perf_reader_set_batch_cb(struct perf_reader *reader,
+                              perf_reader_batch_cb batch_cb) {
+  reader->batch_cb = batch_cb;
+}
+
+void perf_reader_get_stats(struct perf_reader *reader,
+                          struct perf_reader_stats *stats) {
+  *stats = reader->stats;
+}
+
+void perf_reader_reset_stats(struct perf_reader *reader) {
+  memset(&reader->stats, 0, sizeof(reader->stats));
+}
+
 void perf_reader_set_fd(struct perf_reader *reader, int fd) {
   reader->fd = fd;
 }
@@ -24,6 +24,23 @@ extern "C" {
 #endif
 
 struct perf_reader;
+struct perf_reader_epoll;
+
+/*
+ * Counters maintained by a reader since it was opened or its stats were last
+ * reset. lost is the number of samples the kernel reported as dropped, in
+ * lost_records PERF_RECORD_LOST records. max_occupancy is the largest number
+ * of bytes seen pending in the ring (data_head - data_tail) while draining
+ * it, callback_ns the time spent in the raw, batch and lost callbacks.
+ */
+struct perf_reader_stats {
+  uint64_t events;
+  uint64_t bytes;
+  uint64_t lost;
+  uint64_t lost_records;
+  uint64_t max_occupancy;
+  uint64_t callback_ns;
+};
 
 struct perf_reader * perf_reader_new(perf_reader_raw_cb raw_cb,
                                      perf_reader_lost_cb lost_cb,
@@ -33,7 +50,33 @@ int perf_reader_mmap(struct perf_reader *reader);
 void perf_reader_event_read(struct perf_reader *reader);
 int perf_reader_poll(int num_readers, struct perf_reader **readers, int timeout);
 int perf_reader_fd(struct perf_reader *reader);
+
+/*
+ * A persistent epoll set of readers. Readers are added and removed
+ * incrementally and perf_reader_epoll_poll() only drains the rings that are
+ * ready, so its cost does not depend on the total number of readers.
+ * Returns the number of rings drained, or -1 on error.
+ */
+struct perf_reader_epoll * perf_reader_epoll_new(void);
+void perf_reader_epoll_free(struct perf_reader_epoll *ep);
+int perf_reader_epoll_add(struct perf_reader_epoll *ep,
+                          struct perf_reader *reader);
+int perf_reader_epoll_remove(struct perf_reader_epoll *ep,
+                             struct perf_reader *reader);
+int perf_reader_epoll_poll(struct perf_reader_epoll *ep, int timeout);
+/*
+ * Drain every reader at least each flush_ms milliseconds, so that rings
+ * opened with a wakeup watermark deliver with a bounded delay. The timeout of
+ * perf_reader_epoll_poll() is capped accordingly. 0 disables flushing.
+ */
+void perf_reader_epoll_set_flush(struct perf_reader_epoll *ep, int flush_ms);
+int perf_reader_epoll_fd(struct perf_reader_epoll *ep);
 void perf_reader_set_fd(struct perf_reader *reader, int fd);
+void perf_reader_set_batch_cb(struct perf_reader *reader,
+                              perf_reader_batch_cb batch_cb);
+void perf_reader_get_stats(struct perf_reader *reader,
+                          struct perf_reader_stats *stats);
+void perf_reader_reset_stats(struct perf_reader *reader);
 
 #ifdef __cplusplus
 }
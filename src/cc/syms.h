@@ -16,7 +16,11 @@
 #pragma once
 
 #include <algorithm>
+#include <atomic>
+#include <map>
 #include <memory>
+#include <mutex>
+#include <set>
 #include <string>
 #include <sys/types.h>
 #include <unordered_map>
@@ -38,6 +42,23 @@ public:
   void reset() { inode_ = getinode_(); }
 };
 
+// The demangled names of the symbols of a table, each computed on first
+// use. The returned pointers stay valid as long as the cache.
+class DemangleCache {
+  mutable std::mutex mutex_;
+  // by mangled name, empty when it could not be demangled
+  std::unordered_map<const std::string *, std::string> names_;
+  // memory of the entries of names_, kept up to date on insertion so that
+  // memory_size() does not walk them
+  std::atomic<size_t> size_{0};
+
+public:
+  // name must point into the symbol names of the table the cache belongs to
+  const char *demangle(const std::string *name);
+  void clear();
+  size_t memory_size() const;
+};
+
 class SymbolCache {
 public:
   virtual ~SymbolCache() = default;
@@ -46,6 +67,23 @@ public:
   virtual bool resolve_addr(uint64_t addr, struct bcc_symbol *sym, bool demangle = true) = 0;
   virtual bool resolve_name(const char *module, const char *name,
                             uint64_t *addr) = 0;
+  // True when the cached symbols no longer match the target, e.g. after the
+  // process exec'ed or exited.
+  virtual bool is_stale() { return false; }
+  // Approximate heap memory used by the loaded symbol tables, in bytes.
+  virtual size_t memory_size() const = 0;
+  // When to reload the perf maps of JIT compiled code, one of
+  // bcc_perf_map_refresh.
+  virtual void set_perf_map_refresh(int policy) {}
+  // Resolve count addresses into syms, returns the number resolved.
+  virtual int resolve_addrs(const uint64_t *addrs, int count,
+                            struct bcc_symbol *syms, bool demangle = true) {
+    int found = 0;
+    for (int i = 0; i < count; i++)
+      if (resolve_addr(addrs[i], &syms[i], demangle))
+        found++;
+    return found;
+  }
 };
 
 class KSyms : SymbolCache {
@@ -66,6 +104,7 @@ public:
   virtual bool resolve_name(const char *unused, const char *name,
                             uint64_t *addr);
   virtual void refresh();
+  virtual size_t memory_size() const;
 };
 
 class ProcSyms : SymbolCache {
@@ -89,6 +128,68 @@ class ProcSyms : SymbolCache {
     VDSO
   };
 
+  // The sorted symbols of one file. Tables of ELF files are shared by the
+  // modules of every process mapping the same file.
+  struct SymbolTable {
+    std::unordered_set<std::string> symnames_;
+    size_t symnames_size_ = 0;  // memory of the entries of symnames_
+    std::vector<Symbol> syms_;
+    DemangleCache demangled_;
+
+    size_t memory_size() const;
+    static int _add_symbol(const char *symname, uint64_t start, uint64_t size,
+                           void *p);
+  };
+
+  // A file is identified by its device, inode and modification time, and
+  // loaded separately per set of symbol options.
+  struct SymbolTableKey {
+    dev_t dev;
+    ino_t ino;
+    int64_t mtime_sec;
+    int64_t mtime_nsec;
+    int use_debug_file;
+    int check_debug_file_crc;
+    uint32_t use_symbol_type;
+
+    bool operator<(const SymbolTableKey &rhs) const;
+  };
+
+  static std::mutex symbol_tables_mutex_;
+  static std::map<SymbolTableKey, std::weak_ptr<SymbolTable>> symbol_tables_;
+  static std::shared_ptr<SymbolTable> load_elf_symbol_table(
+      const std::string &path, bcc_symbol_option *option);
+
+  // The symbols of a perf map, which JIT compilers keep appending to. Code
+  // can be re-JITted at the address of older code, so the symbols are kept as
+  // disjoint ranges and the last symbol written for an address wins.
+  struct PerfMapTable {
+    struct Entry {
+      uint64_t end;
+      uint64_t sym_start;  // start of the symbol, before being overlapped
+      const std::string *name;
+    };
+
+    explicit PerfMapTable(int fd) : fd_(fd), offset_(0), symnames_size_(0) {}
+
+    ebpf::FileDesc fd_;
+    uint64_t offset_;  // end of the last line parsed
+    std::unordered_set<std::string> symnames_;
+    size_t symnames_size_;  // memory of the entries of symnames_
+    std::map<uint64_t, Entry> ranges_;  // by start address
+    DemangleCache demangled_;
+
+    // Parse the lines appended since the last call, returns true when there
+    // were any.
+    bool update();
+    void add(const char *symname, uint64_t start, uint64_t size);
+    bool find_addr(uint64_t addr, struct bcc_symbol *sym, bool demangle);
+    bool find_name(const char *symname, uint64_t *addr) const;
+    size_t memory_size() const;
+    static int _add_symbol(const char *symname, uint64_t start, uint64_t size,
+                           void *p);
+  };
+
   struct Module {
     struct Range {
       uint64_t start;
@@ -112,19 +213,16 @@ class ProcSyms : SymbolCache {
     uint64_t elf_so_offset_;
     uint64_t elf_so_addr_;
 
-    std::unordered_set<std::string> symnames_;
-    std::vector<Symbol> syms_;
+    std::shared_ptr<SymbolTable> table_;
+    std::shared_ptr<PerfMapTable> perf_map_;
 
     void load_sym_table();
 
     bool contains(uint64_t addr, uint64_t &offset) const;
     uint64_t start() const { return ranges_.begin()->start; }
 
-    bool find_addr(uint64_t offset, struct bcc_symbol *sym);
+    bool find_addr(uint64_t offset, struct bcc_symbol *sym, bool demangle);
     bool find_name(const char *symname, uint64_t *addr);
-
-    static int _add_symbol(const char *symname, uint64_t start, uint64_t size,
-                           void *p);
   };
 
   int pid_;
@@ -132,6 +230,7 @@ class ProcSyms : SymbolCache {
   ProcStat procstat_;
   std::unique_ptr<ProcMountNS> mount_ns_instance_;
   bcc_symbol_option symbol_option_;
+  int perf_map_refresh_;
 
   static int _add_load_sections(uint64_t v_addr, uint64_t mem_sz,
                                 uint64_t file_offset, void *payload);
@@ -139,13 +238,23 @@ class ProcSyms : SymbolCache {
                          void *);
   void load_exe();
   void load_modules();
+  bool find_addr(uint64_t addr, struct bcc_symbol *sym, bool demangle);
+  void update_perf_maps();
 
 public:
   ProcSyms(int pid, struct bcc_symbol_option *option = nullptr);
   virtual void refresh();
   virtual bool resolve_addr(uint64_t addr, struct bcc_symbol *sym, bool demangle = true);
+  virtual int resolve_addrs(const uint64_t *addrs, int count,
+                            struct bcc_symbol *syms, bool demangle = true);
   virtual bool resolve_name(const char *module, const char *name,
                             uint64_t *addr);
+  virtual bool is_stale() { return procstat_.is_stale(); }
+  virtual size_t memory_size() const;
+  virtual void set_perf_map_refresh(int policy) { perf_map_refresh_ = policy; }
+
+  // Number of shared symbol tables currently loaded, and their memory.
+  static size_t shared_tables(size_t *bytes);
 };
 
 class BuildSyms {
@@ -178,11 +287,29 @@ class BuildSyms {
     bool resolve_addr(uint64_t offset, struct bcc_symbol*, bool demangle=true);
   };
 
+  struct Directory {
+    Directory(const std::string &path) : path_(path), scanned_(false) {}
+    std::string path_;
+    bool scanned_;
+  };
+
   std::unordered_map<std::string, std::unique_ptr<Module> > buildmap_;
+  std::vector<Directory> dirs_;
+  // (dev, ino) of the files already indexed by a directory scan
+  std::set<std::pair<dev_t, ino_t> > scanned_files_;
+  // build-ids found in none of the directories
+  std::unordered_set<std::string> unknown_;
+
+  bool add_module(const std::string &module_name, bool replace);
+  bool add_module_if_match(const std::string &path,
+                           const std::string &build_id);
+  void scan_directory(const std::string &path, int depth);
+  Module *find_module(const std::string &build_id);
 
 public:
   BuildSyms() {}
   virtual ~BuildSyms() = default;
   virtual bool add_module(const std::string module_name);
+  virtual bool add_directory(const std::string &path);
   virtual bool resolve_addr(std::string build_id, uint64_t offset, struct bcc_symbol *sym, bool demangle = true);
 };
@@ -27,7 +27,10 @@
 
 namespace ebpf {
 
-typedef std::map<int, std::tuple<int, std::string, int, int, int, int>> fake_fd_map_def;
+// fake fd -> (type, name, key size, leaf size, max entries, flags, name of the
+// inner map of map-in-map types)
+typedef std::map<int, std::tuple<int, std::string, int, int, int, int,
+                                 std::string>> fake_fd_map_def;
 
 class TableStorageImpl;
 class TableStorageIteratorImpl;
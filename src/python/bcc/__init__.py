@@ -14,18 +14,24 @@
 
 from __future__ import print_function
 import atexit
+from bisect import bisect_left
+from collections import OrderedDict
 import ctypes as ct
 import fcntl
+import fnmatch
 import json
 import os
 import re
 import struct
 import errno
 import sys
+import threading
+import time
 basestring = (unicode if sys.version_info[0] < 3 else str)
+_int_types = ((int, long) if sys.version_info[0] < 3 else (int,))
 
 from .libbcc import lib, bcc_symbol, bcc_symbol_option, bcc_stacktrace_build_id, _SYM_CB_TYPE
-from .table import Table, PerfEventArray
+from .table import Table, PerfEventArray, SwappableTable
 from .perf import Perf
 from .syscall import syscall_name
 from .utils import get_online_cpus, printb, _assert_is_bytes, ArgString
@@ -56,10 +62,60 @@ DEBUG_BPF_REGISTER_STATE = 0x10
 # Debug BTF.
 DEBUG_BTF = 0x20
 
+# When the symbols of the perf maps (/tmp/perf-PID.map) written by JIT
+# compilers are reloaded, see BPF.set_perf_map_refresh().
+
+# Load the map once, until the process exec'ed.
+PERF_MAP_REFRESH_NEVER = 0
+# Parse the lines appended to the map when an address is not found.
+PERF_MAP_REFRESH_ON_MISS = 1
+# Parse the lines appended to the map before every lookup.
+PERF_MAP_REFRESH_ALWAYS = 2
+
 class SymbolCache(object):
     def __init__(self, pid):
+        self.pid = pid
         self.cache = lib.bcc_symcache_new(
                 pid, ct.cast(None, ct.POINTER(bcc_symbol_option)))
+        # formatted frames of BPF.sym(), by formatting flags then address;
+        # dropped together with the cache when the process exec'ed
+        self.frames = {}
+        self.refresh_policy = PERF_MAP_REFRESH_ON_MISS if pid >= 0 \
+            else PERF_MAP_REFRESH_NEVER
+        # memory_size() when last measured, and time of the last is_stale()
+        # check, maintained by SymbolCacheLRU
+        self.size = 0
+        self.checked = time.time()
+
+    def __del__(self):
+        if self.cache:
+            lib.bcc_free_symcache(self.cache, self.pid)
+            self.cache = None
+
+    def is_stale(self):
+        """
+        Return True if the process exec'ed or exited since its symbols were
+        loaded. Always False for the kernel symbol cache.
+        """
+        return lib.bcc_symcache_is_stale(self.cache) != 0
+
+    def memory_size(self):
+        """
+        Return the approximate memory used by the symbol tables loaded so
+        far, in bytes.
+        """
+        return lib.bcc_symcache_memory_size(self.cache)
+
+    def set_refresh_policy(self, policy):
+        """
+        Set when the symbols of the perf map of the process are reloaded,
+        one of the PERF_MAP_REFRESH_* constants. Only the lines appended
+        since the last load are parsed. No-op for the kernel symbol cache.
+        """
+        if self.pid < 0:
+            return
+        lib.bcc_symcache_set_perf_map_refresh(self.cache, policy)
+        self.refresh_policy = policy
 
     def resolve(self, addr, demangle):
         """
@@ -83,13 +139,46 @@ class SymbolCache(object):
                 return (None, sym.offset,
                         ct.cast(sym.module, ct.c_char_p).value)
             return (None, addr, None)
-        if demangle:
-            name_res = sym.demangle_name
-            lib.bcc_symbol_free_demangle_name(ct.byref(sym))
-        else:
-            name_res = sym.name
+        # demangled names are cached by libbcc, nothing to free
+        name_res = sym.demangle_name if demangle else sym.name
         return (name_res, sym.offset, ct.cast(sym.module, ct.c_char_p).value)
 
+    def resolve_batch(self, addrs, demangle):
+        """
+        Resolve a sequence of addresses with a single call into libbcc.
+        Returns a list with the tuple resolve() would return for each
+        address.
+        """
+        if not isinstance(addrs, (list, tuple)):
+            addrs = list(addrs)
+        count = len(addrs)
+        if count == 0:
+            return []
+        c_addrs = (ct.c_ulonglong * count)(*addrs)
+        syms = (bcc_symbol * count)()
+        lib.bcc_symcache_resolve_batch(self.cache, c_addrs, count,
+                                       1 if demangle else 0, syms)
+        res = []
+        # module names are shared by many frames, convert each only once
+        modules = {}
+        for i in range(count):
+            sym = syms[i]
+            mod_ptr = ct.cast(sym.module, ct.c_void_p).value
+            if mod_ptr not in modules:
+                modules[mod_ptr] = ct.cast(mod_ptr, ct.c_char_p).value \
+                    if mod_ptr else None
+            module = modules[mod_ptr]
+            name = sym.demangle_name if demangle else sym.name
+            if name is None:
+                # same as the failure path of resolve()
+                if mod_ptr and sym.offset:
+                    res.append((None, sym.offset, module))
+                else:
+                    res.append((None, addrs[i], None))
+            else:
+                res.append((name, sym.offset, module))
+        return res
+
     def resolve_name(self, module, name):
         module = _assert_is_bytes(module)
         name = _assert_is_bytes(name)
@@ -100,6 +189,349 @@ class SymbolCache(object):
         return addr.value
 
 
+class SymbolCacheLRU(object):
+    """SymbolCacheLRU(max_entries=1024, max_bytes=512 << 20, max_frames=1 << 20)
+
+    The symbol caches of BPF.sym() and friends, by pid. Beyond max_entries
+    process caches, or max_bytes of loaded symbol tables, the least recently
+    used caches are freed; 0 disables a limit. The kernel symbol cache is
+    never evicted. A process cache is replaced by a fresh one when the
+    process exec'ed or exited.
+
+    Each cache also memoizes the frame strings returned by BPF.sym(), so
+    that addresses shared by many stacks are only resolved and formatted
+    once. When max_frames strings are memoized, all the memos are cleared;
+    0 disables memoization.
+
+    Whether a process exec'ed is checked at most every stale_check_interval
+    seconds per process, rather than at every lookup.
+    """
+    def __init__(self, max_entries=1024, max_bytes=512 << 20,
+                 max_frames=1 << 20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_frames = max_frames
+        self._caches = OrderedDict()
+        self._kernel = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.frames = 0
+        self.frame_hits = 0
+        self.frame_misses = 0
+        self.refresh_policy = PERF_MAP_REFRESH_ON_MISS
+        self.stale_check_interval = 1.0
+        # sum of the sizes of the caches, when last measured
+        self.bytes = 0
+
+    def get(self, pid):
+        if pid < 0:
+            if self._kernel is None:
+                self.misses += 1
+                self._kernel = SymbolCache(-1)
+            else:
+                self.hits += 1
+            return self._kernel
+        cache = self._caches.pop(pid, None)
+        if cache is not None:
+            now = time.time()
+            if now - cache.checked >= self.stale_check_interval:
+                cache.checked = now
+                if cache.is_stale():
+                    self.invalidations += 1
+                    self._dropped(cache)
+                    cache = None
+        # most recently used last
+        if cache is None:
+            self.misses += 1
+            cache = SymbolCache(pid)
+            if cache.refresh_policy != self.refresh_policy:
+                cache.set_refresh_policy(self.refresh_policy)
+            self._caches[pid] = cache
+            self._shrink()
+        else:
+            self.hits += 1
+            self._caches[pid] = cache
+        return cache
+
+    def _shrink(self):
+        # the most recent cache is always kept
+        while self.max_entries and len(self._caches) > self.max_entries and \
+                len(self._caches) > 1:
+            _, cache = self._caches.popitem(last=False)
+            self._dropped(cache)
+            self.evictions += 1
+        while self.max_bytes and len(self._caches) > 1 and \
+                self.bytes > self.max_bytes:
+            _, cache = self._caches.popitem(last=False)
+            self._dropped(cache)
+            self.evictions += 1
+
+    def _dropped(self, cache):
+        self.frames -= sum(len(memo) for memo in cache.frames.values())
+        self.bytes -= cache.size
+
+    def loaded(self, cache):
+        """loaded(cache)
+
+        Measure cache again after it resolved addresses, which may have
+        loaded symbol tables, and free the least recently used caches if
+        they now use more than max_bytes.
+        """
+        size = cache.memory_size()
+        self.bytes += size - cache.size
+        cache.size = size
+        self._shrink()
+
+    def evict(self, pid=None):
+        """evict(pid=None)
+
+        Free the symbol cache of pid, or all the process symbol caches when
+        pid is None.
+        """
+        if pid is None:
+            for cache in self._caches.values():
+                self._dropped(cache)
+            self.evictions += len(self._caches)
+            self._caches.clear()
+        elif pid < 0:
+            if self._kernel is not None:
+                self._dropped(self._kernel)
+            self._kernel = None
+        else:
+            cache = self._caches.pop(pid, None)
+            if cache is not None:
+                self._dropped(cache)
+                self.evictions += 1
+
+    def frame_memo(self, cache, flags):
+        """frame_memo(cache, flags)
+
+        Return the dict of the frame strings memoized in cache for the
+        formatting flags, by address, or None when memoization is disabled.
+        Frames are not memoized when the perf map of the process is
+        reloaded before every lookup, as they may change.
+        """
+        if not self.max_frames or \
+                cache.refresh_policy == PERF_MAP_REFRESH_ALWAYS:
+            return None
+        memo = cache.frames.get(flags)
+        if memo is None:
+            memo = cache.frames[flags] = {}
+        return memo
+
+    @staticmethod
+    def memoizable(cache, name):
+        # unknown addresses may still show up in the perf map of the process
+        return name is not None or \
+            cache.refresh_policy == PERF_MAP_REFRESH_NEVER
+
+    def memoize(self, memo, addr, frame):
+        if self.frames >= self.max_frames:
+            self.clear_frames()
+        memo[addr] = frame
+        self.frames += 1
+
+    def clear_frames(self):
+        caches = list(self._caches.values())
+        if self._kernel is not None:
+            caches.append(self._kernel)
+        # emptied in place, callers may hold on to a memo
+        for cache in caches:
+            for memo in cache.frames.values():
+                memo.clear()
+        self.frames = 0
+
+    def set_refresh_policy(self, policy):
+        """set_refresh_policy(policy)
+
+        Set the perf map refresh policy of the current and future process
+        caches, one of the PERF_MAP_REFRESH_* constants.
+        """
+        self.refresh_policy = policy
+        for cache in self._caches.values():
+            cache.set_refresh_policy(policy)
+        # frames memoized under the previous policy may be out of date
+        self.clear_frames()
+
+    def memory_size(self):
+        # measure every cache again, shared tables are accounted in equal
+        # parts to their users, which change as caches come and go
+        caches = list(self._caches.values())
+        if self._kernel is not None:
+            caches.append(self._kernel)
+        for cache in caches:
+            cache.size = cache.memory_size()
+        self.bytes = sum(cache.size for cache in caches)
+        return self.bytes
+
+    def stats(self):
+        shared_bytes = ct.c_ulonglong()
+        shared = lib.bcc_symcache_shared_tables(ct.byref(shared_bytes))
+        return {"entries": len(self._caches), "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "bytes": self.memory_size(), "shared_tables": shared,
+                "shared_bytes": shared_bytes.value, "frames": self.frames,
+                "frame_hits": self.frame_hits,
+                "frame_misses": self.frame_misses}
+
+    def __len__(self):
+        return len(self._caches)
+
+    def __contains__(self, pid):
+        if pid < 0:
+            return self._kernel is not None
+        return pid in self._caches
+
+
+class KprobeFunctionIndex(object):
+    """KprobeFunctionIndex()
+
+    The sorted names of the kernel functions kprobes can attach to: the text
+    symbols of /proc/kallsyms outside of the init and irqentry sections,
+    minus the kprobe blacklist. The index is built on first use, shared by
+    all BPF objects, and rebuilt when the loaded kernel modules change.
+    """
+    def __init__(self):
+        self._functions = None
+        self._modules = None
+        self.builds = 0
+
+    @staticmethod
+    def _loaded_modules():
+        # name and load address of each module, the other columns change
+        # with every use of a module
+        try:
+            with open("/proc/modules", "rb") as f:
+                return frozenset((fields[0], fields[-1]) for fields in
+                                 (line.split() for line in f) if fields)
+        except IOError:
+            return None
+
+    @staticmethod
+    def _build():
+        with open("%s/../kprobes/blacklist" % TRACEFS, "rb") as blacklist_f:
+            blacklist = set([line.rstrip().split()[1] for line in blacklist_f])
+        fns = set()     # Some functions may appear more than once
+
+        in_init_section = 0
+        in_irq_section = 0
+        with open("/proc/kallsyms", "rb") as avail_file:
+            for line in avail_file:
+                (t, fn) = line.rstrip().split()[1:3]
+                # Skip all functions defined between __init_begin and
+                # __init_end
+                if in_init_section == 0:
+                    if fn == b'__init_begin':
+                        in_init_section = 1
+                        continue
+                elif in_init_section == 1:
+                    if fn == b'__init_end':
+                        in_init_section = 2
+                    continue
+                # Skip all functions defined between __irqentry_text_start and
+                # __irqentry_text_end
+                if in_irq_section == 0:
+                    if fn == b'__irqentry_text_start':
+                        in_irq_section = 1
+                        continue
+                elif in_irq_section == 1:
+                    if fn == b'__irqentry_text_end':
+                        in_irq_section = 2
+                    continue
+                # All functions defined as NOKPROBE_SYMBOL() start with the
+                # prefix _kbl_addr_*, blacklisting them by looking at the name
+                # allows to catch also those symbols that are defined in kernel
+                # modules.
+                if fn.startswith(b'_kbl_addr_'):
+                    continue
+                # Explicitly blacklist perf-related functions, they are all
+                # non-attachable.
+                elif fn.startswith(b'__perf') or fn.startswith(b'perf_'):
+                    continue
+                if t.lower() in [b't', b'w'] and fn not in blacklist:
+                    fns.add(fn)
+        return sorted(fns)
+
+    def functions(self):
+        """functions()
+
+        Return the sorted list of attachable function names.
+        """
+        # read before building, so that a module loaded meanwhile triggers
+        # another build on the next call
+        modules = self._loaded_modules()
+        if self._functions is None or modules != self._modules:
+            self._functions = self._build()
+            self._modules = modules
+            self.builds += 1
+        return self._functions
+
+    def invalidate(self):
+        self._functions = None
+
+    def prefix(self, prefix):
+        """prefix(prefix)
+
+        Return the sorted list of the function names starting with prefix.
+        """
+        fns = self.functions()
+        if not prefix:
+            return list(fns)
+        # names are ASCII, every name starting with prefix sorts before this
+        return fns[bisect_left(fns, prefix):bisect_left(fns, prefix + b'\xff')]
+
+    @staticmethod
+    def _literal_prefix(pattern):
+        # The literal text all the names re.match(pattern) accepts start with,
+        # possibly empty.
+        if b'|' in pattern:
+            return b''
+        if pattern.startswith(b'^'):
+            pattern = pattern[1:]
+        i = 0
+        while i < len(pattern):
+            c = pattern[i:i + 1]
+            if not (c.isalnum() or c == b'_'):
+                break
+            quantifier = pattern[i + 1:i + 2]
+            if quantifier and quantifier in b'*?{':
+                break
+            i += 1
+            if quantifier == b'+':
+                break
+        return pattern[:i]
+
+    def match(self, event_re):
+        """match(event_re)
+
+        Return the set of function names re.match(event_re) accepts. Only the
+        names starting with the literal prefix of event_re are tried.
+        """
+        if hasattr(event_re, "match"):
+            regex = event_re
+            prefix = b'' if regex.flags & re.IGNORECASE else \
+                self._literal_prefix(regex.pattern)
+        else:
+            regex = re.compile(event_re)
+            prefix = self._literal_prefix(event_re)
+        return set(fn for fn in self.prefix(prefix) if regex.match(fn))
+
+    def glob(self, pattern):
+        """glob(pattern)
+
+        Return the set of function names matching the shell-style pattern,
+        e.g. b"vfs_*".
+        """
+        i = 0
+        while i < len(pattern) and pattern[i:i + 1] not in (b'*', b'?', b'['):
+            i += 1
+        return set(fn for fn in self.prefix(pattern[:i])
+                   if fnmatch.fnmatchcase(fn, pattern))
+
+
 class PerfType:
     # From perf_type_id in uapi/linux/perf_event.h
     HARDWARE = 0
@@ -161,8 +593,11 @@ class BPF(object):
     XDP_REDIRECT = 4
 
     _probe_repl = re.compile(b"[^a-zA-Z0-9_]")
-    _sym_caches = {}
+    _sym_caches = SymbolCacheLRU()
+    _kprobe_functions = KprobeFunctionIndex()
     _bsymcache =  lib.bcc_buildsymcache_new()
+    # formatted frames of build-id stacks, per formatting options
+    _bsym_frames = {}
 
     _auto_includes = {
         "linux/time.h": ["time"],
@@ -296,6 +731,10 @@ class BPF(object):
         self.tracepoint_fds = {}
         self.raw_tracepoint_fds = {}
         self.perf_buffers = {}
+        # fd -> reader of the perf buffers, and the epoll set polling them
+        self._perf_buffer_fds = {}
+        self._perf_epoll = None
+        self._perf_flush_ms = 0
         self.open_perf_events = {}
         self.tracefile = None
         atexit.register(self.cleanup)
@@ -303,6 +742,9 @@ class BPF(object):
         self.debug = debug
         self.funcs = {}
         self.tables = {}
+        # entries added (removed) from python to the BPF_TABLE_COUNTER()
+        # tables, by name, shared by all the table objects of a map
+        self.table_count_adjust = {}
         self.module = None
         cflags_array = (ct.c_char_p * len(cflags))()
         for i, s in enumerate(cflags): cflags_array[i] = bytes(ArgString(s))
@@ -516,49 +958,21 @@ class BPF(object):
 
     @staticmethod
     def get_kprobe_functions(event_re):
-        with open("%s/../kprobes/blacklist" % TRACEFS, "rb") as blacklist_f:
-            blacklist = set([line.rstrip().split()[1] for line in blacklist_f])
-        fns = []
+        """get_kprobe_functions(event_re)
 
-        in_init_section = 0
-        in_irq_section = 0
-        with open("/proc/kallsyms", "rb") as avail_file:
-            for line in avail_file:
-                (t, fn) = line.rstrip().split()[1:3]
-                # Skip all functions defined between __init_begin and
-                # __init_end
-                if in_init_section == 0:
-                    if fn == b'__init_begin':
-                        in_init_section = 1
-                        continue
-                elif in_init_section == 1:
-                    if fn == b'__init_end':
-                        in_init_section = 2
-                    continue
-                # Skip all functions defined between __irqentry_text_start and
-                # __irqentry_text_end
-                if in_irq_section == 0:
-                    if fn == b'__irqentry_text_start':
-                        in_irq_section = 1
-                        continue
-                elif in_irq_section == 1:
-                    if fn == b'__irqentry_text_end':
-                        in_irq_section = 2
-                    continue
-                # All functions defined as NOKPROBE_SYMBOL() start with the
-                # prefix _kbl_addr_*, blacklisting them by looking at the name
-                # allows to catch also those symbols that are defined in kernel
-                # modules.
-                if fn.startswith(b'_kbl_addr_'):
-                    continue
-                # Explicitly blacklist perf-related functions, they are all
-                # non-attachable.
-                elif fn.startswith(b'__perf') or fn.startswith(b'perf_'):
-                    continue
-                if (t.lower() in [b't', b'w']) and re.match(event_re, fn) \
-                    and fn not in blacklist:
-                    fns.append(fn)
-        return set(fns)     # Some functions may appear more than once
+        Return the set of the kernel functions kprobes can attach to whose
+        name matches the regular expression event_re, from the start.
+        """
+        return BPF._kprobe_functions.match(event_re)
+
+    @staticmethod
+    def get_kprobe_functions_glob(pattern):
+        """get_kprobe_functions_glob(pattern)
+
+        Return the set of the kernel functions kprobes can attach to whose
+        name matches the shell-style pattern, e.g. b"vfs_*".
+        """
+        return BPF._kprobe_functions.glob(_assert_is_bytes(pattern))
 
     def _check_probe_quota(self, num_new_probes):
         global _num_open_probes
@@ -849,6 +1263,13 @@ class BPF(object):
             return True
         return False
 
+    @staticmethod
+    def support_map_in_map():
+        # kernel symbol "bpf_map_meta_alloc" indicates map-in-map support
+        if BPF.ksymname("bpf_map_meta_alloc") != -1:
+            return True
+        return False
+
     def detach_tracepoint(self, tp=b""):
         """detach_tracepoint(tp="")
 
@@ -1110,24 +1531,32 @@ class BPF(object):
         while True:
             line = self.trace_readline(nonblocking)
             if not line and nonblocking: return (None,) * 6
+            fields = BPF._parse_trace_line(line)
             # don't print messages related to lost events
-            if line.startswith(b"CPU:"): continue
-            task = line[:16].lstrip()
-            line = line[17:]
-            ts_end = line.find(b":")
-            pid, cpu, flags, ts = line[:ts_end].split()
-            cpu = cpu[1:-1]
-            # line[ts_end:] will have ": [sym_or_addr]: msgs"
-            # For trace_pipe debug output, the addr typically
-            # is invalid (e.g., 0x1). For kernel 4.12 or earlier,
-            # if address is not able to match a kernel symbol,
-            # nothing will be printed out. For kernel 4.13 and later,
-            # however, the illegal address will be printed out.
-            # Hence, both cases are handled here.
-            line = line[ts_end + 1:]
-            sym_end = line.find(b":")
-            msg = line[sym_end + 2:]
-            return (task, int(pid), int(cpu), flags, float(ts), msg)
+            if fields is None: continue
+            return fields
+
+    @staticmethod
+    def _parse_trace_line(line):
+        # split a trace_pipe line into (task, pid, cpu, flags, timestamp,
+        # msg), or None for the "CPU:n [LOST n EVENTS]" lines
+        if line.startswith(b"CPU:"): return None
+        task = line[:16].lstrip()
+        line = line[17:]
+        ts_end = line.find(b":")
+        pid, cpu, flags, ts = line[:ts_end].split()
+        cpu = cpu[1:-1]
+        # line[ts_end:] will have ": [sym_or_addr]: msgs"
+        # For trace_pipe debug output, the addr typically
+        # is invalid (e.g., 0x1). For kernel 4.12 or earlier,
+        # if address is not able to match a kernel symbol,
+        # nothing will be printed out. For kernel 4.13 and later,
+        # however, the illegal address will be printed out.
+        # Hence, both cases are handled here.
+        line = line[ts_end + 1:]
+        sym_end = line.find(b":")
+        msg = line[sym_end + 2:]
+        return (task, int(pid), int(cpu), flags, float(ts), msg)
 
     def trace_readline(self, nonblocking=False):
         """trace_readline(nonblocking=False)
@@ -1171,11 +1600,71 @@ class BPF(object):
         Returns a symbol cache for the specified PID.
         The kernel symbol cache is accessed by providing any PID less than zero.
         """
-        if pid < 0 and pid != -1:
-            pid = -1
-        if not pid in BPF._sym_caches:
-            BPF._sym_caches[pid] = SymbolCache(pid)
-        return BPF._sym_caches[pid]
+        return BPF._sym_caches.get(pid)
+
+    @staticmethod
+    def set_sym_cache_limits(max_entries=None, max_bytes=None):
+        """set_sym_cache_limits(max_entries=None, max_bytes=None)
+
+        Bound the number of per-process symbol caches kept by sym(), and the
+        memory used by their symbol tables. Least recently used caches are
+        freed beyond either limit, 0 meaning no limit. Arguments left to
+        None keep their current value, 1024 caches and 512MB by default.
+        """
+        if max_entries is not None:
+            BPF._sym_caches.max_entries = max_entries
+        if max_bytes is not None:
+            BPF._sym_caches.max_bytes = max_bytes
+        BPF._sym_caches._shrink()
+
+    @staticmethod
+    def sym_cache_evict(pid=None):
+        """sym_cache_evict(pid=None)
+
+        Free the symbol cache of a pid, e.g. once the process is known to
+        have exited, or of all processes when pid is None.
+        """
+        BPF._sym_caches.evict(pid)
+
+    @staticmethod
+    def set_frame_memo_limit(max_frames):
+        """set_frame_memo_limit(max_frames)
+
+        sym(), ksym() and their batch variants memoize the strings they
+        return, per process, address and formatting options. Once
+        max_frames strings are memoized (1M by default), the memo is
+        cleared. 0 disables memoization.
+        """
+        BPF._sym_caches.max_frames = max_frames
+        BPF._sym_caches.clear_frames()
+
+    @staticmethod
+    def set_perf_map_refresh(policy):
+        """set_perf_map_refresh(policy)
+
+        Set when sym() reloads the /tmp/perf-PID.map files written by JIT
+        compilers: PERF_MAP_REFRESH_NEVER loads a map once,
+        PERF_MAP_REFRESH_ON_MISS (the default) parses the lines appended
+        since the last load when an address is not found, and
+        PERF_MAP_REFRESH_ALWAYS does so before every lookup, for code that
+        is re-JITted at the same addresses.
+        """
+        BPF._sym_caches.set_refresh_policy(policy)
+
+    @staticmethod
+    def sym_cache_stats():
+        """sym_cache_stats()
+
+        Return a dict of the symbol cache counters: entries (process caches
+        currently kept), hits, misses, evictions, invalidations (caches
+        replaced after an exec or exit) and bytes (approximate memory used
+        by the loaded symbol tables). The symbol tables of a binary or
+        library are loaded once and shared by all the processes mapping it:
+        shared_tables and shared_bytes give their number and total memory.
+        frames, frame_hits and frame_misses are the size and counters of the
+        memo of formatted frames.
+        """
+        return BPF._sym_caches.stats()
 
     @staticmethod
     def sym(addr, pid, show_module=False, show_offset=False, demangle=True):
@@ -1193,32 +1682,89 @@ class BPF(object):
 
         Example output when both show_module and show_offset are False:
             "start_thread"
+
+        addr can also be a frame of a stack collected with
+        BPF_F_STACK_BUILD_ID, resolved in the modules given to add_module()
+        and add_module_dir(), whatever the pid.
         """
 
-        #addr is of type stacktrace_build_id
-        #so invoke the bsym address resolver
-        typeofaddr = str(type(addr))
-        if typeofaddr.find('bpf_stack_build_id') != -1:
-          sym = bcc_symbol()
-          b = bcc_stacktrace_build_id()
-          b.status = addr.status
-          b.build_id = addr.build_id
-          b.u.offset = addr.offset;
-          res = lib.bcc_buildsymcache_resolve(BPF._bsymcache,
-                                              ct.byref(b),
-                                              ct.byref(sym))
-          if res < 0:
-            if sym.module and sym.offset:
-              name,offset,module = (None, sym.offset,
-                        ct.cast(sym.module, ct.c_char_p).value)
+        if not isinstance(addr, _int_types) and BPF._is_build_id(addr):
+            return BPF._bsym_batch([addr], show_module, show_offset)[0]
+
+        caches = BPF._sym_caches
+        cache = caches.get(pid)
+        memo = caches.frame_memo(cache, (bool(show_module),
+                                 bool(show_offset), bool(demangle)))
+        if memo is not None:
+            frame = memo.get(addr)
+            if frame is not None:
+                caches.frame_hits += 1
+                return frame
+            caches.frame_misses += 1
+        name, offset, module = cache.resolve(addr, demangle)
+        caches.loaded(cache)
+        frame = BPF._sym_format(name, offset, module, show_module,
+                                show_offset)
+        if memo is not None and caches.memoizable(cache, name):
+            caches.memoize(memo, addr, frame)
+        return frame
+
+    @staticmethod
+    def _is_build_id(addr):
+        # frames of BPF_F_STACK_BUILD_ID stacks are bpf_stack_build_id
+        # structs rather than addresses
+        return hasattr(addr, "build_id")
+
+    @staticmethod
+    def _bsym_batch(frames, show_module, show_offset):
+        """_bsym_batch(frames, show_module, show_offset)
+
+        Translate the bpf_stack_build_id frames of a stack. The strings are
+        memoized per build-id and offset.
+        """
+        caches = BPF._sym_caches
+        memo = None
+        if caches.max_frames:
+            memo = BPF._bsym_frames.setdefault((bool(show_module),
+                                                bool(show_offset)), {})
+        result = []
+        for frame in frames:
+            key = (frame.status, bytes(bytearray(frame.build_id)),
+                   frame.offset)
+            if memo is not None:
+                sym_str = memo.get(key)
+                if sym_str is not None:
+                    caches.frame_hits += 1
+                    result.append(sym_str)
+                    continue
+                caches.frame_misses += 1
+
+            sym = bcc_symbol()
+            b = bcc_stacktrace_build_id()
+            b.status = frame.status
+            b.build_id = frame.build_id
+            b.u.offset = frame.offset
+            res = lib.bcc_buildsymcache_resolve(BPF._bsymcache, ct.byref(b),
+                                                ct.byref(sym))
+            module = ct.cast(sym.module, ct.c_char_p).value \
+                if sym.module else None
+            if res < 0:
+                name, offset = None, sym.offset
+                if not sym.offset:
+                    module = None
             else:
-              name, offset, module = (None, addr, None)
-          else:
-            name, offset, module = (sym.name, sym.offset,
-                                    ct.cast(sym.module, ct.c_char_p).value)
-        else:
-          name, offset, module = BPF._sym_cache(pid).resolve(addr, demangle)
+                name, offset = sym.name, sym.offset
+            sym_str = BPF._sym_format(name, offset, module, show_module,
+                                      show_offset)
+            if memo is not None:
+                if len(memo) >= caches.max_frames:
+                    memo.clear()
+                memo[key] = sym_str
+            result.append(sym_str)
+        return result
 
+    @staticmethod
+    def _sym_format(name, offset, module, show_module, show_offset):
         offset = b"+0x%x" % offset if show_offset and name is not None else b""
         name = name or b"[unknown]"
         name = name + offset
@@ -1226,6 +1772,193 @@ class BPF(object):
             if show_module and module is not None else b""
         return name + module
 
+    @staticmethod
+    def sym_batch(addrs, pid, show_module=False, show_offset=False,
+                  demangle=True):
+        """sym_batch(addrs, pid, show_module=False, show_offset=False)
+
+        Translate a sequence of memory addresses of a pid, such as the frames
+        of a stack, into the list of strings sym() would return for each.
+        The addresses are resolved with a single call into libbcc instead of
+        one per address.
+        """
+        if not isinstance(addrs, (list, tuple)):
+            addrs = list(addrs)
+        # the frames of a stack are all of the same type
+        if addrs and not isinstance(addrs[0], _int_types) and \
+                BPF._is_build_id(addrs[0]):
+            return BPF._bsym_batch(addrs, show_module, show_offset)
+        caches = BPF._sym_caches
+        cache = caches.get(pid)
+        memo = caches.frame_memo(cache, (bool(show_module), bool(show_offset),
+                                         bool(demangle)))
+        if memo is None:
+            results = cache.resolve_batch(addrs, demangle)
+            caches.loaded(cache)
+            return [BPF._sym_format(name, offset, module, show_module,
+                                    show_offset)
+                    for name, offset, module in results]
+
+        frames = [memo.get(addr) for addr in addrs]
+        missing = [i for i, frame in enumerate(frames) if frame is None]
+        caches.frame_hits += len(frames) - len(missing)
+        caches.frame_misses += len(missing)
+        if missing:
+            addrs = [addrs[i] for i in missing]
+            results = cache.resolve_batch(addrs, demangle)
+            caches.loaded(cache)
+            for i, addr, (name, offset, module) in zip(missing, addrs,
+                                                       results):
+                frames[i] = BPF._sym_format(name, offset, module, show_module,
+                                            show_offset)
+                if caches.memoizable(cache, name):
+                    caches.memoize(memo, addr, frames[i])
+        return frames
+
+    # below this many addresses to resolve, sym_stacks() does not start
+    # threads, and a process gets one more thread per this many addresses
+    _sym_chunk = 1024
+
+    @staticmethod
+    def _sym_mount_ns(pid):
+        try:
+            return os.stat("/proc/%d/ns/mnt" % pid).st_ino
+        except OSError:
+            return None
+
+    @staticmethod
+    def sym_stacks(stacks, show_module=False, show_offset=False,
+                   demangle=True, workers=None):
+        """sym_stacks(stacks, show_module=False, show_offset=False,
+                      demangle=True, workers=None)
+
+        Translate many stacks at once, such as all the stacks of the report
+        a tool prints when tracing stops. stacks is a sequence of (pid,
+        addrs) pairs, a pid of less than zero meaning kernel addresses.
+        Returns, in the same order, the list of strings sym() (or ksym())
+        would return for the addresses of each pair.
+
+        Each unique address is resolved once. When there are many of them,
+        they are split across up to workers threads (by default one per
+        CPU, at most 8), and resolved in libbcc without holding the GIL.
+        The output does not depend on the number of workers.
+        """
+        stacks = [(pid, list(addrs)) for pid, addrs in stacks]
+        caches = BPF._sym_caches
+        if workers is None:
+            workers = min(len(get_online_cpus()), 8)
+
+        # unique addresses per pid, and those not memoized yet
+        groups = {}
+        # stacks of build-id frames, resolved by the build-id cache
+        bstacks = set()
+        for i, (pid, addrs) in enumerate(stacks):
+            if addrs and not isinstance(addrs[0], _int_types) and \
+                    BPF._is_build_id(addrs[0]):
+                bstacks.add(i)
+                continue
+            group = groups.get(pid)
+            if group is None:
+                # kernel frames are formatted like ksym()
+                flags = (bool(show_module), bool(show_offset),
+                         bool(demangle) and pid >= 0)
+                cache = caches.get(pid)
+                group = groups[pid] = (cache, flags[2],
+                                       caches.frame_memo(cache, flags), {})
+            memo, frames = group[2], group[3]
+            for addr in addrs:
+                if addr not in frames:
+                    frames[addr] = memo.get(addr) if memo is not None \
+                        else None
+
+        # [pid, cache, addrs, results]; the caches of a process are not
+        # thread-safe, so more addresses of one process need more caches.
+        # They are created here, as loading their module list may enter the
+        # mount namespace of the process.
+        serial, parallel = [], []
+        self_ns = BPF._sym_mount_ns(os.getpid())
+        for pid, (cache, demangle_pid, memo, frames) in groups.items():
+            addrs = sorted(addr for addr, frame in frames.items()
+                           if frame is None)
+            if memo is not None:
+                caches.frame_hits += len(frames) - len(addrs)
+                caches.frame_misses += len(addrs)
+            if not addrs:
+                continue
+            # entering another mount namespace fails once threads exist, so
+            # processes in other namespaces are resolved first, serially
+            if pid >= 0 and BPF._sym_mount_ns(pid) != self_ns:
+                serial.append([pid, cache, addrs, None])
+                continue
+            # the kernel symbols are loaded once, by a single cache
+            nchunks = 1 if pid < 0 else \
+                max(1, min(workers, len(addrs) // BPF._sym_chunk))
+            size = (len(addrs) + nchunks - 1) // nchunks
+            for i in range(nchunks):
+                if i == 0:
+                    chunk_cache = cache
+                else:
+                    # the symbol tables are shared with the first cache
+                    chunk_cache = SymbolCache(pid)
+                    chunk_cache.set_refresh_policy(cache.refresh_policy)
+                parallel.append([pid, chunk_cache,
+                                 addrs[i * size:(i + 1) * size], None])
+
+        for task in serial:
+            task[3] = task[1].resolve_batch(task[2], groups[task[0]][1])
+        total = sum(len(task[2]) for task in parallel)
+        if workers <= 1 or total <= BPF._sym_chunk:
+            for task in parallel:
+                task[3] = task[1].resolve_batch(task[2], groups[task[0]][1])
+        else:
+            # largest tasks first
+            queue = sorted(parallel, key=lambda task: len(task[2]))
+            errors = []
+
+            def work():
+                while True:
+                    try:
+                        task = queue.pop()
+                    except IndexError:
+                        return
+                    try:
+                        task[3] = task[1].resolve_batch(task[2],
+                                                        groups[task[0]][1])
+                    except Exception as e:
+                        errors.append(e)
+
+            threads = [threading.Thread(target=work)
+                       for i in range(min(workers, len(queue)))]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            if errors:
+                raise errors[0]
+
+        for pid in set(task[0] for task in serial + parallel):
+            caches.loaded(groups[pid][0])
+
+        # format and memoize in this thread only
+        for pid, _, addrs, results in serial + parallel:
+            cache, _, memo, frames = groups[pid]
+            for addr, (name, offset, module) in zip(addrs, results):
+                frame = BPF._sym_format(name, offset, module, show_module,
+                                        show_offset)
+                frames[addr] = frame
+                if memo is not None and caches.memoizable(cache, name):
+                    caches.memoize(memo, addr, frame)
+
+        result = []
+        for i, (pid, addrs) in enumerate(stacks):
+            if i in bstacks:
+                result.append(BPF._bsym_batch(addrs, show_module,
+                                              show_offset))
+            else:
+                frames = groups[pid][3]
+                result.append([frames[addr] for addr in addrs])
+        return result
+
     @staticmethod
     def ksym(addr, show_module=False, show_offset=False):
         """ksym(addr)
@@ -1240,6 +1973,16 @@ class BPF(object):
         """
         return BPF.sym(addr, -1, show_module, show_offset, False)
 
+    @staticmethod
+    def ksym_batch(addrs, show_module=False, show_offset=False):
+        """ksym_batch(addrs)
+
+        Translate a sequence of kernel memory addresses into the list of
+        strings ksym() would return for each, with a single call into
+        libbcc.
+        """
+        return BPF.sym_batch(addrs, -1, show_module, show_offset, False)
+
     @staticmethod
     def ksymname(name):
         """ksymname(name)
@@ -1275,11 +2018,84 @@ class BPF(object):
 
         Poll from all open perf ring buffers, calling the callback that was
         provided when calling open_perf_buffer for each entry.
+
+        If some buffers were opened with a wakeup watermark, this returns
+        at least every flush_ms milliseconds to deliver their pending
+        entries, even when timeout is -1.
+        """
+        lib.perf_reader_epoll_poll(self._perf_epoll_get(), timeout)
+
+    def _perf_epoll_get(self):
+        # the epoll set is created once, then kept in sync by
+        # _add_perf_buffer/_remove_perf_buffer
+        if not self._perf_epoll:
+            ep = lib.perf_reader_epoll_new()
+            if not ep:
+                raise Exception("Could not create perf buffer epoll set")
+            for v in self.perf_buffers.values():
+                if lib.perf_reader_epoll_add(ep, v) < 0:
+                    lib.perf_reader_epoll_free(ep)
+                    raise Exception("Could not add perf buffer to epoll set")
+            if self._perf_flush_ms:
+                lib.perf_reader_epoll_set_flush(ep, self._perf_flush_ms)
+            self._perf_epoll = ep
+        return self._perf_epoll
+
+    def _set_perf_buffer_flush(self, flush_ms):
+        # perf_buffer_poll() sweeps all rings at the shortest flush interval
+        # requested by any buffer opened with a wakeup watermark
+        if self._perf_flush_ms and self._perf_flush_ms <= flush_ms:
+            return
+        self._perf_flush_ms = flush_ms
+        if self._perf_epoll:
+            lib.perf_reader_epoll_set_flush(self._perf_epoll, flush_ms)
+
+    def perf_buffer_epoll_fd(self):
+        """perf_buffer_epoll_fd(self)
+
+        Return a single file descriptor that becomes readable when any of
+        the open perf ring buffers has data; perf_buffer_poll(0) then drains
+        the ready ones. This lets an event loop watch one fd instead of one
+        per ring.
+        """
+        return lib.perf_reader_epoll_fd(self._perf_epoll_get())
+
+    def _add_perf_buffer(self, key, reader):
+        if self._perf_epoll and \
+                lib.perf_reader_epoll_add(self._perf_epoll, reader) < 0:
+            lib.perf_reader_free(reader)
+            raise Exception("Could not add perf buffer to epoll set")
+        self.perf_buffers[key] = reader
+        self._perf_buffer_fds[lib.perf_reader_fd(reader)] = reader
+
+    def _remove_perf_buffer(self, key):
+        reader = self.perf_buffers.pop(key)
+        self._perf_buffer_fds.pop(lib.perf_reader_fd(reader), None)
+        if self._perf_epoll:
+            lib.perf_reader_epoll_remove(self._perf_epoll, reader)
+        lib.perf_reader_free(reader)
+
+    def perf_buffer_fds(self):
+        """perf_buffer_fds(self)
+
+        Return the file descriptors of all open perf ring buffers. Each one
+        becomes readable when its ring has data and can then be drained with
+        perf_buffer_consume(fd). This allows waiting on the rings from an
+        external event loop instead of blocking in perf_buffer_poll().
         """
-        readers = (ct.c_void_p * len(self.perf_buffers))()
-        for i, v in enumerate(self.perf_buffers.values()):
-            readers[i] = v
-        lib.perf_reader_poll(len(readers), readers, timeout)
+        return list(self._perf_buffer_fds.keys())
+
+    def perf_buffer_consume(self, fd):
+        """perf_buffer_consume(self, fd)
+
+        Read all pending entries from the perf ring buffer behind fd, as
+        returned by perf_buffer_fds(), calling its callback for each entry.
+        Does not block.
+        """
+        reader = self._perf_buffer_fds.get(fd)
+        if reader is None:
+            raise Exception("fd %d is not an open perf buffer" % fd)
+        lib.perf_reader_event_read(reader)
 
     def kprobe_poll(self, timeout = -1):
         """kprobe_poll(self)
@@ -1301,6 +2117,23 @@ class BPF(object):
         lib.bcc_buildsymcache_add_module(BPF._bsymcache, modname.encode())
       except Exception as e:
         print("Error adding module to build sym cache"+str(e))
+      BPF._bsym_frames.clear()
+
+    @staticmethod
+    def add_module_dir(dirname):
+        """add_module_dir(dirname)
+
+        Resolve the frames of build-id stacks whose build-id was not added
+        with add_module() from the ELF files under dirname. Debug file trees
+        such as /usr/lib/debug are looked up by build-id, and otherwise the
+        build-ids of all the ELF files of the tree are indexed once, the
+        first time one is missing.
+        """
+        if lib.bcc_buildsymcache_add_directory(BPF._bsymcache,
+                                               dirname.encode()) < 0:
+            raise Exception("Could not add directory %s to build sym cache"
+                            % dirname)
+        BPF._bsym_frames.clear()
 
     def donothing(self):
         """the do nothing exit handler"""
@@ -1321,6 +2154,9 @@ class BPF(object):
         for key in table_keys:
             if isinstance(self.tables[key], PerfEventArray):
                 del self.tables[key]
+        if self._perf_epoll:
+            lib.perf_reader_epoll_free(self._perf_epoll)
+            self._perf_epoll = None
         for (ev_type, ev_config) in list(self.open_perf_events.keys()):
             self.detach_perf_event(ev_type, ev_config)
         if self.tracefile:
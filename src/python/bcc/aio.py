@@ -0,0 +1,234 @@
+# Copyright (c) Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""asyncio integration for perf ring buffers and trace_pipe.
+
+Instead of blocking a thread in BPF.perf_buffer_poll() or
+BPF.trace_readline(), the readers here register the underlying file
+descriptors with the running event loop and hand out the events through an
+async iterator:
+
+    reader = AsyncPerfReader(b)
+    reader.open_perf_buffer(b["events"])
+    async for cpu, event in reader:
+        ...
+
+This module needs Python 3.5 or newer; it is not imported by the bcc package
+itself.
+"""
+
+import abc
+import asyncio
+import collections
+import errno
+import fcntl
+import os
+
+
+class _AsyncReader(abc.ABC):
+    # Buffers items produced by fd callbacks until the consumer awaits them.
+    # When maxsize is reached, the fds are unregistered until the consumer
+    # catches up, so that the kernel side drops (and reports) the excess
+    # instead of this process buffering it without bound.
+    def __init__(self, loop=None, maxsize=0):
+        self._loop = loop or asyncio.get_event_loop()
+        self._maxsize = maxsize
+        self._items = collections.deque()
+        self._getters = collections.deque()
+        self._fds = []
+        self._reading = False
+        self._closed = False
+
+    @abc.abstractmethod
+    def _on_readable(self, fd):
+        """Consume what fd has to read, feeding items through _extend()."""
+
+    def _add_readers(self):
+        if self._reading or self._closed:
+            return
+        for fd in self._fds:
+            self._loop.add_reader(fd, self._on_readable, fd)
+        self._reading = True
+
+    def _remove_readers(self):
+        if not self._reading:
+            return
+        for fd in self._fds:
+            self._loop.remove_reader(fd)
+        self._reading = False
+
+    @abc.abstractmethod
+    def start(self):
+        """Register the fds to watch with the event loop."""
+
+    def _extend(self, items):
+        self._items.extend(items)
+        self._wakeup()
+
+    def _wakeup(self):
+        while self._getters and self._items:
+            fut = self._getters.popleft()
+            if not fut.done():
+                fut.set_result(self._pop())
+        if self._maxsize and len(self._items) >= self._maxsize:
+            self._remove_readers()
+        if self._closed:
+            while self._getters:
+                fut = self._getters.popleft()
+                if not fut.done():
+                    fut.set_exception(StopAsyncIteration())
+
+    def _pop(self):
+        item = self._items.popleft()
+        if self._maxsize and not self._reading and not self._closed and \
+                len(self._items) < self._maxsize:
+            self._add_readers()
+        return item
+
+    def close(self):
+        """close()
+
+        Stop watching the fds. Iteration ends once the buffered items have
+        been consumed.
+        """
+        self._remove_readers()
+        self._closed = True
+        self._wakeup()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __aiter__(self):
+        if not self._reading and not self._closed:
+            self.start()
+        return self
+
+    def __anext__(self):
+        # plain future rather than a coroutine, so that this module stays
+        # free of async syntax
+        fut = self._loop.create_future()
+        if self._items and not self._getters:
+            fut.set_result(self._pop())
+        elif self._closed:
+            fut.set_exception(StopAsyncIteration())
+        else:
+            self._getters.append(fut)
+        return fut
+
+
+class AsyncPerfReader(_AsyncReader):
+    """AsyncPerfReader(bpf, loop=None, maxsize=0)
+
+    Watches the perf ring buffers of a BPF object from an asyncio event
+    loop. Only the rings whose fd became readable are drained, calling the
+    callbacks given to open_perf_buffer() as perf_buffer_poll() would.
+
+    Rings opened with AsyncPerfReader.open_perf_buffer() feed the async
+    iterator instead, which yields (cpu, event) pairs. maxsize bounds the
+    number of buffered events: the rings are no longer drained while it is
+    reached.
+
+    bpf only needs to provide perf_buffer_fds() and perf_buffer_consume(fd),
+    so any object with those methods can be used, e.g. in tests.
+    """
+    def __init__(self, bpf, loop=None, maxsize=0):
+        super(AsyncPerfReader, self).__init__(loop, maxsize)
+        self.bpf = bpf
+
+    def open_perf_buffer(self, table, page_cnt=8, lost_cb=None,
+                         decode=True):
+        """open_perf_buffer(table, page_cnt=8, lost_cb=None, decode=True)
+
+        Open the perf buffers of table and deliver their events to the
+        iterator. Events are decoded with table.decode() into namedtuples,
+        or are bytes copies of the raw data when decode is False.
+        """
+        if decode:
+            def cb(cpu, batch):
+                self._extend((cpu, e) for e in batch.decode())
+        else:
+            def cb(cpu, batch):
+                self._extend((cpu, bytes(e)) for e in batch)
+        table.open_perf_buffer(cb, page_cnt=page_cnt, lost_cb=lost_cb,
+                               batch=True)
+        if self._reading:
+            self.start()
+
+    def start(self):
+        """start()
+
+        Register the fds of all the perf buffers currently open on the BPF
+        object with the event loop. Called again, it picks up buffers that
+        were opened since.
+        """
+        self._remove_readers()
+        self._fds = list(self.bpf.perf_buffer_fds())
+        self._add_readers()
+
+    def _on_readable(self, fd):
+        self.bpf.perf_buffer_consume(fd)
+
+
+class AsyncTraceReader(_AsyncReader):
+    """AsyncTraceReader(bpf, loop=None, fields=False, maxsize=0)
+
+    Reads the kernel trace_pipe, as opened by BPF.trace_open(), from an
+    asyncio event loop. The iterator yields each line as bytes, or the
+    (task, pid, cpu, flags, timestamp, msg) tuples of BPF.trace_fields()
+    when fields is True.
+
+    Do not mix with the blocking trace_* calls on the same BPF object: they
+    read the pipe through a buffered file object.
+    """
+    def __init__(self, bpf, loop=None, fields=False, maxsize=0):
+        super(AsyncTraceReader, self).__init__(loop, maxsize)
+        self.bpf = bpf
+        self._fields = fields
+        self._partial = b""
+
+    def start(self):
+        """start()
+
+        Open trace_pipe if needed and register it with the event loop.
+        """
+        fd = self.bpf.trace_open(nonblocking=True).fileno()
+        fl = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
+        self._remove_readers()
+        self._fds = [fd]
+        self._add_readers()
+
+    def _on_readable(self, fd):
+        try:
+            data = os.read(fd, 65536)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            raise
+        if not data:
+            self.close()
+            return
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        if self._fields:
+            parse = self.bpf._parse_trace_line
+            items = []
+            for line in lines:
+                fields = parse(line.rstrip())
+                if fields is not None:
+                    items.append(fields)
+        else:
+            items = [line.rstrip() for line in lines]
+        if items:
+            self._extend(items)
@@ -49,6 +49,10 @@ lib.bpf_table_max_entries_id.restype = ct.c_ulonglong
 lib.bpf_table_max_entries_id.argtypes = [ct.c_void_p, ct.c_ulonglong]
 lib.bpf_table_flags_id.restype = ct.c_int
 lib.bpf_table_flags_id.argtypes = [ct.c_void_p, ct.c_ulonglong]
+lib.bpf_table_key_size_id.restype = ct.c_size_t
+lib.bpf_table_key_size_id.argtypes = [ct.c_void_p, ct.c_size_t]
+lib.bpf_table_leaf_size_id.restype = ct.c_size_t
+lib.bpf_table_leaf_size_id.argtypes = [ct.c_void_p, ct.c_size_t]
 lib.bpf_table_key_desc.restype = ct.c_char_p
 lib.bpf_table_key_desc.argtypes = [ct.c_void_p, ct.c_char_p]
 lib.bpf_table_leaf_desc.restype = ct.c_char_p
@@ -71,6 +75,9 @@ lib.bpf_perf_event_field.restype = ct.c_char_p
 lib.bpf_perf_event_field.argtypes = [ct.c_void_p, ct.c_char_p, ct.c_ulonglong]
 
 # keep in sync with libbpf.h
+lib.bcc_create_map.restype = ct.c_int
+lib.bcc_create_map.argtypes = [ct.c_int, ct.c_char_p, ct.c_int, ct.c_int,
+        ct.c_int, ct.c_int]
 lib.bpf_get_next_key.restype = ct.c_int
 lib.bpf_get_next_key.argtypes = [ct.c_int, ct.c_void_p, ct.c_void_p]
 lib.bpf_get_first_key.restype = ct.c_int
@@ -82,6 +89,15 @@ lib.bpf_update_elem.argtypes = [ct.c_int, ct.c_void_p, ct.c_void_p,
         ct.c_ulonglong]
 lib.bpf_delete_elem.restype = ct.c_int
 lib.bpf_delete_elem.argtypes = [ct.c_int, ct.c_void_p]
+lib.bpf_lookup_batch.restype = ct.c_int
+lib.bpf_lookup_batch.argtypes = [ct.c_int, ct.c_void_p, ct.c_void_p,
+        ct.c_void_p, ct.c_void_p, ct.POINTER(ct.c_uint32)]
+lib.bpf_lookup_and_delete_batch.restype = ct.c_int
+lib.bpf_lookup_and_delete_batch.argtypes = [ct.c_int, ct.c_void_p,
+        ct.c_void_p, ct.c_void_p, ct.c_void_p, ct.POINTER(ct.c_uint32)]
+lib.bpf_delete_batch.restype = ct.c_int
+lib.bpf_delete_batch.argtypes = [ct.c_int, ct.c_void_p,
+        ct.POINTER(ct.c_uint32)]
 lib.bpf_open_raw_sock.restype = ct.c_int
 lib.bpf_open_raw_sock.argtypes = [ct.c_char_p]
 lib.bpf_attach_socket.restype = ct.c_int
@@ -91,6 +107,8 @@ lib.bcc_func_load.argtypes = [ct.c_void_p, ct.c_int, ct.c_char_p, ct.c_void_p,
         ct.c_size_t, ct.c_char_p, ct.c_uint, ct.c_int, ct.c_char_p, ct.c_uint]
 _RAW_CB_TYPE = ct.CFUNCTYPE(None, ct.py_object, ct.c_void_p, ct.c_int)
 _LOST_CB_TYPE = ct.CFUNCTYPE(None, ct.py_object, ct.c_ulonglong)
+_BATCH_CB_TYPE = ct.CFUNCTYPE(None, ct.py_object, ct.c_void_p,
+        ct.POINTER(ct.c_uint32), ct.c_int)
 lib.bpf_attach_kprobe.restype = ct.c_int
 lib.bpf_attach_kprobe.argtypes = [ct.c_int, ct.c_int, ct.c_char_p, ct.c_char_p,
         ct.c_ulonglong]
@@ -109,6 +127,18 @@ lib.bpf_attach_raw_tracepoint.restype = ct.c_int
 lib.bpf_attach_raw_tracepoint.argtypes = [ct.c_int, ct.c_char_p]
 lib.bpf_open_perf_buffer.restype = ct.c_void_p
 lib.bpf_open_perf_buffer.argtypes = [_RAW_CB_TYPE, _LOST_CB_TYPE, ct.py_object, ct.c_int, ct.c_int, ct.c_int]
+
+class bcc_perf_buffer_opts(ct.Structure):
+    _fields_ = [
+            ('pid', ct.c_int),
+            ('cpu', ct.c_int),
+            ('wakeup_events', ct.c_int),
+            ('wakeup_bytes', ct.c_int),
+        ]
+
+lib.bpf_open_perf_buffer_opts.restype = ct.c_void_p
+lib.bpf_open_perf_buffer_opts.argtypes = [_RAW_CB_TYPE, _LOST_CB_TYPE,
+        ct.py_object, ct.c_int, ct.POINTER(bcc_perf_buffer_opts)]
 lib.bpf_open_perf_event.restype = ct.c_int
 lib.bpf_open_perf_event.argtypes = [ct.c_uint, ct.c_ulonglong, ct.c_int, ct.c_int]
 lib.perf_reader_poll.restype = ct.c_int
@@ -117,6 +147,40 @@ lib.perf_reader_free.restype = None
 lib.perf_reader_free.argtypes = [ct.c_void_p]
 lib.perf_reader_fd.restype = int
 lib.perf_reader_fd.argtypes = [ct.c_void_p]
+lib.perf_reader_event_read.restype = None
+lib.perf_reader_event_read.argtypes = [ct.c_void_p]
+lib.perf_reader_epoll_new.restype = ct.c_void_p
+lib.perf_reader_epoll_new.argtypes = []
+lib.perf_reader_epoll_free.restype = None
+lib.perf_reader_epoll_free.argtypes = [ct.c_void_p]
+lib.perf_reader_epoll_add.restype = ct.c_int
+lib.perf_reader_epoll_add.argtypes = [ct.c_void_p, ct.c_void_p]
+lib.perf_reader_epoll_remove.restype = ct.c_int
+lib.perf_reader_epoll_remove.argtypes = [ct.c_void_p, ct.c_void_p]
+lib.perf_reader_epoll_poll.restype = ct.c_int
+lib.perf_reader_epoll_poll.argtypes = [ct.c_void_p, ct.c_int]
+lib.perf_reader_epoll_set_flush.restype = None
+lib.perf_reader_epoll_set_flush.argtypes = [ct.c_void_p, ct.c_int]
+lib.perf_reader_epoll_fd.restype = ct.c_int
+lib.perf_reader_epoll_fd.argtypes = [ct.c_void_p]
+lib.perf_reader_set_batch_cb.restype = None
+lib.perf_reader_set_batch_cb.argtypes = [ct.c_void_p, _BATCH_CB_TYPE]
+
+class perf_reader_stats(ct.Structure):
+    _fields_ = [
+            ('events', ct.c_uint64),
+            ('bytes', ct.c_uint64),
+            ('lost', ct.c_uint64),
+            ('lost_records', ct.c_uint64),
+            ('max_occupancy', ct.c_uint64),
+            ('callback_ns', ct.c_uint64),
+        ]
+
+lib.perf_reader_get_stats.restype = None
+lib.perf_reader_get_stats.argtypes = [ct.c_void_p,
+        ct.POINTER(perf_reader_stats)]
+lib.perf_reader_reset_stats.restype = None
+lib.perf_reader_reset_stats.argtypes = [ct.c_void_p]
 
 lib.bpf_attach_xdp.restype = ct.c_int
 lib.bpf_attach_xdp.argtypes = [ct.c_char_p, ct.c_int, ct.c_uint]
@@ -187,6 +251,9 @@ lib.bcc_free_buildsymcache.argtypes = [ct.c_void_p]
 lib.bcc_buildsymcache_add_module.restype = ct.c_int
 lib.bcc_buildsymcache_add_module.argtypes = [ct.c_void_p, ct.c_char_p]
 
+lib.bcc_buildsymcache_add_directory.restype = ct.c_int
+lib.bcc_buildsymcache_add_directory.argtypes = [ct.c_void_p, ct.c_char_p]
+
 lib.bcc_buildsymcache_resolve.restype = ct.c_int
 lib.bcc_buildsymcache_resolve.argtypes = [ct.c_void_p, ct.POINTER(bcc_stacktrace_build_id), ct.POINTER(bcc_symbol)]
 
@@ -199,6 +266,25 @@ lib.bcc_symcache_resolve.argtypes = [ct.c_void_p, ct.c_ulonglong, ct.POINTER(bcc
 lib.bcc_symcache_resolve_no_demangle.restype = ct.c_int
 lib.bcc_symcache_resolve_no_demangle.argtypes = [ct.c_void_p, ct.c_ulonglong, ct.POINTER(bcc_symbol)]
 
+lib.bcc_symcache_resolve_batch.restype = ct.c_int
+lib.bcc_symcache_resolve_batch.argtypes = [ct.c_void_p,
+    ct.POINTER(ct.c_ulonglong), ct.c_int, ct.c_int, ct.POINTER(bcc_symbol)]
+
+lib.bcc_symbol_free_demangle_names.restype = None
+lib.bcc_symbol_free_demangle_names.argtypes = [ct.POINTER(bcc_symbol), ct.c_int]
+
+lib.bcc_symcache_is_stale.restype = ct.c_int
+lib.bcc_symcache_is_stale.argtypes = [ct.c_void_p]
+
+lib.bcc_symcache_memory_size.restype = ct.c_ulonglong
+lib.bcc_symcache_memory_size.argtypes = [ct.c_void_p]
+
+lib.bcc_symcache_shared_tables.restype = ct.c_ulonglong
+lib.bcc_symcache_shared_tables.argtypes = [ct.POINTER(ct.c_ulonglong)]
+
+lib.bcc_symcache_set_perf_map_refresh.restype = None
+lib.bcc_symcache_set_perf_map_refresh.argtypes = [ct.c_void_p, ct.c_int]
+
 lib.bcc_symcache_resolve_name.restype = ct.c_int
 lib.bcc_symcache_resolve_name.argtypes = [
     ct.c_void_p, ct.c_char_p, ct.c_char_p, ct.POINTER(ct.c_ulonglong)]
@@ -19,13 +19,24 @@ import multiprocessing
 import os
 import errno
 import re
+import struct
+import sys
+import time
+from collections import namedtuple
 
-from .libbcc import lib, _RAW_CB_TYPE, _LOST_CB_TYPE
+from .libbcc import lib, _RAW_CB_TYPE, _LOST_CB_TYPE, _BATCH_CB_TYPE, \
+                    bcc_perf_buffer_opts, perf_reader_stats
 from .perf import Perf
 from .utils import get_online_cpus
 from .utils import get_possible_cpus
+from .utils import _assert_is_bytes
 from subprocess import check_output
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 BPF_MAP_TYPE_HASH = 1
 BPF_MAP_TYPE_ARRAY = 2
 BPF_MAP_TYPE_PROG_ARRAY = 3
@@ -45,11 +56,69 @@ BPF_MAP_TYPE_CPUMAP = 16
 BPF_MAP_TYPE_XSKMAP = 17
 BPF_MAP_TYPE_SOCKHASH = 18
 
+BPF_ANY = 0
+BPF_NOEXIST = 1
+
+_int_types = (int, long) if sys.version_info[0] < 3 else (int,)
+
+# kernel-internal errno returned for unsupported map operations
+_ENOTSUPP = 524
+# default number of entries moved per BPF_MAP_*_BATCH syscall
+_BATCH_CHUNK = 4096
+
 stars_max = 40
 log2_index_max = 65
 linear_index_max = 1025
 
 # helper functions, consider moving these to a utils module
+def _ctype_to_dtype(ctype):
+    """Return the numpy dtype with the same memory layout as a ctypes type"""
+    if issubclass(ctype, ct.Array):
+        if ctype._type_ is ct.c_char:
+            return np.dtype("S%d" % ctype._length_)
+        return np.dtype((_ctype_to_dtype(ctype._type_), (ctype._length_,)))
+    if issubclass(ctype, (ct.Structure, ct.Union)):
+        names, formats, offsets = [], [], []
+        for field in ctype._fields_:
+            if len(field) > 2:
+                # bitfields have no numpy equivalent, expose the raw bytes
+                return np.dtype((np.void, ct.sizeof(ctype)))
+            names.append(field[0])
+            formats.append(_ctype_to_dtype(field[1]))
+            offsets.append(getattr(ctype, field[0]).offset)
+        return np.dtype({"names": names, "formats": formats,
+                         "offsets": offsets, "itemsize": ct.sizeof(ctype)})
+    return np.dtype(ctype._type_)
+
+def _buffer_view(buf, ctype, count):
+    """memoryview over the first count elements of a ctypes array, used in
+    place of numpy arrays when numpy is not available. Scalars (and arrays of
+    scalars) are cast to their native format, anything else is left as bytes.
+    """
+    if sys.version_info[0] < 3:
+        raise Exception("numpy is required to view table buffers on Python 2")
+    view = memoryview(buf).cast("B")[:count * ct.sizeof(ctype)]
+    if issubclass(ctype, ct.Array) and \
+            issubclass(ctype._type_, ct._SimpleCData):
+        return view.cast(ctype._type_._type_, shape=[count, ctype._length_])
+    if issubclass(ctype, ct._SimpleCData):
+        return view.cast(ctype._type_)
+    return view
+
+def _percpu_to_numpy(table):
+    keys, leaves, count = table._dump()
+    if np is None:
+        return (_buffer_view(keys, table.Key, count),
+                _buffer_view(leaves, table.Leaf, count))
+    values = np.frombuffer(leaves, dtype=_ctype_to_dtype(table.Leaf._type_),
+                           count=count * table.total_cpu)
+    values = values.reshape(count, table.total_cpu)
+    if table.alignment != 0:
+        # the kernel stores unaligned leaves in 8 byte per-cpu slots
+        values = values.astype(_ctype_to_dtype(table.sLeaf))
+    return (np.frombuffer(keys, dtype=_ctype_to_dtype(table.Key),
+                          count=count), values)
+
 def _stars(val, val_max, width):
     i = 0
     text = ""
@@ -156,8 +225,19 @@ def Table(bpf, map_id, map_fd, keytype, leaftype, name, **kwargs):
         t = DevMap(bpf, map_id, map_fd, keytype, leaftype)
     elif ttype == BPF_MAP_TYPE_CPUMAP:
         t = CpuMap(bpf, map_id, map_fd, keytype, leaftype)
+    elif ttype == BPF_MAP_TYPE_ARRAY_OF_MAPS:
+        t = ArrayOfMaps(bpf, map_id, map_fd, keytype, leaftype)
+    elif ttype == BPF_MAP_TYPE_HASH_OF_MAPS:
+        t = HashOfMaps(bpf, map_id, map_fd, keytype, leaftype)
     if t == None:
         raise Exception("Unknown table type %d" % ttype)
+    if name is not None and \
+            ttype in (BPF_MAP_TYPE_HASH, BPF_MAP_TYPE_PERCPU_HASH) and \
+            lib.bpf_table_fd(bpf.module, name + b"__count") >= 0:
+        # declared with BPF_TABLE_COUNTER()
+        t._counter = bpf[name + b"__count"]
+        t._counter_name = name
+        bpf.table_count_adjust.setdefault(name, 0)
     return t
 
 
@@ -173,8 +253,25 @@ class TableBase(MutableMapping):
         self.flags = lib.bpf_table_flags_id(self.bpf.module, self.map_id)
         self._cbs = {}
         self._name = name
+        self.max_entries = int(lib.bpf_table_max_entries_id(self.bpf.module,
+                self.map_id))
+        # whether the kernel implements each BPF_MAP_*_BATCH command for
+        # this map, per command name: the support depends on the map type,
+        # e.g. arrays only implement BPF_MAP_LOOKUP_BATCH. Missing until
+        # the first call of the command tells.
+        self._batch_ok = {}
+        # per-cpu entry count of BPF_TABLE_COUNTER() tables, which BPF
+        # programs update; the entries added (removed) from python are in
+        # bpf.table_count_adjust
+        self._counter = None
 
     def key_sprintf(self, key):
+        """key_sprintf(key)
+
+        Format key as a string, using the printer clang generated for the
+        key type. Raises when the program was loaded from the compiled object
+        cache (BCC_OBJ_CACHE_DIR), which does not keep the printers.
+        """
         buf = ct.create_string_buffer(ct.sizeof(self.Key) * 8)
         res = lib.bpf_table_key_snprintf(self.bpf.module, self.map_id, buf,
                                          len(buf), ct.byref(key))
@@ -183,6 +280,11 @@ class TableBase(MutableMapping):
         return buf.value
 
     def leaf_sprintf(self, leaf):
+        """leaf_sprintf(leaf)
+
+        Format leaf as a string, like key_sprintf() does for keys, with the
+        same limitation for cached programs.
+        """
         buf = ct.create_string_buffer(ct.sizeof(self.Leaf) * 8)
         res = lib.bpf_table_leaf_snprintf(self.bpf.module, self.map_id, buf,
                                           len(buf), ct.byref(leaf))
@@ -191,6 +293,11 @@ class TableBase(MutableMapping):
         return buf.value
 
     def key_scanf(self, key_str):
+        """key_scanf(key_str)
+
+        Parse key_str into a Key, the reverse of key_sprintf(), with the same
+        limitation for cached programs.
+        """
         key = self.Key()
         res = lib.bpf_table_key_sscanf(self.bpf.module, self.map_id, key_str,
                                        ct.byref(key))
@@ -199,6 +306,11 @@ class TableBase(MutableMapping):
         return key
 
     def leaf_scanf(self, leaf_str):
+        """leaf_scanf(leaf_str)
+
+        Parse leaf_str into a Leaf, the reverse of leaf_sprintf(), with the
+        same limitation for cached programs.
+        """
         leaf = self.Leaf()
         res = lib.bpf_table_leaf_sscanf(self.bpf.module, self.map_id, leaf_str,
                                         ct.byref(leaf))
@@ -214,7 +326,13 @@ class TableBase(MutableMapping):
         return leaf
 
     def __setitem__(self, key, leaf):
-        res = lib.bpf_update_elem(self.map_fd, ct.byref(key), ct.byref(leaf), 0)
+        if self._counter is not None and \
+                lib.bpf_update_elem(self.map_fd, ct.byref(key),
+                                    ct.byref(leaf), BPF_NOEXIST) == 0:
+            self._adjust_count(1)
+            return
+        res = lib.bpf_update_elem(self.map_fd, ct.byref(key), ct.byref(leaf),
+                                  BPF_ANY)
         if res < 0:
             errstr = os.strerror(ct.get_errno())
             raise Exception("Could not update table: %s" % errstr)
@@ -223,6 +341,27 @@ class TableBase(MutableMapping):
         res = lib.bpf_delete_elem(self.map_fd, ct.byref(key))
         if res < 0:
             raise KeyError
+        self._adjust_count(-1)
+
+    def fill_ratio(self):
+        """fill_ratio()
+
+        Return the number of entries over max_entries, between 0 and 1. It
+        is cheap for tables declared with BPF_TABLE_COUNTER(), for capacity
+        alerts, and walks the whole table otherwise.
+        """
+        return float(len(self)) / self.max_entries
+
+    def _counted_len(self):
+        # the counter can briefly go out of range while insertions and
+        # deletions race on different cpus
+        count = sum(self._counter.getvalue(self._counter.Key(0)))
+        count += self.bpf.table_count_adjust[self._counter_name]
+        return max(0, min(count, self.max_entries))
+
+    def _adjust_count(self, delta):
+        if self._counter is not None:
+            self.bpf.table_count_adjust[self._counter_name] += delta
 
     # override the MutableMapping's implementation of these since they
     # don't handle KeyError nicely
@@ -261,12 +400,334 @@ class TableBase(MutableMapping):
         for k in list(self.keys()):
             self[k] = self.Leaf()
 
+    def _batch_unsupported(self, errcode):
+        # EINVAL: kernel predates the batch commands, ENOTSUPP (524) and
+        # EOPNOTSUPP: the map type does not implement them
+        return errcode in (errno.EINVAL, errno.EOPNOTSUPP, _ENOTSUPP)
+
+    def _lookup_batch(self, delete, chunk):
+        if delete:
+            batch_fn = lib.bpf_lookup_and_delete_batch
+            cmd = "BPF_MAP_LOOKUP_AND_DELETE_BATCH"
+        else:
+            batch_fn = lib.bpf_lookup_batch
+            cmd = "BPF_MAP_LOOKUP_BATCH"
+        if self._batch_ok.get(cmd) is False:
+            return None
+
+        if chunk is None:
+            chunk = _BATCH_CHUNK
+        chunk = max(1, min(chunk, self.max_entries))
+        key_size = ct.sizeof(self.Key)
+        leaf_size = ct.sizeof(self.Leaf)
+        # hash and array maps both use a u32 bucket/index as batch cursor
+        in_batch = ct.c_uint32()
+        out_batch = ct.c_uint32()
+        cursor = None
+        items = []
+        while True:
+            # fresh buffers per chunk: the returned keys and leaves are views
+            # into them, so no per-entry copy is needed
+            keys = (self.Key * chunk)()
+            leaves = (self.Leaf * chunk)()
+            count = ct.c_uint32(chunk)
+            res = batch_fn(self.map_fd, cursor, ct.byref(out_batch),
+                           keys, leaves, ct.byref(count))
+            errcode = ct.get_errno() if res < 0 else 0
+            if res < 0 and errcode not in (0, errno.ENOENT):
+                if cmd not in self._batch_ok and \
+                        self._batch_unsupported(errcode):
+                    self._batch_ok[cmd] = False
+                    return None
+                if errcode == errno.ENOSPC and count.value == 0:
+                    # a single hash bucket does not fit in the buffer
+                    chunk *= 2
+                    continue
+                raise Exception("%s failed: %s" % (cmd,
+                                os.strerror(errcode)))
+            self._batch_ok[cmd] = True
+            if delete:
+                self._adjust_count(-count.value)
+            for i in range(count.value):
+                items.append((self.Key.from_buffer(keys, i * key_size),
+                              self.Leaf.from_buffer(leaves, i * leaf_size)))
+            if res < 0:
+                # ENOENT: the whole map has been walked
+                break
+            in_batch.value = out_batch.value
+            cursor = ct.byref(in_batch)
+        return items
+
+    def _grow_dump(self, keys, leaves, count):
+        # double the dump buffers, up to max_entries, keeping their first
+        # count entries
+        size = min(len(keys) * 2, self.max_entries)
+        new_keys = (self.Key * size)()
+        new_leaves = (self.Leaf * size)()
+        ct.memmove(new_keys, keys, count * ct.sizeof(self.Key))
+        ct.memmove(new_leaves, leaves, count * ct.sizeof(self.Leaf))
+        return new_keys, new_leaves
+
+    def _dump_batch(self):
+        # copy the table into contiguous keys/leaves arrays with
+        # BPF_MAP_LOOKUP_BATCH, growing them as the cursor advances, so that
+        # sparse maps do not pay for max_entries; returns (keys, leaves,
+        # count), or None if unsupported
+        cmd = "BPF_MAP_LOOKUP_BATCH"
+        if self._batch_ok.get(cmd) is False:
+            return None
+        size = min(_BATCH_CHUNK, self.max_entries)
+        keys = (self.Key * size)()
+        leaves = (self.Leaf * size)()
+        key_size = ct.sizeof(self.Key)
+        leaf_size = ct.sizeof(self.Leaf)
+        in_batch = ct.c_uint32()
+        out_batch = ct.c_uint32()
+        cursor = None
+        chunk = _BATCH_CHUNK
+        total = 0
+        while True:
+            if total == len(keys):
+                if total >= self.max_entries:
+                    break
+                keys, leaves = self._grow_dump(keys, leaves, total)
+            count = ct.c_uint32(min(chunk, len(keys) - total))
+            res = lib.bpf_lookup_batch(self.map_fd, cursor,
+                                       ct.byref(out_batch),
+                                       ct.byref(keys, total * key_size),
+                                       ct.byref(leaves, total * leaf_size),
+                                       ct.byref(count))
+            errcode = ct.get_errno() if res < 0 else 0
+            if res < 0 and errcode not in (0, errno.ENOENT):
+                if cmd not in self._batch_ok and \
+                        self._batch_unsupported(errcode):
+                    self._batch_ok[cmd] = False
+                    return None
+                if errcode == errno.ENOSPC and count.value == 0:
+                    if chunk < len(keys) - total:
+                        chunk *= 2
+                    elif len(keys) < self.max_entries:
+                        keys, leaves = self._grow_dump(keys, leaves, total)
+                    else:
+                        # the map grew past max_entries while we walked it
+                        break
+                    continue
+                raise Exception("%s failed: %s" % (cmd,
+                                os.strerror(errcode)))
+            self._batch_ok[cmd] = True
+            total += count.value
+            if res < 0:
+                break
+            in_batch.value = out_batch.value
+            cursor = ct.byref(in_batch)
+        return keys, leaves, total
+
+    def _dump(self):
+        # copy the whole table into two contiguous ctypes arrays, returning
+        # them with the number of entries copied; the arrays can be larger
+        dumped = self._dump_batch()
+        if dumped is not None:
+            return dumped
+        size = min(_BATCH_CHUNK, self.max_entries)
+        keys = (self.Key * size)()
+        leaves = (self.Leaf * size)()
+        count = 0
+        for k in self._keys_for_fallback():
+            if count == len(keys):
+                if count >= self.max_entries:
+                    break
+                keys, leaves = self._grow_dump(keys, leaves, count)
+            try:
+                leaves[count] = TableBase.__getitem__(self, k)
+            except KeyError:
+                continue
+            keys[count] = k
+            count += 1
+        return keys, leaves, count
+
+    def to_numpy(self):
+        """to_numpy()
+
+        Return the table contents as a (keys, leaves) pair of numpy arrays,
+        entry i being keys[i], leaves[i]. Their dtypes mirror the ctypes Key
+        and Leaf types (per-cpu leaves become a subarray of one value per
+        cpu). The entries are copied out in bulk into contiguous buffers,
+        which the arrays wrap without any further copy.
+
+        Without numpy, memoryviews over the same buffers are returned
+        instead; scalar keys and leaves are cast to their native format so
+        that they index as Python numbers. This needs Python 3.
+        """
+        keys, leaves, count = self._dump()
+        if np is None:
+            return (_buffer_view(keys, self.Key, count),
+                    _buffer_view(leaves, self.Leaf, count))
+        return (np.frombuffer(keys, dtype=_ctype_to_dtype(self.Key),
+                              count=count),
+                np.frombuffer(leaves, dtype=_ctype_to_dtype(self.Leaf),
+                              count=count))
+
+    def snapshot(self):
+        """snapshot()
+
+        Return a TableSnapshot, an immutable copy of the table contents
+        taken in bulk like to_numpy(). Comparing it with the snapshot of the
+        previous interval with diff() gives the entries that were added,
+        removed or changed in between, without clearing the table.
+        """
+        keys, leaves, count = self._dump()
+        return TableSnapshot(self.Key, self.Leaf,
+                ct.string_at(keys, count * ct.sizeof(self.Key)),
+                ct.string_at(leaves, count * ct.sizeof(self.Leaf)),
+                count, time.time())
+
+    def items_lookup_batch(self, chunk=None):
+        """items_lookup_batch(chunk=None)
+
+        Return a list of (key, leaf) pairs like items(), but fetched with
+        BPF_MAP_LOOKUP_BATCH, moving up to chunk entries per syscall instead
+        of two syscalls per entry. Leaves are returned as stored in the map
+        (per-cpu tables are not reduced). On kernels without batch support
+        this falls back to walking the table with get_next_key.
+        """
+        items = self._lookup_batch(False, chunk)
+        if items is None:
+            items = [(k, TableBase.__getitem__(self, k))
+                     for k in self._keys_for_fallback()]
+        return items
+
+    def items_lookup_and_delete_batch(self, chunk=None):
+        """items_lookup_and_delete_batch(chunk=None)
+
+        Atomically read and remove every entry, in chunks of up to chunk
+        entries per syscall, using BPF_MAP_LOOKUP_AND_DELETE_BATCH. Returns
+        the list of (key, leaf) pairs that were removed. Without kernel
+        support each entry is looked up and then deleted, which can lose
+        updates made by the bpf program in between.
+        """
+        items = self._lookup_batch(True, chunk)
+        if items is None:
+            items = []
+            for k in self._keys_for_fallback():
+                try:
+                    leaf = TableBase.__getitem__(self, k)
+                    self.__delitem__(k)
+                except KeyError:
+                    continue
+                items.append((k, leaf))
+        return items
+
+    def delete_batch(self, keys=None):
+        """delete_batch(keys=None)
+
+        Delete the given keys (an iterable of Key, or a ctypes array of Key)
+        with a single BPF_MAP_DELETE_BATCH syscall. If keys is None, delete
+        every entry in the table. Falls back to one delete per key when the
+        kernel does not support batching.
+        """
+        if keys is None:
+            if self._lookup_batch(True, None) is None:
+                self.clear()
+            return
+
+        if not isinstance(keys, ct.Array):
+            keys = list(keys)
+            arr = (self.Key * len(keys))()
+            for i, k in enumerate(keys):
+                arr[i] = k
+            keys = arr
+        if len(keys) == 0:
+            return
+
+        cmd = "BPF_MAP_DELETE_BATCH"
+        if self._batch_ok.get(cmd) is not False:
+            count = ct.c_uint32(len(keys))
+            res = lib.bpf_delete_batch(self.map_fd, keys, ct.byref(count))
+            if res == 0:
+                self._adjust_count(-count.value)
+                self._batch_ok[cmd] = True
+                return
+            errcode = ct.get_errno()
+            if not (cmd not in self._batch_ok and
+                    self._batch_unsupported(errcode)):
+                # count holds the number of keys deleted before the error
+                self._adjust_count(-count.value)
+                raise Exception("%s failed after %d entries: %s" %
+                                (cmd, count.value, os.strerror(errcode)))
+            self._batch_ok[cmd] = False
+
+        key_size = ct.sizeof(self.Key)
+        for i in range(len(keys)):
+            self.__delitem__(self.Key.from_buffer(keys, i * key_size))
+
+    def _keys_for_fallback(self):
+        # grab the key list first so that deletes don't disturb the walk
+        return list(TableBase.__iter__(self))
+
     def __iter__(self):
         return TableBase.Iter(self)
 
     def iter(self): return self.__iter__()
     def keys(self): return self.__iter__()
 
+    def _iter_reuse(self, with_leaves):
+        # two key buffers, the current one and the one get_next_key fills,
+        # swapped at each step along with their pointers
+        key_size = ct.sizeof(self.Key)
+        cur, nxt = self.Key(), self.Key()
+        cur_p, nxt_p = ct.byref(cur), ct.byref(nxt)
+        leaf = self.Leaf()
+        leaf_p = ct.byref(leaf)
+        res = lib.bpf_get_first_key(self.map_fd, cur_p, key_size)
+        while res == 0:
+            if not with_leaves:
+                yield cur
+            elif lib.bpf_lookup_elem(self.map_fd, cur_p, leaf_p) == 0:
+                yield (cur, leaf)
+            res = lib.bpf_get_next_key(self.map_fd, cur_p, nxt_p)
+            cur, nxt, cur_p, nxt_p = nxt, cur, nxt_p, cur_p
+
+    def iterkeys_reuse(self):
+        """iterkeys_reuse()
+
+        Iterate over the keys like keys(), but yield two preallocated Key
+        buffers in turn instead of allocating a Key per entry. A key is
+        only valid until the next step: copy it to keep it.
+        """
+        return self._iter_reuse(False)
+
+    def iteritems_reuse(self):
+        """iteritems_reuse()
+
+        Iterate over (key, leaf) pairs like iteritems(), reusing the key
+        buffers of iterkeys_reuse() and a single Leaf buffer. Leaves are
+        returned as stored in the map (per-cpu tables are not reduced).
+        """
+        return self._iter_reuse(True)
+
+    def keys_array(self, out=None):
+        """keys_array(out=None)
+
+        Return every key in a single ctypes array of Key, filled by walking
+        the table with get_next_key straight into it. The array returned
+        has one element per key found, and shares the memory of out, of
+        which at most len(out) elements are filled, or of a new array of
+        max_entries keys.
+        """
+        if out is None:
+            out = (self.Key * self.max_entries)()
+        key_size = ct.sizeof(self.Key)
+        count = 0
+        if len(out) and lib.bpf_get_first_key(self.map_fd, ct.byref(out),
+                                              key_size) == 0:
+            count = 1
+            while count < len(out) and \
+                    lib.bpf_get_next_key(self.map_fd,
+                                         ct.byref(out, (count - 1) * key_size),
+                                         ct.byref(out, count * key_size)) == 0:
+                count += 1
+        return (self.Key * count).from_buffer(out)
+
     class Iter(object):
         def __init__(self, table):
             self.table = table
@@ -410,11 +871,207 @@ class TableBase(MutableMapping):
             _print_linear_hist(vals, val_type)
 
 
+SnapshotDiff = namedtuple("SnapshotDiff",
+                          ["added", "removed", "changed", "deltas", "interval"])
+
+def _signed_dtype(dtype):
+    # unsigned types are subtracted as the signed type of the same size, so
+    # that values going down give negative deltas instead of wrapping
+    base = dtype.base
+    if base.kind == "u":
+        base = np.dtype("i%d" % base.itemsize)
+    return np.dtype((base, dtype.shape)) if dtype.shape else base
+
+def _snapshot_deltas(cur, prev):
+    # cur - prev for numeric leaves, field by field for structs of numbers
+    dtype = cur.dtype
+    if dtype.names is None:
+        if dtype.kind not in "iuf":
+            return None
+        signed = _signed_dtype(dtype)
+        return cur.view(signed) - prev.view(signed)
+    for name in dtype.names:
+        if dtype.fields[name][0].base.kind not in "iuf":
+            return None
+    deltas = np.empty(len(cur), dtype=[(name,
+                      _signed_dtype(dtype.fields[name][0]))
+                      for name in dtype.names])
+    for name in dtype.names:
+        signed = _signed_dtype(dtype.fields[name][0]).base
+        deltas[name] = cur[name].view(signed) - prev[name].view(signed)
+    return deltas
+
+def _struct_format(ctype):
+    # struct module format of scalar and array of scalar leaves, or None
+    if issubclass(ctype, ct.Array):
+        fmt = _struct_format(ctype._type_)
+        return "%d%s" % (ctype._length_, fmt) if fmt else None
+    if issubclass(ctype, ct._SimpleCData) and \
+            ctype._type_ in "bBhHiIlLqQfd":
+        return ctype._type_
+    return None
+
+class TableSnapshot(object):
+    """TableSnapshot(keytype, leaftype, keys, leaves, count, ts)
+
+    Immutable copy of the entries of a table, returned by
+    TableBase.snapshot(). keys and leaves are bytes holding count packed
+    Key and Leaf values, and ts the time.time() at which it was taken.
+    """
+    def __init__(self, keytype, leaftype, keys, leaves, count, ts):
+        self.Key = keytype
+        self.Leaf = leaftype
+        self._keys = keys
+        self._leaves = leaves
+        self.count = count
+        self.ts = ts
+
+    def __len__(self):
+        return self.count
+
+    def keys(self):
+        """keys()
+
+        Return the keys as a read-only numpy array (a memoryview without
+        numpy), laid out like the keys returned by to_numpy().
+        """
+        if np is None:
+            return _buffer_view(self._keys, self.Key, self.count)
+        return np.frombuffer(self._keys, dtype=_ctype_to_dtype(self.Key),
+                             count=self.count)
+
+    def leaves(self):
+        """leaves()
+
+        Return the leaves, in the order of keys(), like keys() does.
+        """
+        if np is None:
+            return _buffer_view(self._leaves, self.Leaf, self.count)
+        return np.frombuffer(self._leaves, dtype=_ctype_to_dtype(self.Leaf),
+                             count=self.count)
+
+    def items(self):
+        """items()
+
+        Return a list of (key, leaf) pairs of ctypes objects, like
+        TableBase.items().
+        """
+        key_size = ct.sizeof(self.Key)
+        leaf_size = ct.sizeof(self.Leaf)
+        return [(self.Key.from_buffer_copy(self._keys, i * key_size),
+                 self.Leaf.from_buffer_copy(self._leaves, i * leaf_size))
+                for i in range(self.count)]
+
+    def _subset(self, keys, leaves, count):
+        return TableSnapshot(self.Key, self.Leaf, keys, leaves, count, self.ts)
+
+    def diff(self, prev):
+        """diff(prev)
+
+        Compare with prev, an older snapshot of the same table, and return a
+        SnapshotDiff(added, removed, changed, deltas, interval). added and
+        changed are snapshots of the entries that are new or whose leaf
+        changed since prev, removed holds the entries of prev that are gone,
+        and interval is the time between the two snapshots in seconds.
+
+        deltas holds, for each entry of changed, its leaf minus the one in
+        prev, field by field for structs of numbers, and is None for other
+        leaves. Unsigned values are subtracted as signed ones, so a value
+        that went down gives a negative delta. Keys and leaves are compared
+        as bytes, with numpy when it is available.
+        """
+        if (self.Key, self.Leaf) != (prev.Key, prev.Leaf):
+            raise Exception("Cannot diff snapshots of different tables")
+        if np is None:
+            return self._diff_bytes(prev)
+        key_dtype = np.dtype((np.void, ct.sizeof(self.Key)))
+        leaf_dtype = np.dtype((np.void, ct.sizeof(self.Leaf)))
+        keys = np.frombuffer(self._keys, dtype=key_dtype, count=self.count)
+        leaves = np.frombuffer(self._leaves, dtype=leaf_dtype,
+                               count=self.count)
+        prev_keys = np.frombuffer(prev._keys, dtype=key_dtype,
+                                  count=prev.count)
+        prev_leaves = np.frombuffer(prev._leaves, dtype=leaf_dtype,
+                                    count=prev.count)
+
+        # index in prev of each key, found tells whether it is there at all
+        if prev.count:
+            order = np.argsort(prev_keys)
+            pos = np.searchsorted(prev_keys[order], keys)
+            pos = order[np.minimum(pos, prev.count - 1)]
+            found = prev_keys[pos] == keys
+        else:
+            pos = np.zeros(self.count, dtype=np.intp)
+            found = np.zeros(self.count, dtype=bool)
+        changed = found.copy()
+        changed[found] = leaves[found] != prev_leaves[pos[found]]
+        kept = np.ones(prev.count, dtype=bool)
+        kept[pos[found]] = False
+
+        added = ~found
+        deltas = _snapshot_deltas(self.leaves()[changed],
+                                  prev.leaves()[pos[changed]])
+        return SnapshotDiff(
+            self._subset(keys[added].tobytes(), leaves[added].tobytes(),
+                         int(added.sum())),
+            prev._subset(prev_keys[kept].tobytes(),
+                         prev_leaves[kept].tobytes(), int(kept.sum())),
+            self._subset(keys[changed].tobytes(), leaves[changed].tobytes(),
+                         int(changed.sum())),
+            deltas, self.ts - prev.ts)
+
+    def _diff_bytes(self, prev):
+        key_size = ct.sizeof(self.Key)
+        leaf_size = ct.sizeof(self.Leaf)
+        index = {}
+        for j in range(prev.count):
+            index[prev._keys[j * key_size:(j + 1) * key_size]] = j
+        added = ([], [])
+        changed = ([], [])
+        pairs = []
+        for i in range(self.count):
+            key = self._keys[i * key_size:(i + 1) * key_size]
+            leaf = self._leaves[i * leaf_size:(i + 1) * leaf_size]
+            j = index.pop(key, None)
+            if j is None:
+                added[0].append(key)
+                added[1].append(leaf)
+            elif leaf != prev._leaves[j * leaf_size:(j + 1) * leaf_size]:
+                changed[0].append(key)
+                changed[1].append(leaf)
+                pairs.append((i, j))
+        removed = sorted(index.values())
+
+        deltas = None
+        fmt = _struct_format(self.Leaf)
+        if fmt:
+            deltas = []
+            for i, j in pairs:
+                cur = struct.unpack_from(fmt, self._leaves, i * leaf_size)
+                old = struct.unpack_from(fmt, prev._leaves, j * leaf_size)
+                delta = [c - o for c, o in zip(cur, old)]
+                if not issubclass(self.Leaf, ct.Array):
+                    delta = delta[0]
+                deltas.append(delta)
+        return SnapshotDiff(
+            self._subset(b"".join(added[0]), b"".join(added[1]),
+                         len(added[0])),
+            prev._subset(
+                b"".join(prev._keys[j * key_size:(j + 1) * key_size]
+                         for j in removed),
+                b"".join(prev._leaves[j * leaf_size:(j + 1) * leaf_size]
+                         for j in removed), len(removed)),
+            self._subset(b"".join(changed[0]), b"".join(changed[1]),
+                         len(changed[0])),
+            deltas, self.ts - prev.ts)
+
 class HashTable(TableBase):
     def __init__(self, *args, **kwargs):
         super(HashTable, self).__init__(*args, **kwargs)
 
     def __len__(self):
+        if self._counter is not None:
+            return self._counted_len()
         i = 0
         for k in self: i += 1
         return i
@@ -426,8 +1083,6 @@ class LruHash(HashTable):
 class ArrayBase(TableBase):
     def __init__(self, *args, **kwargs):
         super(ArrayBase, self).__init__(*args, **kwargs)
-        self.max_entries = int(lib.bpf_table_max_entries_id(self.bpf.module,
-                self.map_id))
 
     def _normalize_key(self, key):
         if isinstance(key, int):
@@ -540,6 +1195,8 @@ class PerfEventArray(ArrayBase):
         super(PerfEventArray, self).__init__(*args, **kwargs)
         self._open_key_fds = {}
         self._event_class = None
+        self._decoder = None
+        self._ring_size = 0
 
     def __del__(self):
         keys = list(self._open_key_fds.keys())
@@ -554,15 +1211,15 @@ class PerfEventArray(ArrayBase):
         key_id = (id(self), key)
         if key_id in self.bpf.perf_buffers:
             # The key is opened for perf ring buffer
-            lib.perf_reader_free(self.bpf.perf_buffers[key_id])
-            del self.bpf.perf_buffers[key_id]
+            self.bpf._remove_perf_buffer(key_id)
             del self._cbs[key]
         else:
             # The key is opened for perf event read
             lib.bpf_close_perf_event_fd(self._open_key_fds[key])
         del self._open_key_fds[key]
 
-    def _get_event_class(self):
+    def _get_event_fields(self):
+        # list of (name, ctype, C type string) for the perf output struct
         ct_mapping = { 'char'              : ct.c_char,
                        's8'                : ct.c_char,
                        'unsigned char'     : ct.c_ubyte,
@@ -606,16 +1263,43 @@ class PerfEventArray(ArrayBase):
             m = array_type.match(field_type)
             try:
                 if m:
-                    fields.append((field_name, ct_mapping[m.group(1)] * int(m.group(2))))
+                    fields.append((field_name, ct_mapping[m.group(1)] * int(m.group(2)),
+                                   field_type))
                 else:
-                    fields.append((field_name, ct_mapping[field_type]))
+                    fields.append((field_name, ct_mapping[field_type], field_type))
             except KeyError:
                 print("Type: '%s' not recognized. Please define the data with ctypes manually."
                       % field_type)
                 exit()
             i += 1
+        return fields
+
+    def _get_event_class(self):
+        fields = [(name, ctype) for name, ctype, _ in self._get_event_fields()]
         return type('', (ct.Structure,), {'_fields_': fields})
 
+    def decoder(self):
+        """decoder()
+
+        Return an EventDecoder for this table's perf output struct. It
+        unpacks events with a precompiled struct.Struct into namedtuples,
+        which is considerably faster than the ctypes objects returned by
+        event().
+        """
+        if self._decoder is None:
+            self._decoder = EventDecoder(self._get_event_fields())
+        return self._decoder
+
+    def decode(self, data):
+        """decode(data)
+
+        Decode one event with decoder(). data is either the pointer passed
+        to a perf buffer callback or a bytes-like object.
+        """
+        if self._decoder is None:
+            self._decoder = EventDecoder(self._get_event_fields())
+        return self._decoder.decode(data)
+
     def event(self, data):
         """event(data)
 
@@ -628,7 +1312,9 @@ class PerfEventArray(ArrayBase):
             self._event_class = self._get_event_class()
         return ct.cast(data, ct.POINTER(self._event_class)).contents
 
-    def open_perf_buffer(self, callback, page_cnt=8, lost_cb=None):
+    def open_perf_buffer(self, callback, page_cnt=8, lost_cb=None,
+                         batch=False, wakeup_events=1, wakeup_bytes=0,
+                         flush_ms=None):
         """open_perf_buffers(callback)
 
         Opens a set of per-cpu ring buffer to receive custom perf event
@@ -636,15 +1322,43 @@ class PerfEventArray(ArrayBase):
         event submitted from the kernel, up to millions per second. Use
         page_cnt to change the size of the per-cpu ring buffer. The value
         must be a power of two and defaults to 8.
+
+        With batch=True, all events pending in a ring are copied into one
+        buffer and the callback is invoked once per ring drain, as
+        callback(cpu, batch) with a PerfEventBatch, instead of once per
+        event. This saves a C to Python transition per event, and needs
+        Python 3.
+
+        By default the poller is woken up for every event. Set
+        wakeup_events to only wake it every that many events, or
+        wakeup_bytes to wake it once that many bytes are pending in a ring.
+        Events below the watermark are still delivered by
+        perf_buffer_poll() after at most flush_ms milliseconds (100 by
+        default when a watermark is set).
         """
 
         if page_cnt & (page_cnt - 1) != 0:
             raise Exception("Perf buffer page_cnt must be a power of two")
-
+        if batch and sys.version_info[0] < 3:
+            raise Exception("Perf buffer batch mode requires Python 3")
+        if wakeup_bytes and wakeup_events > 1:
+            raise Exception("Only one of wakeup_events and wakeup_bytes can be set")
+        if wakeup_bytes >= page_cnt * os.sysconf("SC_PAGESIZE"):
+            raise Exception("Perf buffer wakeup_bytes must be smaller than the ring")
+        if flush_ms is None:
+            flush_ms = 100 if wakeup_bytes or wakeup_events > 1 else 0
+
+        opts = bcc_perf_buffer_opts()
+        opts.pid = -1
+        opts.wakeup_events = wakeup_events
+        opts.wakeup_bytes = wakeup_bytes
         for i in get_online_cpus():
-            self._open_perf_buffer(i, callback, page_cnt, lost_cb)
+            self._open_perf_buffer(i, callback, page_cnt, lost_cb, batch, opts)
+        if flush_ms:
+            self.bpf._set_perf_buffer_flush(flush_ms)
 
-    def _open_perf_buffer(self, cpu, callback, page_cnt, lost_cb):
+    def _open_perf_buffer(self, cpu, callback, page_cnt, lost_cb, batch=False,
+                          opts=None):
         def raw_cb_(_, data, size):
             try:
                 callback(cpu, data, size)
@@ -653,6 +1367,14 @@ class PerfEventArray(ArrayBase):
                     exit()
                 else:
                     raise e
+        def batch_cb_(_, buf, index, count):
+            try:
+                callback(cpu, PerfEventBatch(self, cpu, buf, index, count))
+            except IOError as e:
+                if e.errno == errno.EPIPE:
+                    exit()
+                else:
+                    raise e
         def lost_cb_(_, lost):
             try:
                 lost_cb(lost)
@@ -661,19 +1383,63 @@ class PerfEventArray(ArrayBase):
                     exit()
                 else:
                     raise e
-        fn = _RAW_CB_TYPE(raw_cb_)
+        if batch:
+            fn = _BATCH_CB_TYPE(batch_cb_)
+            raw_fn = ct.cast(None, _RAW_CB_TYPE)
+        else:
+            fn = raw_fn = _RAW_CB_TYPE(raw_cb_)
         lost_fn = _LOST_CB_TYPE(lost_cb_) if lost_cb else ct.cast(None, _LOST_CB_TYPE)
-        reader = lib.bpf_open_perf_buffer(fn, lost_fn, None, -1, cpu, page_cnt)
+        if opts is None:
+            opts = bcc_perf_buffer_opts()
+            opts.pid = -1
+            opts.wakeup_events = 1
+        opts.cpu = cpu
+        reader = lib.bpf_open_perf_buffer_opts(raw_fn, lost_fn, None, page_cnt,
+                                               ct.byref(opts))
         if not reader:
             raise Exception("Could not open perf buffer")
+        if batch:
+            lib.perf_reader_set_batch_cb(reader, fn)
         fd = lib.perf_reader_fd(reader)
         self[self.Key(cpu)] = self.Leaf(fd)
-        self.bpf.perf_buffers[(id(self), cpu)] = reader
+        self.bpf._add_perf_buffer((id(self), cpu), reader)
+        self._ring_size = page_cnt * os.sysconf("SC_PAGESIZE")
         # keep a refcnt
         self._cbs[cpu] = (fn, lost_fn)
         # The actual fd is held by the perf reader, add to track opened keys
         self._open_key_fds[cpu] = -1
 
+    def stats(self):
+        """stats()
+
+        Returns a dict of per-cpu PerfBufferStats for the ring buffers
+        opened with open_perf_buffer(), counted since they were opened or
+        since the last reset_stats(): events and bytes delivered to the
+        callback, samples lost and the number of lost records reporting
+        them, the largest number of bytes seen pending in the ring
+        (max_occupancy, out of size), and the seconds spent in callbacks.
+        A max_occupancy close to size means page_cnt should be raised.
+        """
+        res = {}
+        st = perf_reader_stats()
+        for (table_id, cpu), reader in self.bpf.perf_buffers.items():
+            if table_id != id(self):
+                continue
+            lib.perf_reader_get_stats(reader, ct.byref(st))
+            res[cpu] = PerfBufferStats(st.events, st.bytes, st.lost,
+                                       st.lost_records, st.max_occupancy,
+                                       self._ring_size, st.callback_ns / 1e9)
+        return res
+
+    def reset_stats(self):
+        """reset_stats()
+
+        Zero the counters returned by stats().
+        """
+        for (table_id, cpu), reader in self.bpf.perf_buffers.items():
+            if table_id == id(self):
+                lib.perf_reader_reset_stats(reader)
+
     def _open_perf_event(self, cpu, typ, config):
         fd = lib.bpf_open_perf_event(typ, config, -1, cpu)
         if fd < 0:
@@ -692,6 +1458,196 @@ class PerfEventArray(ArrayBase):
             self._open_perf_event(i, typ, config)
 
 
+PerfBufferStats = namedtuple("PerfBufferStats", ["events", "bytes", "lost",
+    "lost_records", "max_occupancy", "size", "callback_time"])
+
+def _s128(val):
+    return val - (1 << 128) if val >= (1 << 127) else val
+
+class EventDecoder(object):
+    """EventDecoder(fields)
+
+    Decodes raw perf output records with a struct.Struct compiled once from
+    the event's field list, as returned by
+    PerfEventArray._get_event_fields(). Events are returned as namedtuples
+    with the C field names. Char arrays are bytes cut at the first NUL, like
+    ctypes does; other fixed size arrays are tuples; __int128 fields are
+    Python ints; pointers are plain integers.
+    """
+    # struct codes for standard sizes, by (size, signed)
+    _int_codes = {(1, True): "b", (2, True): "h", (4, True): "i",
+                  (8, True): "q", (1, False): "B", (2, False): "H",
+                  (4, False): "I", (8, False): "Q"}
+
+    def __init__(self, fields):
+        cls = type('', (ct.Structure,),
+                   {'_fields_': [(name, ctype) for name, ctype, _ in fields]})
+        self.size = ct.sizeof(cls)
+        fmt = ["="]
+        pos = 0
+        # (kind, index in the flat unpacked tuple, item count) per field,
+        # kind is None when the item can be used as is
+        self._layout = []
+        flat = 0
+        for name, ctype, type_str in fields:
+            offset = getattr(cls, name).offset
+            if offset > pos:
+                fmt.append("%dx" % (offset - pos))
+            pos = offset + ct.sizeof(ctype)
+            if type_str.endswith("__int128"):
+                fmt.append("2Q")
+                kind = "s128" if type_str == "__int128" else "u128"
+                self._layout.append((kind, flat, 2))
+                flat += 2
+            elif issubclass(ctype, ct.Array):
+                if ctype._type_ is ct.c_char:
+                    fmt.append("%ds" % ctype._length_)
+                    self._layout.append(("str", flat, 1))
+                    flat += 1
+                elif issubclass(ctype._type_, ct.Array):
+                    # e.g. arrays of __int128, left as raw bytes
+                    fmt.append("%ds" % ct.sizeof(ctype))
+                    self._layout.append((None, flat, 1))
+                    flat += 1
+                else:
+                    fmt.append("%d%s" % (ctype._length_,
+                                         self._code(ctype._type_)))
+                    self._layout.append(("array", flat, ctype._length_))
+                    flat += ctype._length_
+            else:
+                fmt.append(self._code(ctype))
+                self._layout.append((None, flat, 1))
+                flat += 1
+        if self.size > pos:
+            fmt.append("%dx" % (self.size - pos))
+        self._struct = struct.Struct("".join(fmt))
+        self._raw = ct.c_char * self.size
+        self.Event = namedtuple("Event", [f[0] for f in fields], rename=True)
+        if all(kind is None for kind, _, _ in self._layout):
+            self._convert = self.Event._make
+        else:
+            self._convert = self._compile()
+
+    def _code(self, ctype):
+        if ctype is ct.c_char:
+            return "c"
+        if ctype in (ct.c_void_p, ct.c_char_p):
+            return "Q" if ct.sizeof(ctype) == 8 else "I"
+        return self._int_codes[(ct.sizeof(ctype), ctype(-1).value < 0)]
+
+    def _compile(self):
+        # build one expression converting the flat unpacked tuple into an
+        # Event, so that decoding costs a single Python call per event
+        exprs = []
+        lo, hi = (0, 1) if sys.byteorder == "little" else (1, 0)
+        for kind, i, n in self._layout:
+            if kind is None:
+                exprs.append("v[%d]" % i)
+            elif kind == "str":
+                exprs.append("v[%d].partition(b'\\0')[0]" % i)
+            elif kind == "array":
+                exprs.append("v[%d:%d]" % (i, i + n))
+            elif kind == "u128":
+                exprs.append("(v[%d] | (v[%d] << 64))" % (i + lo, i + hi))
+            else:
+                exprs.append("_s128(v[%d] | (v[%d] << 64))" % (i + lo, i + hi))
+        src = "lambda v: _new(_Event, (%s,))" % ", ".join(exprs)
+        return eval(src, {"_new": tuple.__new__, "_Event": self.Event,
+                          "_s128": _s128})
+
+    def decode(self, data, offset=0):
+        """decode(data, offset=0)
+
+        Decode the event at offset in a bytes-like object, or at the
+        address data when it is an integer pointer (as passed to perf
+        buffer callbacks).
+        """
+        if isinstance(data, _int_types):
+            # view the memory in place rather than copying it out first
+            data = self._raw.from_address(data + offset)
+            offset = 0
+        return self._convert(self._struct.unpack_from(data, offset))
+
+    def decode_all(self, buf, offsets, count):
+        """decode_all(buf, offsets, count)
+
+        Decode count events packed in buf, event i starting at offsets[i].
+        """
+        unpack_from = self._struct.unpack_from
+        convert = self._convert
+        return [convert(unpack_from(buf, offsets[i])) for i in range(count)]
+
+    def columns(self, events):
+        """columns(events)
+
+        Transpose decoded events into a dict mapping each field name to the
+        list of its values.
+        """
+        return dict(zip(self.Event._fields, [list(c) for c in zip(*events)])) \
+            if events else dict((f, []) for f in self.Event._fields)
+
+class PerfEventBatch(object):
+    """PerfEventBatch
+
+    The events drained from one cpu's perf ring buffer in a single read,
+    as passed to callbacks registered with open_perf_buffer(batch=True).
+    The raw data of all events is packed back to back in buffer, event i
+    spanning buffer[offsets[i]:offsets[i + 1]]. The memory is owned by
+    libbcc and reused for the next drain: it is only valid while the
+    callback runs, copy anything that needs to be kept.
+    """
+    def __init__(self, table, cpu, buf, index, count):
+        self.table = table
+        self.cpu = cpu
+        self._count = count
+        self._addr = buf
+        self.offsets = ct.cast(index,
+                               ct.POINTER(ct.c_uint32 * (count + 1))).contents
+        data = (ct.c_ubyte * self.offsets[count]).from_address(buf)
+        self.buffer = memoryview(data).cast("B")
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._count
+        if i < 0 or i >= self._count:
+            raise IndexError("event index out of range")
+        return self.buffer[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self.buffer[self.offsets[i]:self.offsets[i + 1]]
+
+    def event(self, i):
+        """event(i)
+
+        Decode event i like PerfEventArray.event() does for the data
+        pointer passed to per-event callbacks.
+        """
+        if i < 0 or i >= self._count:
+            raise IndexError("event index out of range")
+        return self.table.event(self._addr + self.offsets[i])
+
+    def events(self):
+        """events()
+
+        Iterate over all events of the batch, decoded with event().
+        """
+        for i in range(self._count):
+            yield self.table.event(self._addr + self.offsets[i])
+
+    def decode(self):
+        """decode()
+
+        Return the list of all events of the batch, unpacked into
+        namedtuples by the table's EventDecoder. The result does not
+        reference the batch memory and can be kept.
+        """
+        return self.table.decoder().decode_all(self.buffer, self.offsets,
+                                               self._count)
+
 class PerCpuHash(HashTable):
     def __init__(self, *args, **kwargs):
         self.reducer = kwargs.pop("reducer", None)
@@ -744,6 +1700,17 @@ class PerCpuHash(HashTable):
         result = self.sum(key)
         return result.value / self.total_cpu
 
+    def to_numpy_percpu(self):
+        """to_numpy_percpu()
+
+        Return a (keys, values) pair of numpy arrays, where values has one
+        row per entry and one column per possible cpu, so that reductions
+        over all keys are a single call, e.g. values.sum(axis=1) or
+        values.max(). Without numpy, memoryviews of the same shape are
+        returned.
+        """
+        return _percpu_to_numpy(self)
+
 class LruPerCpuHash(PerCpuHash):
     def __init__(self, *args, **kwargs):
         super(LruPerCpuHash, self).__init__(*args, **kwargs)
@@ -804,6 +1771,17 @@ class PerCpuArray(ArrayBase):
         result = self.sum(key)
         return result.value / self.total_cpu
 
+    def to_numpy_percpu(self):
+        """to_numpy_percpu()
+
+        Return a (keys, values) pair of numpy arrays, where values has one
+        row per entry and one column per possible cpu, so that reductions
+        over all keys are a single call, e.g. values.sum(axis=1) or
+        values.max(). Without numpy, memoryviews of the same shape are
+        returned.
+        """
+        return _percpu_to_numpy(self)
+
 class LpmTrie(TableBase):
     def __init__(self, *args, **kwargs):
         super(LpmTrie, self).__init__(*args, **kwargs)
@@ -854,6 +1832,13 @@ class StackTrace(TableBase):
             return self.resolve(addr) if self.resolve else addr
 
     def walk(self, stack_id, resolve=None):
+        """walk(stack_id, resolve=None)
+
+        Iterate over the addresses of a stack, or over resolve(addr) for
+        each address when resolve is given, e.g. BPF.ksym. BPF.sym() and
+        BPF.ksym() memoize the frame strings they return, so addresses
+        shared by many stacks are only resolved once.
+        """
         return StackTrace.StackWalker(self[self.Key(stack_id)], self.flags, resolve)
 
     def __len__(self):
@@ -871,3 +1856,169 @@ class DevMap(ArrayBase):
 class CpuMap(ArrayBase):
     def __init__(self, *args, **kwargs):
         super(CpuMap, self).__init__(*args, **kwargs)
+
+def _inner_map_leaf(table, leaf):
+    # maps of maps are updated with the fd of the inner map, and looked up
+    # from user space as its id
+    if isinstance(leaf, TableBase):
+        leaf = leaf.map_fd
+    if isinstance(leaf, int):
+        leaf = table.Leaf(leaf)
+    return leaf
+
+def _create_inner_map(template, items=None):
+    module = template.bpf.module
+    fd = lib.bcc_create_map(template.ttype, None,
+            lib.bpf_table_key_size_id(module, template.map_id),
+            lib.bpf_table_leaf_size_id(module, template.map_id),
+            template.max_entries, template.flags)
+    if fd < 0:
+        errstr = os.strerror(ct.get_errno())
+        raise Exception("Could not create map: %s" % errstr)
+    # the new map has the layout of the template, and shares its description
+    t = Table(template.bpf, template.map_id, fd, template.Key, template.Leaf,
+              template._name)
+    # closed along with the table, the map stays alive while it is stored
+    # in a map of maps
+    t._owned_fd = FileDesc(fd)
+    if items is not None:
+        for k, v in (items.items() if hasattr(items, "items") else items):
+            t[k] = v
+    return t
+
+class _MapOfMaps(object):
+    # shared by ArrayOfMaps and HashOfMaps, keeps the table objects stored
+    # from python alive so that replace() can hand them back
+
+    def _inner_key(self, key):
+        return bytes(bytearray(key))
+
+    def create_inner(self, template, items=None):
+        """create_inner(template, items=None)
+
+        Create a new map with the type, key, leaf and size of the table
+        template, which should be the inner map this map was declared with,
+        and return it as a table object. items, a dict or a sequence of
+        (key, leaf) pairs, is written to it before returning, so that it is
+        fully populated before being stored in this map.
+        """
+        return _create_inner_map(template, items)
+
+    def replace(self, key, leaf):
+        """replace(key, leaf)
+
+        Atomically make BPF programs use the inner map leaf, a table object
+        or an fd, for key, and return the table object that was stored at
+        key from python, or None.
+        """
+        key = self._map_key(key)
+        old = self._inner.get(self._inner_key(key))
+        self[key] = leaf
+        return old
+
+class ArrayOfMaps(_MapOfMaps, ArrayBase):
+    def __init__(self, *args, **kwargs):
+        super(ArrayOfMaps, self).__init__(*args, **kwargs)
+        self._inner = {}
+
+    def _map_key(self, key):
+        return self._normalize_key(key)
+
+    def __setitem__(self, key, leaf):
+        key = self._normalize_key(key)
+        super(ArrayOfMaps, self).__setitem__(key, _inner_map_leaf(self, leaf))
+        self._inner[self._inner_key(key)] = \
+                leaf if isinstance(leaf, TableBase) else None
+
+    def __delitem__(self, key):
+        key = self._normalize_key(key)
+        super(ArrayOfMaps, self).__delitem__(key)
+        self._inner.pop(self._inner_key(key), None)
+
+class HashOfMaps(_MapOfMaps, HashTable):
+    def __init__(self, *args, **kwargs):
+        super(HashOfMaps, self).__init__(*args, **kwargs)
+        self._inner = {}
+
+    def _map_key(self, key):
+        return key
+
+    def __setitem__(self, key, leaf):
+        super(HashOfMaps, self).__setitem__(key, _inner_map_leaf(self, leaf))
+        self._inner[self._inner_key(key)] = \
+                leaf if isinstance(leaf, TableBase) else None
+
+    def __delitem__(self, key):
+        super(HashOfMaps, self).__delitem__(key)
+        self._inner.pop(self._inner_key(key), None)
+
+class SwappableTable(object):
+    """SwappableTable(bpf, name)
+
+    The tables of a BPF_SWAPPABLE_TABLE() or BPF_SWAPPABLE_HISTOGRAM(): BPF
+    programs update the active one of name_0 and name_1, through the map of
+    maps name. swap() makes them update the other one, with a single
+    syscall, and returns the table that was active, which they no longer
+    update: it can be read and cleared without racing with them.
+
+    Maps of maps need Linux 4.12 or later, see BPF.support_map_in_map().
+    Without them, name can be a plain table instead: swap() then returns it
+    as is, to be read and cleared while BPF programs keep updating it.
+    """
+    def __init__(self, bpf, name):
+        name = _assert_is_bytes(name)
+        table = bpf[name]
+        if isinstance(table, ArrayOfMaps):
+            self.outer = table
+            self.tables = [bpf[name + b"_0"], bpf[name + b"_1"]]
+            self.outer[0] = self.tables[0]
+        else:
+            self.outer = None
+            self.tables = [table, table]
+        self.active = 0
+
+    @staticmethod
+    def increment_text(name, key, swappable=True):
+        """increment_text(name, key, swappable=True)
+
+        Return the C statement adding one to the value of key in the active
+        table of the BPF_SWAPPABLE_TABLE() name, for tools generating their
+        BPF program, or in the plain table name when swappable is False.
+        """
+        if not swappable:
+            return "%s.increment(%s);" % (name, key)
+        return ("{ int __zero = 0; void *__active = %s.lookup(&__zero); "
+                "if (__active) bpf_map_increment(__active, &%s, 1); }" %
+                (name, key))
+
+    def swap(self):
+        """swap()
+
+        Make BPF programs update the idle table, and return the table they
+        updated so far. Since Linux 4.20, the kernel waits for the programs
+        running on other CPUs before returning from the update of the map of
+        maps. On 4.12 to 4.19 it does not: programs that looked up the old
+        table just before the swap can still update it right after swap()
+        returns, so a few updates may land in the returned table after it
+        was read, or be lost when it is cleared.
+        """
+        table = self.tables[self.active]
+        self.active ^= 1
+        if self.outer is not None:
+            self.outer[0] = self.tables[self.active]
+        return table
+
+    def active_table(self):
+        """active_table()
+
+        Return the table BPF programs currently update.
+        """
+        return self.tables[self.active]
+
+    def idle_table(self):
+        """idle_table()
+
+        Return the table BPF programs do not update, to be cleared before
+        the next swap().
+        """
+        return self.tables[self.active ^ 1]
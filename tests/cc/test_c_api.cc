@@ -16,6 +16,7 @@
 #include <fcntl.h>
 #include <dlfcn.h>
 #include <stdint.h>
+#include <stdlib.h>
 #include <string.h>
 #include <link.h>
 #include <sys/mman.h>
@@ -24,6 +25,8 @@
 #include <sys/types.h>
 #include <sys/wait.h>
 #include <unistd.h>
+#include <algorithm>
+#include <vector>
 
 #include "bcc_elf.h"
 #include "bcc_perf_map.h"
@@ -117,6 +120,10 @@ extern "C" int _a_test_function(const char *a_string) {
   return i;
 }
 
+namespace demangle_test {
+__attribute__((noinline)) int mangled_function(int x) { return x + 1; }
+}
+
 static int setup_tmp_mnts(void) {
   // Disconnect this mount namespace from its parent
   if (mount(NULL, "/", NULL, MS_REC|MS_PRIVATE, NULL) < 0) {
@@ -263,6 +270,65 @@ TEST_CASE("resolve symbol addresses for a given PID", "[c_api]") {
     REQUIRE(sym_match);
   }
 
+  SECTION("resolve a batch of addresses") {
+    void *libbcc = dlopen("libbcc.so", RTLD_LAZY | RTLD_NOLOAD);
+    REQUIRE(libbcc);
+
+    uint64_t addrs[3] = {
+      (uint64_t)&_a_test_function,
+      (uint64_t)dlsym(libbcc, "bcc_resolve_symname"),
+      0,
+    };
+    struct bcc_symbol syms[3];
+
+    REQUIRE(bcc_symcache_resolve_batch(resolver, addrs, 3, 1, syms) == 2);
+    for (int i = 0; i < 2; i++) {
+      REQUIRE(bcc_symcache_resolve(resolver, addrs[i], &sym) == 0);
+      REQUIRE(string(sym.name) == syms[i].name);
+      REQUIRE(string(sym.module) == syms[i].module);
+      REQUIRE(sym.offset == syms[i].offset);
+      bcc_symbol_free_demangle_name(&sym);
+    }
+    REQUIRE(syms[2].name == NULL);
+    bcc_symbol_free_demangle_names(syms, 3);
+  }
+
+  SECTION("cache demangled names") {
+    uint64_t addr = (uint64_t)&demangle_test::mangled_function;
+    struct bcc_symbol again;
+
+    REQUIRE(bcc_symcache_resolve(resolver, addr, &sym) == 0);
+    REQUIRE(string(sym.name).find("_ZN") == 0);
+    REQUIRE(string("demangle_test::mangled_function(int)") ==
+            sym.demangle_name);
+
+    // demangled once, later lookups return the same string
+    REQUIRE(bcc_symcache_resolve(resolver, addr, &again) == 0);
+    REQUIRE(again.demangle_name == sym.demangle_name);
+    REQUIRE(bcc_symcache_resolve_batch(resolver, &addr, 1, 1, &again) == 1);
+    REQUIRE(again.demangle_name == sym.demangle_name);
+
+    REQUIRE(bcc_symcache_resolve_no_demangle(resolver, addr, &again) == 0);
+    REQUIRE(again.demangle_name == NULL);
+  }
+
+  SECTION("share symbol tables between caches") {
+    void *other = bcc_symcache_new(getpid(), nullptr);
+    struct bcc_symbol other_sym;
+    uint64_t bytes = 0;
+
+    REQUIRE(other);
+    REQUIRE(bcc_symcache_resolve(resolver, (uint64_t)&_a_test_function, &sym) ==
+            0);
+    REQUIRE(bcc_symcache_resolve(other, (uint64_t)&_a_test_function,
+                                 &other_sym) == 0);
+    // same symbol table, so the same name string
+    REQUIRE(sym.name == other_sym.name);
+    REQUIRE(bcc_symcache_shared_tables(&bytes) >= 1);
+    REQUIRE(bytes > 0);
+    bcc_free_symcache(other, getpid());
+  }
+
   SECTION("resolve in separate mount namespace") {
     pid_t child;
     uint64_t addr = 0;
@@ -434,12 +500,175 @@ TEST_CASE("resolve symbols using /tmp/perf-pid.map", "[c_api]") {
     unlink(path.c_str());
   }
 
+  SECTION("appended and re-JITted symbols") {
+    child = spawn_child(map_addr, /* own_pidns */ true, true,
+        perf_map_func_noop);
+    REQUIRE(child > 0);
+
+    string path = perf_map_path(child);
+    REQUIRE(make_perf_map_file(path, (unsigned long long)map_addr) == 0);
+
+    void *resolver = bcc_symcache_new(child, nullptr);
+    REQUIRE(resolver);
 
+    REQUIRE(bcc_symcache_resolve(resolver, (unsigned long long)map_addr,
+        &sym) == 0);
+    REQUIRE(string("dummy_fn") == sym.name);
+    REQUIRE(bcc_symcache_resolve(resolver, (unsigned long long)map_addr + 0x20,
+        &sym) < 0);
+
+    FILE *file = fopen(path.c_str(), "a");
+    REQUIRE(file);
+    fprintf(file, "%llx 10 appended_fn\n", (unsigned long long)map_addr + 0x20);
+    fprintf(file, "%llx 8 rejitted_fn\n", (unsigned long long)map_addr + 0x4);
+    fclose(file);
+
+    // a miss reloads the map
+    REQUIRE(bcc_symcache_resolve(resolver, (unsigned long long)map_addr + 0x20,
+        &sym) == 0);
+    REQUIRE(string("appended_fn") == sym.name);
+
+    // the last symbol written for an address wins
+    REQUIRE(bcc_symcache_resolve(resolver, (unsigned long long)map_addr + 0x6,
+        &sym) == 0);
+    REQUIRE(string("rejitted_fn") == sym.name);
+    REQUIRE(sym.offset == 0x2);
+    REQUIRE(bcc_symcache_resolve(resolver, (unsigned long long)map_addr + 0xc,
+        &sym) == 0);
+    REQUIRE(string("dummy_fn") == sym.name);
+    REQUIRE(sym.offset == 0xc);
+
+    // without refresh, new symbols are only seen by a new cache
+    bcc_symcache_set_perf_map_refresh(resolver, BCC_PERF_MAP_REFRESH_NEVER);
+    file = fopen(path.c_str(), "a");
+    REQUIRE(file);
+    fprintf(file, "%llx 10 late_fn\n", (unsigned long long)map_addr + 0x40);
+    fclose(file);
+    REQUIRE(bcc_symcache_resolve(resolver, (unsigned long long)map_addr + 0x40,
+        &sym) < 0);
+
+    bcc_free_symcache(resolver, child);
+    unlink(path.c_str());
+  }
 
   munmap(map_addr, map_sz);
 }
 
 
+static vector<string> _sym_names;
+static int _collect_sym(const char *name, uint64_t) {
+  _sym_names.push_back(name);
+  return 0;
+}
+
+TEST_CASE("on-disk symbol index", "[c_api]") {
+  char dir[] = "/tmp/bcc_sym_index_XXXXXX";
+  REQUIRE(mkdtemp(dir));
+  string idx_dir = string(dir) + "/idx";
+  setenv("BCC_SYM_INDEX_DIR", idx_dir.c_str(), 1);
+
+  char *this_exe = realpath("/proc/self/exe", NULL);
+  REQUIRE(this_exe);
+
+  // cold run parses the ELF file and stores the index
+  _sym_names.clear();
+  REQUIRE(bcc_foreach_function_symbol(this_exe, _collect_sym) == 0);
+  vector<string> cold = _sym_names;
+  REQUIRE(std::find(cold.begin(), cold.end(), "_a_test_function") != cold.end());
+
+  string cmd = "ls " + idx_dir + " | grep -c '\\.sym$'";
+  int files = 0;
+  REQUIRE(cmd_scanf(cmd.c_str(), "%d", &files) == 0);
+  REQUIRE(files == 1);
+
+  // warm run replays the same symbols from the index
+  _sym_names.clear();
+  REQUIRE(bcc_foreach_function_symbol(this_exe, _collect_sym) == 0);
+  REQUIRE(_sym_names == cold);
+
+  // symbol resolution through the index gives the same result
+  struct bcc_symbol sym;
+  REQUIRE(bcc_resolve_symname(this_exe, "_a_test_function", 0x0, 0, nullptr,
+                              &sym) == 0);
+  REQUIRE(sym.offset != 0);
+  bcc_procutils_free(sym.module);
+
+  unsetenv("BCC_SYM_INDEX_DIR");
+  free(this_exe);
+  string rm = string("rm -rf ") + dir;
+  REQUIRE(system(rm.c_str()) == 0);
+}
+
+static uint64_t _test_function_addr;
+static int _find_test_function(const char *name, uint64_t addr) {
+  if (string("_a_test_function") == name)
+    _test_function_addr = addr;
+  return 0;
+}
+
+TEST_CASE("resolve build-ids from a directory", "[c_api]") {
+  char *this_exe = realpath("/proc/self/exe", NULL);
+  REQUIRE(this_exe);
+  char buildid[BPF_BUILD_ID_SIZE * 2 + 1];
+  if (bcc_elf_get_buildid(this_exe, buildid) < 0) {
+    // linked without a build-id note
+    free(this_exe);
+    return;
+  }
+  REQUIRE(bcc_foreach_function_symbol(this_exe, _find_test_function) == 0);
+  REQUIRE(_test_function_addr != 0);
+
+  char dir[] = "/tmp/bcc_build_id_XXXXXX";
+  REQUIRE(mkdtemp(dir));
+  string sub = string(dir) + "/usr/bin";
+  string cmd = "mkdir -p " + sub + " && cp " + this_exe + " " + sub + "/exe";
+  REQUIRE(system(cmd.c_str()) == 0);
+
+  struct bpf_stack_build_id trace = {};
+  trace.status = BPF_STACK_BUILD_ID_VALID;
+  for (int i = 0; i < BPF_BUILD_ID_SIZE; i++)
+    sscanf(buildid + 2 * i, "%2hhx", &trace.build_id[i]);
+  trace.offset = _test_function_addr + 4;
+
+  void *resolver = bcc_buildsymcache_new();
+  struct bcc_symbol sym;
+
+  SECTION("unknown without a directory") {
+    REQUIRE(bcc_buildsymcache_resolve(resolver, &trace, &sym) < 0);
+  }
+
+  SECTION("found by scanning the tree") {
+    REQUIRE(bcc_buildsymcache_add_directory(resolver, "/nonexistent") < 0);
+    REQUIRE(bcc_buildsymcache_add_directory(resolver, dir) == 0);
+    REQUIRE(bcc_buildsymcache_resolve(resolver, &trace, &sym) == 0);
+    REQUIRE(string("_a_test_function") == sym.name);
+    REQUIRE(sym.offset == 4);
+    REQUIRE(string(sym.module) == sub + "/exe");
+
+    // other build-ids are not found, and the tree is not scanned again
+    struct bpf_stack_build_id other = trace;
+    other.build_id[0] ^= 0xff;
+    REQUIRE(bcc_buildsymcache_resolve(resolver, &other, &sym) < 0);
+    REQUIRE(bcc_buildsymcache_resolve(resolver, &trace, &sym) == 0);
+  }
+
+  SECTION("found by name in a .build-id tree") {
+    string link = string(dir) + "/.build-id/" + string(buildid, 2);
+    cmd = "mkdir -p " + link + " && ln -s " + sub + "/exe " + link + "/" +
+          string(buildid + 2) + ".debug";
+    REQUIRE(system(cmd.c_str()) == 0);
+    REQUIRE(bcc_buildsymcache_add_directory(resolver, dir) == 0);
+    REQUIRE(bcc_buildsymcache_resolve(resolver, &trace, &sym) == 0);
+    REQUIRE(string("_a_test_function") == sym.name);
+    REQUIRE(string(sym.module) == link + "/" + string(buildid + 2) + ".debug");
+  }
+
+  bcc_free_buildsymcache(resolver);
+  free(this_exe);
+  string rm = string("rm -rf ") + dir;
+  REQUIRE(system(rm.c_str()) == 0);
+}
+
 TEST_CASE("get online CPUs", "[c_api]") {
 	std::vector<int> cpus = ebpf::get_online_cpus();
 	int num_cpus = sysconf(_SC_NPROCESSORS_ONLN);
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# Copyright (c) Facebook, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License")
+
+# The readers are exercised against fake rings: pipes that a fake BPF object
+# hands out as perf buffer fds, so no kernel support is needed.
+
+import os
+import sys
+import unittest
+from collections import namedtuple
+
+if sys.version_info >= (3, 5):
+    import asyncio
+    from bcc import BPF
+    from bcc.aio import AsyncPerfReader, AsyncTraceReader
+
+Event = namedtuple("Event", ["seq"])
+
+class FakeBatch(object):
+    def __init__(self, data):
+        self.data = data
+    def __iter__(self):
+        return iter([self.data[i:i + 1] for i in range(len(self.data))])
+    def decode(self):
+        return [Event(b) for b in self.data]
+
+class FakeTable(object):
+    def __init__(self, bpf, ncpu):
+        self.bpf = bpf
+        self.ncpu = ncpu
+    def open_perf_buffer(self, callback, page_cnt=8, lost_cb=None,
+                         batch=False):
+        for cpu in range(self.ncpu):
+            self.bpf.add_ring(cpu, callback)
+
+class FakeBPF(object):
+    """Each ring is a pipe: writing bytes to it submits one event per byte"""
+    def __init__(self):
+        self.rings = {}
+        self.consumed = {}
+    def add_ring(self, cpu, callback):
+        r, w = os.pipe()
+        os.set_blocking(r, False)
+        self.rings[r] = (cpu, w, callback)
+    def submit(self, cpu, data):
+        for r, (c, w, _) in self.rings.items():
+            if c == cpu:
+                os.write(w, data)
+    def perf_buffer_fds(self):
+        return list(self.rings.keys())
+    def perf_buffer_consume(self, fd):
+        cpu, _, callback = self.rings[fd]
+        self.consumed[cpu] = self.consumed.get(cpu, 0) + 1
+        data = b""
+        while True:
+            try:
+                chunk = os.read(fd, 4096)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            data += chunk
+        if data:
+            callback(cpu, FakeBatch(data))
+    def trace_open(self, nonblocking=False):
+        if not hasattr(self, "tracefile"):
+            r, self.trace_w = os.pipe()
+            self.tracefile = os.fdopen(r, "rb")
+        return self.tracefile
+    def close(self):
+        for r, (_, w, _) in self.rings.items():
+            os.close(r)
+            os.close(w)
+
+@unittest.skipUnless(sys.version_info >= (3, 5), "asyncio needs Python 3.5")
+class TestAsyncReaders(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.bpf = FakeBPF()
+
+    def tearDown(self):
+        self.bpf.close()
+        self.loop.close()
+
+    def take(self, reader, n):
+        futs = [reader.__anext__() for _ in range(n)]
+        return self.loop.run_until_complete(
+            asyncio.wait_for(asyncio.gather(*futs), 5))
+
+    def test_only_ready_rings_are_drained(self):
+        reader = AsyncPerfReader(self.bpf, loop=self.loop)
+        reader.open_perf_buffer(FakeTable(self.bpf, 4))
+        reader.__aiter__()
+        self.bpf.submit(2, b"\x01\x02\x03")
+        items = self.take(reader, 3)
+        self.assertEqual(items, [(2, Event(1)), (2, Event(2)), (2, Event(3))])
+        self.assertEqual(list(self.bpf.consumed.keys()), [2])
+        reader.close()
+
+    def test_concurrent_consumers(self):
+        reader = AsyncPerfReader(self.bpf, loop=self.loop)
+        reader.open_perf_buffer(FakeTable(self.bpf, 2))
+        reader.__aiter__()
+        # getters are queued before any data arrives, and served in order
+        futs = [reader.__anext__() for _ in range(6)]
+        self.loop.call_soon(self.bpf.submit, 0, b"\x00\x01\x02")
+        self.loop.call_later(0.01, self.bpf.submit, 1, b"\x03\x04\x05")
+        items = self.loop.run_until_complete(
+            asyncio.wait_for(asyncio.gather(*futs), 5))
+        self.assertEqual(sorted(e.seq for _, e in items), list(range(6)))
+        self.assertEqual([e.seq for c, e in items if c == 0], [0, 1, 2])
+        reader.close()
+        with self.assertRaises(StopAsyncIteration):
+            self.loop.run_until_complete(reader.__anext__())
+
+    def test_maxsize_pauses_rings(self):
+        reader = AsyncPerfReader(self.bpf, loop=self.loop, maxsize=2)
+        reader.open_perf_buffer(FakeTable(self.bpf, 1))
+        reader.__aiter__()
+        self.bpf.submit(0, b"\x00\x01\x02")
+        self.assertEqual(len(self.take(reader, 1)), 1)
+        self.assertFalse(reader._reading)
+        self.assertEqual(len(self.take(reader, 2)), 2)
+        self.assertTrue(reader._reading)
+        reader.close()
+
+    def test_trace_pipe(self):
+        self.bpf._parse_trace_line = BPF._parse_trace_line
+        reader = AsyncTraceReader(self.bpf, loop=self.loop, fields=True)
+        reader.__aiter__()
+        os.write(self.bpf.trace_w,
+                 b"           <...>-1234  [002] d... 1234.500000: 0: hello\n"
+                 b"CPU:1 [LOST 3 EVENTS]\n"
+                 b"           <...>-1235  [003] d... 1234.600000: 0: wor")
+        self.loop.call_later(0.01, os.write, self.bpf.trace_w, b"ld\n")
+        items = self.take(reader, 2)
+        self.assertEqual(items[0][1:3], (1234, 2))
+        self.assertEqual(items[0][5], b"hello")
+        self.assertEqual(items[1][5], b"world")
+        reader.close()
+        os.close(self.bpf.trace_w)
+        self.bpf.tracefile.close()
+
+if __name__ == "__main__":
+    unittest.main()
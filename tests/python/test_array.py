@@ -4,11 +4,19 @@
 
 from bcc import BPF
 import ctypes as ct
+import os
 import random
+import select
 import time
 import subprocess
+import sys
 from bcc.utils import get_online_cpus
-from unittest import main, TestCase
+from unittest import main, skipIf, skipUnless, TestCase
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 class TestArray(TestCase):
     def test_simple(self):
@@ -38,6 +46,23 @@ class TestArray(TestCase):
         self.assertEqual(t1[-2].value, 37)
         self.assertEqual(t1[-1].value, t1[127].value)
 
+    @skipIf(np is None and sys.version_info[0] < 3,
+            "numpy-less views need Python 3")
+    def test_to_numpy(self):
+        b = BPF(text="""BPF_ARRAY(table1, u64, 128);""")
+        t1 = b["table1"]
+        for i in range(128):
+            t1[ct.c_int(i)] = ct.c_ulonglong(i * 3)
+        keys, leaves = t1.to_numpy()
+        if np is None:
+            # memoryviews of the native type instead
+            self.assertEqual(list(keys), list(range(128)))
+            self.assertEqual(sum(leaves), sum(i * 3 for i in range(128)))
+        else:
+            self.assertEqual(len(keys), 128)
+            self.assertEqual(int(leaves.sum()), sum(i * 3 for i in range(128)))
+            self.assertEqual(int(leaves[keys == 5][0]), 15)
+
     def test_perf_buffer(self):
         self.counter = 0
 
@@ -71,6 +96,135 @@ int do_sys_nanosleep(void *ctx) {
         self.assertGreater(self.counter, 0)
         b.cleanup()
 
+    @skipUnless(sys.version_info[0] >= 3, "batch mode needs Python 3")
+    def test_perf_buffer_batch(self):
+        self.seqs = []
+        self.drains = 0
+
+        def cb(cpu, batch):
+            self.drains += 1
+            self.assertGreater(len(batch), 0)
+            for i, raw in enumerate(batch):
+                self.assertGreaterEqual(len(raw), 16)
+                event = batch.event(i)
+                self.assertEqual(event.cpu, cpu)
+                self.seqs.append(event.seq)
+
+        text = """
+BPF_PERF_OUTPUT(events);
+BPF_ARRAY(seq, u64, 1);
+int do_sys_nanosleep(void *ctx) {
+    struct {
+        u64 seq;
+        u32 cpu;
+    } data = {};
+    int zero = 0;
+    u64 *val = seq.lookup(&zero);
+    if (!val)
+        return 0;
+    data.seq = __sync_fetch_and_add(val, 1);
+    data.cpu = bpf_get_smp_processor_id();
+    events.perf_submit(ctx, &data, sizeof(data));
+    return 0;
+}
+"""
+        b = BPF(text=text)
+        b.attach_kprobe(event=b.get_syscall_fnname("nanosleep"),
+                        fn_name="do_sys_nanosleep")
+        b["events"].open_perf_buffer(cb, batch=True)
+        # several events per ring before the first poll
+        for i in range(10):
+            subprocess.call(['sleep', '0.01'])
+        b.perf_buffer_poll()
+        self.assertGreaterEqual(len(self.seqs), 10)
+        # one callback per ring that had data, not one per event
+        self.assertLessEqual(self.drains, len(get_online_cpus()))
+        self.assertEqual(len(set(self.seqs)), len(self.seqs))
+        b.cleanup()
+
+    def test_perf_buffer_epoll(self):
+        self.counts = {"a": 0, "b": 0}
+
+        def cb_a(cpu, data, size):
+            self.counts["a"] += 1
+
+        def cb_b(cpu, data, size):
+            self.counts["b"] += 1
+
+        text = """
+BPF_PERF_OUTPUT(a);
+BPF_PERF_OUTPUT(b);
+int do_sys_nanosleep(void *ctx) {
+    u64 ts = bpf_ktime_get_ns();
+    a.perf_submit(ctx, &ts, sizeof(ts));
+    b.perf_submit(ctx, &ts, sizeof(ts));
+    return 0;
+}
+"""
+        b = BPF(text=text)
+        b.attach_kprobe(event=b.get_syscall_fnname("nanosleep"),
+                        fn_name="do_sys_nanosleep")
+        b["a"].open_perf_buffer(cb_a)
+        # the epoll set exists from here on, later buffers are added to it
+        epfd = b.perf_buffer_epoll_fd()
+        b["b"].open_perf_buffer(cb_b)
+        self.assertEqual(len(b.perf_buffer_fds()), 2 * len(get_online_cpus()))
+        subprocess.call(['sleep', '0.1'])
+        r, _, _ = select.select([epfd], [], [], 5)
+        self.assertEqual(r, [epfd])
+        b.perf_buffer_poll(0)
+        self.assertGreater(self.counts["a"], 0)
+        self.assertGreater(self.counts["b"], 0)
+
+        # closing a's buffers removes them from the set
+        for cpu in get_online_cpus():
+            del b["a"][b["a"].Key(cpu)]
+        self.assertEqual(len(b.perf_buffer_fds()), len(get_online_cpus()))
+        a_count = self.counts["a"]
+        subprocess.call(['sleep', '0.1'])
+        b.perf_buffer_poll(1000)
+        self.assertEqual(self.counts["a"], a_count)
+        b.cleanup()
+
+    def test_perf_buffer_stats(self):
+        self.counter = 0
+
+        def cb(cpu, data, size):
+            self.counter += 1
+
+        text = """
+BPF_PERF_OUTPUT(events);
+int do_sys_nanosleep(void *ctx) {
+    struct {
+        u64 ts;
+        u32 cpu;
+    } data = {bpf_ktime_get_ns(), bpf_get_smp_processor_id()};
+    events.perf_submit(ctx, &data, sizeof(data));
+    return 0;
+}
+"""
+        b = BPF(text=text)
+        b.attach_kprobe(event=b.get_syscall_fnname("nanosleep"),
+                        fn_name="do_sys_nanosleep")
+        b["events"].open_perf_buffer(cb, page_cnt=4)
+        for i in range(5):
+            subprocess.call(['sleep', '0.01'])
+        b.perf_buffer_poll(timeout=100)
+        stats = b["events"].stats()
+        self.assertEqual(sorted(stats.keys()), get_online_cpus())
+        self.assertEqual(sum(s.events for s in stats.values()), self.counter)
+        for s in stats.values():
+            self.assertEqual(s.size, 4 * os.sysconf("SC_PAGESIZE"))
+            self.assertLessEqual(s.max_occupancy, s.size)
+            self.assertEqual(s.lost, 0)
+            if s.events:
+                self.assertGreaterEqual(s.bytes, 12 * s.events)
+                self.assertGreater(s.max_occupancy, 0)
+        b["events"].reset_stats()
+        stats = b["events"].stats()
+        self.assertEqual(sum(s.events for s in stats.values()), 0)
+        b.cleanup()
+
     def test_perf_buffer_for_each_cpu(self):
         self.events = []
 
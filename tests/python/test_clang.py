@@ -268,6 +268,43 @@ BPF_HASH(table3, u32, int);
 """
         b = BPF(text=text, debug=0)
 
+    def test_table_counter(self):
+        text = """
+BPF_HASH(counts, u32, u64, 64);
+BPF_TABLE_COUNTER(counts);
+int do_getpid(void *ctx) {
+    u32 k = 1;
+    u64 zero = 0, one = 1;
+    counts.insert(&k, &one);
+    k = 2;
+    counts.update(&k, &one);
+    counts.update(&k, &one);
+    counts.increment(3);
+    counts.increment(3);
+    k = 4;
+    counts.lookup_or_init(&k, &zero);
+    k = 1;
+    counts.delete(&k);
+    return 0;
+}
+"""
+        b = BPF(text=text, debug=0)
+        event = b.get_syscall_fnname("getpid")
+        b.attach_kprobe(event=event, fn_name="do_getpid")
+        os.getpid()
+        os.getpid()
+        b.detach_kprobe(event)
+        counts = b["counts"]
+        self.assertEqual(len(counts), 3)
+        counts[counts.Key(5)] = counts.Leaf(1)
+        counts[counts.Key(5)] = counts.Leaf(2)
+        del counts[counts.Key(2)]
+        self.assertEqual(len(counts), 3)
+        self.assertEqual(len(counts), len(list(counts.keys())))
+        self.assertEqual(counts.fill_ratio(), 3.0 / 64)
+        counts.clear()
+        self.assertEqual(len(counts), 0)
+
     def test_consecutive_probe_read(self):
         text = """
 #include <linux/fs.h>
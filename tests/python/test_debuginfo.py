@@ -2,9 +2,12 @@
 # Copyright (c) Sasha Goldshtein
 # Licensed under the Apache License, Version 2.0 (the "License")
 
+import ctypes as ct
+from ctypes.util import find_library
 import os
 import subprocess
-from bcc import SymbolCache, BPF
+from bcc import SymbolCache, BPF, PERF_MAP_REFRESH_ON_MISS, \
+    PERF_MAP_REFRESH_ALWAYS
 from unittest import main, TestCase
 
 class TestKSyms(TestCase):
@@ -42,6 +45,124 @@ class TestKSyms(TestCase):
         found = sym in aliases
         self.assertTrue(found)
 
+    def test_frame_memo(self):
+        (addr, aliases) = self.grab_sym()
+        addr = int(addr, 16)
+        first = BPF.ksym(addr, show_module=True)
+        before = BPF.sym_cache_stats()
+        self.assertEqual(BPF.ksym(addr, show_module=True), first)
+        self.assertEqual(BPF.ksym_batch([addr], show_module=True), [first])
+        stats = BPF.sym_cache_stats()
+        self.assertEqual(stats["frame_hits"] - before["frame_hits"], 2)
+        self.assertEqual(stats["frame_misses"], before["frame_misses"])
+        # other formatting options are memoized separately
+        self.assertNotEqual(BPF.ksym(addr), first)
+
+        BPF.set_frame_memo_limit(0)
+        self.assertEqual(BPF.ksym(addr, show_module=True), first)
+        self.assertEqual(BPF.sym_cache_stats()["frame_hits"],
+                         stats["frame_hits"])
+        BPF.set_frame_memo_limit(1 << 20)
+
+    def test_ksym_batch(self):
+        (addr, aliases) = self.grab_sym()
+        addrs = [int(addr, 16), int(addr, 16) + 1, 0]
+        self.assertEqual(BPF.ksym_batch(addrs, show_offset=True),
+                         [BPF.ksym(a, show_offset=True) for a in addrs])
+        self.assertEqual(BPF.ksym_batch([]), [])
+
+class TestSymCacheLRU(TestCase):
+    def setUp(self):
+        BPF.sym_cache_evict()
+        self.procs = [subprocess.Popen(['sleep', '60']) for i in range(3)]
+
+    def tearDown(self):
+        for p in self.procs:
+            p.kill()
+            p.wait()
+        BPF.set_sym_cache_limits(max_entries=1024, max_bytes=512 << 20)
+
+    def test_lru(self):
+        BPF.set_sym_cache_limits(max_entries=2, max_bytes=0)
+        before = BPF.sym_cache_stats()
+        for p in self.procs:
+            BPF.sym(0, p.pid)
+        BPF.sym(0, self.procs[2].pid)
+        stats = BPF.sym_cache_stats()
+        self.assertEqual(stats["entries"], 2)
+        self.assertEqual(stats["misses"] - before["misses"], 3)
+        self.assertEqual(stats["hits"] - before["hits"], 1)
+        self.assertEqual(stats["evictions"] - before["evictions"], 1)
+        self.assertNotIn(self.procs[0].pid, BPF._sym_caches)
+        self.assertIn(self.procs[2].pid, BPF._sym_caches)
+
+        BPF.sym_cache_evict(self.procs[2].pid)
+        self.assertNotIn(self.procs[2].pid, BPF._sym_caches)
+
+    def test_invalidate_on_exit(self):
+        pid = self.procs[0].pid
+        BPF.sym(0, pid)
+        before = BPF.sym_cache_stats()
+        self.procs[0].kill()
+        self.procs[0].wait()
+        BPF.sym(0, pid)
+        stats = BPF.sym_cache_stats()
+        self.assertEqual(stats["invalidations"] - before["invalidations"], 1)
+
+    def test_perf_map_refresh(self):
+        pid = self.procs[0].pid
+        path = "/tmp/perf-%d.map" % pid
+        self.addCleanup(os.unlink, path)
+        self.addCleanup(BPF.set_perf_map_refresh, PERF_MAP_REFRESH_ON_MISS)
+        with open(path, "w") as f:
+            f.write("1000 10 jit_a\n")
+        self.assertEqual(BPF.sym(0x1004, pid), b"jit_a")
+        self.assertEqual(BPF.sym(0x2004, pid), b"[unknown]")
+
+        # appended symbols are picked up on a miss
+        with open(path, "a") as f:
+            f.write("2000 10 jit_b\n1000 8 jit_c\n")
+        self.assertEqual(BPF.sym(0x2004, pid), b"jit_b")
+        self.assertEqual(BPF.sym(0x1004, pid), b"jit_a")
+
+        # re-JITted code at known addresses needs a reload for every lookup
+        BPF.set_perf_map_refresh(PERF_MAP_REFRESH_ALWAYS)
+        self.assertEqual(BPF.sym(0x1004, pid), b"jit_c")
+        self.assertEqual(BPF.sym(0x100c, pid, show_offset=True),
+                         b"jit_a+0xc")
+
+    def test_sym_stacks(self):
+        libc = ct.CDLL(find_library("c"))
+        user = [ct.cast(getattr(libc, fn), ct.c_void_p).value + off
+                for fn in ["strtok", "malloc", "free", "getpid", "memcpy"]
+                for off in range(0, 64, 4)]
+        with open("/proc/kallsyms", "rb") as f:
+            kernel = [int(line.split()[0], 16) for line in f
+                      if line.split()[1] in [b"t", b"T"]][:200:10]
+        pid = os.getpid()
+        stacks = [(pid, user), (-1, kernel), (pid, user[::-1] + [0]),
+                  (self.procs[0].pid, user[:3])]
+        chunk = BPF._sym_chunk
+        self.addCleanup(setattr, BPF, "_sym_chunk", chunk)
+        BPF._sym_chunk = 8
+
+        expected = None
+        for workers in [1, 4]:
+            BPF.sym_cache_evict()
+            res = BPF.sym_stacks(stacks, show_module=True, show_offset=True,
+                                 workers=workers)
+            if expected is None:
+                expected = res
+            # same output whatever the number of workers
+            self.assertEqual(res, expected)
+        self.assertEqual(expected[0],
+                         BPF.sym_batch(user, pid, show_module=True,
+                                       show_offset=True))
+        self.assertEqual(expected[1],
+                         BPF.ksym_batch(kernel, show_module=True,
+                                        show_offset=True))
+        self.assertEqual(expected[2][:-1], expected[0][::-1])
+
 class Harness(TestCase):
     def setUp(self):
         self.build_command()
@@ -70,7 +191,10 @@ class Harness(TestCase):
         self.assertEqual(sym, b'some_namespace::some_function(int, int)')
         self.assertEqual(offset, 0)
         self.assertTrue(module[-5:] == b'dummy')
-
+        for demangle in (False, True):
+            addrs = [self.addr, self.addr + 1, 0]
+            self.assertEqual(self.syms.resolve_batch(addrs, demangle),
+                             [self.syms.resolve(a, demangle) for a in addrs])
 
     def resolve_name(self):
         script_dir = os.path.dirname(os.path.realpath(__file__).encode("utf8"))
@@ -112,6 +236,7 @@ class TestBuildid(Harness):
         for line in lines:
             if b"some_function" in line:
                 self.mangled_name = line.split(b' ')[2]
+                self.sym_value = int(line.split(b' ')[0], 16)
                 break
         self.assertTrue(self.mangled_name)
 
@@ -133,5 +258,24 @@ class TestBuildid(Harness):
     def test_resolve_addr(self):
         self.resolve_name()
 
+    def test_build_id_frames(self):
+        class Frame(ct.Structure):
+            _fields_ = [("status", ct.c_int), ("build_id", ct.c_ubyte * 20),
+                        ("offset", ct.c_ulonglong)]
+
+        build_id = bytearray.fromhex("123456789abcdef0123456789abcdef012345678")
+        frame = Frame(1, (ct.c_ubyte * 20)(*build_id), self.sym_value + 2)
+        unknown = Frame(1, (ct.c_ubyte * 20)(*build_id[::-1]), 0x10)
+        BPF.add_module_dir("/usr/lib/debug")
+        expected = self.mangled_name + b"+0x2"
+        self.assertEqual(BPF.sym(frame, -1, show_offset=True), expected)
+        self.assertEqual(BPF.sym_batch([frame, unknown, frame], -1,
+                                       show_offset=True),
+                         [expected, b"[unknown]", expected])
+        pid = os.getpid()
+        addr = ct.cast(ct.CDLL(find_library("c")).malloc, ct.c_void_p).value
+        self.assertEqual(BPF.sym_stacks([(pid, [frame]), (pid, [addr])]),
+                         [[self.mangled_name], [BPF.sym(addr, pid)]])
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# Copyright (c) Facebook, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License")
+
+import ctypes as ct
+import os
+import sys
+import unittest
+from time import time
+from bcc import BPF
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class TestMapBatch(unittest.TestCase):
+    MAPSIZE = 1024
+
+    def fill_hash(self, t, n):
+        for i in range(n):
+            t[ct.c_int(i)] = ct.c_ulonglong(i * 10)
+
+    def check_items(self, items, n):
+        self.assertEqual(len(items), n)
+        got = sorted((k.value, v.value) for k, v in items)
+        self.assertEqual(got, [(i, i * 10) for i in range(n)])
+
+    def test_lookup_batch(self):
+        b = BPF(text="""BPF_HASH(map, int, u64, %d);""" % self.MAPSIZE)
+        t = b["map"]
+        self.fill_hash(t, self.MAPSIZE)
+        # small chunks force several round trips through the cursor
+        self.check_items(t.items_lookup_batch(chunk=100), self.MAPSIZE)
+        self.check_items(t.items_lookup_batch(), self.MAPSIZE)
+        self.assertEqual(len(t), self.MAPSIZE)
+
+    def test_lookup_and_delete_batch(self):
+        b = BPF(text="""BPF_HASH(map, int, u64, %d);""" % self.MAPSIZE)
+        t = b["map"]
+        self.fill_hash(t, self.MAPSIZE)
+        self.check_items(t.items_lookup_and_delete_batch(chunk=100),
+                         self.MAPSIZE)
+        self.assertEqual(len(t), 0)
+        self.assertEqual(t.items_lookup_and_delete_batch(), [])
+
+    def test_delete_batch(self):
+        b = BPF(text="""BPF_HASH(map, int, u64, %d);""" % self.MAPSIZE)
+        t = b["map"]
+        self.fill_hash(t, self.MAPSIZE)
+        t.delete_batch([ct.c_int(i) for i in range(0, self.MAPSIZE, 2)])
+        self.assertEqual(sorted(k.value for k in t.keys()),
+                         list(range(1, self.MAPSIZE, 2)))
+        t.delete_batch()
+        self.assertEqual(len(t), 0)
+
+    def test_array_lookup_batch(self):
+        b = BPF(text="""BPF_ARRAY(map, u64, %d);""" % self.MAPSIZE)
+        t = b["map"]
+        for i in range(self.MAPSIZE):
+            t[ct.c_int(i)] = ct.c_ulonglong(i * 10)
+        self.check_items(t.items_lookup_batch(), self.MAPSIZE)
+
+    def test_array_unsupported_batch(self):
+        b = BPF(text="""BPF_ARRAY(map, u64, %d);""" % self.MAPSIZE)
+        t = b["map"]
+        for i in range(self.MAPSIZE):
+            t[ct.c_int(i)] = ct.c_ulonglong(i * 10)
+        # arrays implement BPF_MAP_LOOKUP_BATCH but not the deleting
+        # commands, which must fall back without disabling the lookup
+        t.items_lookup_batch()
+        t.delete_batch([ct.c_int(0)])
+        self.assertEqual(t[ct.c_int(0)].value, 0)
+        items = t.items_lookup_and_delete_batch()
+        self.assertEqual(len(items), self.MAPSIZE)
+        # array entries are zeroed rather than removed
+        self.assertEqual(sum(v.value for k, v in t.items_lookup_batch()), 0)
+
+    def test_lookup_batch_same_as_items(self):
+        b = BPF(text="""BPF_HASH(map, int, u64, %d);""" % self.MAPSIZE)
+        t = b["map"]
+        self.fill_hash(t, 100)
+        self.assertEqual(
+            sorted((k.value, v.value) for k, v in t.items_lookup_batch()),
+            sorted((k.value, v.value) for k, v in t.items()))
+
+    @unittest.skipUnless(os.environ.get("BCC_BENCHMARKS"),
+                         "set BCC_BENCHMARKS to run benchmarks")
+    def test_syscalls_per_entry(self):
+        # count syscalls issued by this process while dumping the map, to
+        # compare the batched walk against the get_next_key + lookup walk
+        counter = BPF(text="""
+BPF_ARRAY(count, u64, 1);
+TRACEPOINT_PROBE(raw_syscalls, sys_enter) {
+    if ((bpf_get_current_pid_tgid() >> 32) != TGID)
+        return 0;
+    int zero = 0;
+    count.increment(zero);
+    return 0;
+}""", cflags=["-DTGID=%d" % os.getpid()])
+        nsys = counter["count"]
+
+        entries = 64 * 1024
+        b = BPF(text="""BPF_HASH(map, int, u64, %d);""" % entries)
+        t = b["map"]
+        self.fill_hash(t, entries)
+
+        def measure(fn):
+            nsys[ct.c_int(0)] = ct.c_ulonglong(0)
+            start = time()
+            items = fn()
+            elapsed = time() - start
+            self.assertEqual(len(items), entries)
+            return nsys[ct.c_int(0)].value, elapsed
+
+        slow_calls, slow_time = measure(t.items)
+        fast_calls, fast_time = measure(t.items_lookup_batch)
+        sys.stderr.write("\n%d entries: items() %.2f syscalls/entry %.3fs, "
+                         "items_lookup_batch() %.4f syscalls/entry %.3fs" %
+                         (entries, float(slow_calls) / entries, slow_time,
+                          float(fast_calls) / entries, fast_time))
+        if t._batch_ok.get("BPF_MAP_LOOKUP_BATCH"):
+            self.assertLess(fast_calls, slow_calls)
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_to_numpy_hash(self):
+        b = BPF(text="""
+struct key_t { u32 pid; char comm[16]; };
+BPF_HASH(counts, struct key_t, u64, 256);
+""")
+        counts = b["counts"]
+        for i in range(10):
+            k = counts.Key(i, b"task%d" % i)
+            counts[k] = ct.c_ulonglong(i)
+        keys, leaves = counts.to_numpy()
+        self.assertEqual(len(keys), 10)
+        self.assertEqual(sorted(keys["pid"]), list(range(10)))
+        i = np.nonzero(keys["pid"] == 4)[0][0]
+        self.assertEqual(keys["comm"][i], b"task4")
+        self.assertEqual(leaves[i], 4)
+
+    def test_snapshot_diff(self):
+        b = BPF(text="""BPF_HASH(counts, u32, u64, 256);""")
+        counts = b["counts"]
+        for i in range(10):
+            counts[ct.c_uint(i)] = ct.c_ulonglong(i)
+        prev = counts.snapshot()
+        self.assertEqual(len(prev), 10)
+        counts[ct.c_uint(3)] = ct.c_ulonglong(10)
+        # values going down give negative deltas, even though unsigned
+        counts[ct.c_uint(6)] = ct.c_ulonglong(1)
+        counts[ct.c_uint(20)] = ct.c_ulonglong(1)
+        del counts[ct.c_uint(5)]
+        cur = counts.snapshot()
+        # snapshots are copies
+        counts[ct.c_uint(4)] = ct.c_ulonglong(100)
+        self.assertEqual(dict((k.value, v.value) for k, v in cur.items())[4], 4)
+
+        d = cur.diff(prev)
+        self.assertEqual([k.value for k, v in d.added.items()], [20])
+        self.assertEqual([k.value for k, v in d.removed.items()], [5])
+        changed = [k.value for k, v in d.changed.items()]
+        self.assertEqual(sorted(changed), [3, 6])
+        self.assertEqual(sorted(zip(changed, [int(x) for x in d.deltas])),
+                         [(3, 7), (6, -5)])
+        self.assertGreaterEqual(d.interval, 0)
+        self.assertEqual(len(cur.diff(cur).changed), 0)
+
+    def test_keys_array(self):
+        b = BPF(text="""BPF_HASH(map, int, u64, %d);""" % self.MAPSIZE)
+        t = b["map"]
+        self.fill_hash(t, 100)
+        keys = t.keys_array()
+        self.assertEqual(len(keys), 100)
+        self.assertEqual(sorted(keys), list(range(100)))
+        out = (t.Key * 10)()
+        self.assertEqual(len(t.keys_array(out)), 10)
+        self.assertEqual(sorted(out), sorted(keys[:10]))
+
+        self.assertEqual(sorted(k.value for k in t.iterkeys_reuse()),
+                         list(range(100)))
+        items = [(k.value, v.value) for k, v in t.iteritems_reuse()]
+        self.assertEqual(sorted(items), [(i, i * 10) for i in range(100)])
+
+    @unittest.skipUnless(os.environ.get("BCC_BENCHMARKS"),
+                         "set BCC_BENCHMARKS to run benchmarks")
+    def test_iteration_benchmark(self):
+        entries = 1024 * 1024
+        b = BPF(text="""BPF_HASH(map, int, u64, %d);""" % entries)
+        t = b["map"]
+        self.fill_hash(t, entries)
+
+        def measure(fn):
+            start = time()
+            count = fn()
+            elapsed = time() - start
+            self.assertEqual(count, entries)
+            return elapsed
+
+        keys_time = measure(lambda: sum(1 for k in t.keys()))
+        reuse_time = measure(lambda: sum(1 for k in t.iterkeys_reuse()))
+        array_time = measure(lambda: len(t.keys_array()))
+        items_time = measure(lambda: sum(1 for i in t.iteritems()))
+        items_reuse_time = measure(lambda: sum(1 for i in t.iteritems_reuse()))
+        sys.stderr.write("\n%d entries: keys() %.3fs, iterkeys_reuse() %.3fs, "
+                         "keys_array() %.3fs, iteritems() %.3fs, "
+                         "iteritems_reuse() %.3fs" %
+                         (entries, keys_time, reuse_time, array_time,
+                          items_time, items_reuse_time))
+
+if __name__ == "__main__":
+    unittest.main()
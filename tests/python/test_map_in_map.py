@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License")
+
+import ctypes as ct
+import os
+import unittest
+from bcc import BPF, SwappableTable
+
+class TestMapInMap(unittest.TestCase):
+    def test_array_of_maps(self):
+        b = BPF(text="""
+BPF_ARRAY(inner, u64, 4);
+BPF_ARRAY(other, u64, 4);
+BPF_ARRAY_OF_MAPS(outer, "inner", 2);
+BPF_HASH_OF_MAPS(by_key, "inner", 8);
+""")
+        outer = b["outer"]
+        # tables or fds
+        outer[0] = b["inner"]
+        outer[1] = b["other"].map_fd
+        # read back as map ids
+        self.assertNotEqual(outer[0].value, 0)
+        self.assertNotEqual(outer[0].value, outer[1].value)
+        del outer[1]
+        by_key = b["by_key"]
+        by_key[by_key.Key(42)] = b["other"]
+        self.assertEqual([k.value for k in by_key.keys()], [42])
+
+    def test_create_inner(self):
+        b = BPF(text="""
+BPF_HASH(inner, u32, u64, 16);
+BPF_HASH_OF_MAPS(by_key, "inner", 8);
+""")
+        by_key = b["by_key"]
+        key = by_key.Key(7)
+        first = by_key.create_inner(b["inner"],
+                                    [(ct.c_uint(i), ct.c_ulonglong(i * 2))
+                                     for i in range(10)])
+        self.assertEqual(len(first), 10)
+        self.assertEqual(first[ct.c_uint(3)].value, 6)
+        self.assertNotEqual(first.map_fd, b["inner"].map_fd)
+        self.assertIsNone(by_key.replace(key, first))
+        first_id = by_key[key].value
+
+        second = by_key.create_inner(b["inner"])
+        self.assertIs(by_key.replace(key, second), first)
+        self.assertNotEqual(by_key[key].value, first_id)
+        # the template limits the size of the inner maps
+        for i in range(16):
+            second[ct.c_uint(i)] = ct.c_ulonglong(i)
+        with self.assertRaises(Exception):
+            second[ct.c_uint(16)] = ct.c_ulonglong(16)
+        del by_key[key]
+        self.assertEqual(len(by_key), 0)
+
+    def test_swappable_table(self):
+        b = BPF(text="""
+BPF_SWAPPABLE_TABLE("hash", u32, u64, counts, 1024);
+int do_getpid(void *ctx) {
+    u32 tgid = bpf_get_current_pid_tgid() >> 32;
+    int zero = 0;
+    void *active = counts.lookup(&zero);
+    if (active)
+        bpf_map_increment(active, &tgid, 1);
+    return 0;
+}
+""")
+        b.attach_kprobe(event=b.get_syscall_fnname("getpid"),
+                        fn_name="do_getpid")
+        counts = SwappableTable(b, b"counts")
+        key = counts.active_table().Key(os.getpid())
+        for i in range(100):
+            os.getpid()
+        first = counts.swap()
+        self.assertIs(first, counts.idle_table())
+        for i in range(50):
+            os.getpid()
+        self.assertGreaterEqual(first[key].value, 100)
+        # the programs no longer update it
+        calls = first[key].value
+        os.getpid()
+        self.assertEqual(first[key].value, calls)
+        first.clear()
+        self.assertEqual(len(first), 0)
+
+        second = counts.swap()
+        self.assertIsNot(second, first)
+        self.assertGreaterEqual(second[key].value, 50)
+        b.cleanup()
+
+    def test_swappable_plain_table(self):
+        # the fallback used by tools on kernels without maps of maps
+        b = BPF(text="""
+BPF_HASH(counts, u32, u64, 1024);
+int do_getpid(void *ctx) {
+    u32 key = bpf_get_current_pid_tgid() >> 32;
+    %s
+    return 0;
+}
+""" % SwappableTable.increment_text("counts", "key", False))
+        b.attach_kprobe(event=b.get_syscall_fnname("getpid"),
+                        fn_name="do_getpid")
+        counts = SwappableTable(b, b"counts")
+        key = counts.active_table().Key(os.getpid())
+        for i in range(10):
+            os.getpid()
+        table = counts.swap()
+        self.assertIs(table, b["counts"])
+        self.assertIs(counts.swap(), table)
+        self.assertGreaterEqual(table[key].value, 10)
+        b.cleanup()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# Copyright (c) PLUMgrid, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License")
+
+import os
+import shutil
+import tempfile
+import unittest
+from bcc import BPF
+
+text = b"""
+BPF_HASH(counts, u32, u64, 16);
+BPF_PERF_OUTPUT(events);
+struct data_t { u32 pid; char comm[16]; };
+int count(void *ctx) {
+    struct data_t data = {};
+    u32 key = 1;
+    counts.increment(key);
+    data.pid = bpf_get_current_pid_tgid();
+    events.perf_submit(ctx, &data, sizeof(data));
+    return 0;
+}
+"""
+
+class TestObjCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        os.environ["BCC_OBJ_CACHE_DIR"] = self.cache_dir
+
+    def tearDown(self):
+        del os.environ["BCC_OBJ_CACHE_DIR"]
+        shutil.rmtree(self.cache_dir)
+
+    def test_warm_start(self):
+        b = BPF(text=text)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        b.cleanup()
+
+        b = BPF(text=text)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        b.load_func(b"count", BPF.KPROBE)
+        counts = b[b"counts"]
+        counts[counts.Key(1)] = counts.Leaf(42)
+        self.assertEqual(counts[counts.Key(1)].value, 42)
+        event = b[b"events"].event
+        self.assertTrue(callable(event))
+        b.cleanup()
+
+    def test_cflags_in_key(self):
+        BPF(text=text).cleanup()
+        BPF(text=text, cflags=["-DUNUSED=1"]).cleanup()
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,10 +3,16 @@
 # Licensed under the Apache License, Version 2.0 (the "License")
 
 import os
+import sys
 import unittest
 from bcc import BPF
 import multiprocessing
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 class TestPercpu(unittest.TestCase):
 
     def setUp(self):
@@ -53,6 +59,26 @@ class TestPercpu(unittest.TestCase):
         self.assertGreater(max.value, int(0))
         bpf_code.detach_kprobe(event_name)
 
+    @unittest.skipIf(np is None and sys.version_info[0] < 3,
+                     "numpy-less views need Python 3")
+    def test_to_numpy_percpu(self):
+        b = BPF(text='BPF_TABLE("percpu_hash", u32, u64, stats, 16);')
+        stats_map = b["stats"]
+        ncpu = len(stats_map.Leaf())
+        for k in range(4):
+            ini = stats_map.Leaf()
+            for i in range(ncpu):
+                ini[i] = k + i
+            stats_map[stats_map.Key(k)] = ini
+        keys, values = stats_map.to_numpy_percpu()
+        if isinstance(values, memoryview):
+            self.assertEqual(values.shape, (4, ncpu))
+            return
+        self.assertEqual(values.shape, (4, ncpu))
+        totals = dict(zip(keys.tolist(), values.sum(axis=1).tolist()))
+        for k in range(4):
+            self.assertEqual(totals[k], stats_map.sum(stats_map.Key(k)).value)
+
     def test_u32(self):
         test_prog1 = """
         BPF_TABLE("percpu_array", u32, u32, stats, 1);
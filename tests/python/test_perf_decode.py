@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# Copyright (c) Facebook, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License")
+
+import ctypes as ct
+import os
+import sys
+import unittest
+from time import time
+from bcc.table import EventDecoder
+
+# field list in the form returned by PerfEventArray._get_event_fields(),
+# modelled on the execsnoop/tcplife event structs
+FIELDS = [("pid", ct.c_uint, "u32"),
+          ("ppid", ct.c_uint, "u32"),
+          ("comm", ct.c_char * 16, "char [16]"),
+          ("ts", ct.c_ulonglong, "u64"),
+          ("saddr", ct.c_ulonglong * 2, "unsigned __int128"),
+          ("args", ct.c_int * 4, "int [4]"),
+          ("retval", ct.c_int, "int")]
+
+Event = type('', (ct.Structure,), {'_fields_': [(n, c) for n, c, _ in FIELDS]})
+
+class TestPerfDecode(unittest.TestCase):
+    def make_events(self, n):
+        events = (Event * n)()
+        for i in range(n):
+            e = events[i]
+            e.pid = i
+            e.ppid = 1
+            e.comm = b"task%d" % (i % 100)
+            e.ts = i * 1000
+            e.saddr[0] = i
+            e.saddr[1] = 1
+            e.args[3] = -i
+            e.retval = -2
+        return events
+
+    def test_decode(self):
+        events = self.make_events(4)
+        d = EventDecoder(FIELDS)
+        self.assertEqual(d.size, ct.sizeof(Event))
+        e = d.decode(ct.addressof(events[3]))
+        self.assertEqual(e.pid, 3)
+        self.assertEqual(e.comm, b"task3")
+        self.assertEqual(e.saddr, 3 | (1 << 64))
+        self.assertEqual(e.args, (0, 0, 0, -3))
+        self.assertEqual(e.retval, -2)
+        buf = ct.string_at(ct.addressof(events), ct.sizeof(events))
+        offsets = [i * ct.sizeof(Event) for i in range(4)]
+        decoded = d.decode_all(buf, offsets, 4)
+        self.assertEqual([x.pid for x in decoded], [0, 1, 2, 3])
+        self.assertEqual(d.columns(decoded)["comm"],
+                         [b"task0", b"task1", b"task2", b"task3"])
+
+    @unittest.skipUnless(os.environ.get("BCC_BENCHMARKS"),
+                         "set BCC_BENCHMARKS to run benchmarks")
+    def test_decode_throughput(self):
+        n = 100000
+        events = self.make_events(n)
+        base = ct.addressof(events)
+        size = ct.sizeof(Event)
+        d = EventDecoder(FIELDS)
+
+        # current path: ct.cast per event, then a getattr per field, as
+        # done by trace.py when printing an event
+        start = time()
+        ctypes_rows = []
+        for i in range(n):
+            e = ct.cast(base + i * size, ct.POINTER(Event)).contents
+            ctypes_rows.append((e.pid, e.ppid, e.comm, e.ts,
+                                e.saddr[0] | (e.saddr[1] << 64),
+                                tuple(e.args), e.retval))
+        ctypes_rate = n / (time() - start)
+
+        start = time()
+        decoder_rows = []
+        for i in range(n):
+            e = d.decode(base + i * size)
+            decoder_rows.append((e.pid, e.ppid, e.comm, e.ts, e.saddr,
+                                 e.args, e.retval))
+        decoder_rate = n / (time() - start)
+
+        buf = ct.string_at(base, n * size)
+        offsets = range(0, n * size, size)
+        start = time()
+        batch_rows = [(e.pid, e.ppid, e.comm, e.ts, e.saddr, e.args, e.retval)
+                      for e in d.decode_all(buf, offsets, n)]
+        batch_rate = n / (time() - start)
+
+        sys.stderr.write("\nevents/s: ctypes %d, EventDecoder.decode %d, "
+                         "EventDecoder.decode_all %d" %
+                         (ctypes_rate, decoder_rate, batch_rate))
+        self.assertEqual(decoder_rows, ctypes_rows)
+        self.assertEqual(batch_rows, ctypes_rows)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# Copyright (c) Facebook, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License")
+
+import os
+import sys
+import threading
+import unittest
+from time import time, sleep
+from bcc import BPF
+
+# every getppid() from this process submits EVENTS_PER_CALL events
+EVENTS_PER_CALL = 16
+
+text = """
+BPF_PERF_OUTPUT(events);
+TRACEPOINT_PROBE(syscalls, sys_enter_getppid) {
+    if ((bpf_get_current_pid_tgid() >> 32) != TGID)
+        return 0;
+    u64 ts = bpf_ktime_get_ns();
+#pragma unroll
+    for (int i = 0; i < EVENTS_PER_CALL; i++)
+        events.perf_submit(args, &ts, sizeof(ts));
+    return 0;
+}
+"""
+
+@unittest.skipUnless(sys.version_info[0] >= 3, "batch mode needs Python 3")
+class TestPerfWakeup(unittest.TestCase):
+    def run_load(self, nevents, **kwargs):
+        b = BPF(text=text, cflags=["-DTGID=%d" % os.getpid(),
+                                   "-DEVENTS_PER_CALL=%d" % EVENTS_PER_CALL])
+        stats = {"events": 0, "wakeups": 0, "lost": 0}
+
+        def cb(cpu, batch):
+            # in batch mode the callback runs once per ring drain
+            stats["wakeups"] += 1
+            stats["events"] += len(batch)
+
+        def lost_cb(lost):
+            stats["lost"] += lost
+
+        b["events"].open_perf_buffer(cb, page_cnt=64, lost_cb=lost_cb,
+                                     batch=True, **kwargs)
+        done = []
+
+        def poller():
+            while not done:
+                b.perf_buffer_poll(100)
+        t = threading.Thread(target=poller)
+        t.start()
+        start = time()
+        calls = nevents // EVENTS_PER_CALL
+        for i in range(calls):
+            os.getppid()
+        # let the flush deliver what is below the watermark
+        sleep(0.3)
+        done.append(True)
+        t.join()
+        elapsed = time() - start
+        b.cleanup()
+        # the number of events actually submitted
+        return stats, elapsed, calls * EVENTS_PER_CALL
+
+    def test_wakeup_events(self):
+        stats, _, submitted = self.run_load(1000, wakeup_events=64,
+                                            flush_ms=50)
+        # everything is delivered, including the tail below the watermark
+        self.assertEqual(stats["events"] + stats["lost"], submitted)
+
+    @unittest.skipUnless(os.environ.get("BCC_BENCHMARKS"),
+                         "set BCC_BENCHMARKS to run benchmarks")
+    def test_wakeup_benchmark(self):
+        for opts in [{}, {"wakeup_events": 64}, {"wakeup_bytes": 65536}]:
+            stats, elapsed, nevents = self.run_load(1000000, **opts)
+            sys.stderr.write("\n%-24s %8d wakeups per million events, "
+                             "%d lost, %.0f events/s" %
+                             (opts or "wakeup every event",
+                              stats["wakeups"] * 1000000 // nevents,
+                              stats["lost"], nevents / elapsed))
+            self.assertEqual(stats["events"] + stats["lost"], nevents)
+
+if __name__ == "__main__":
+    unittest.main()
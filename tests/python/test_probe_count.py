@@ -4,8 +4,10 @@
 
 from bcc import BPF, _get_num_open_probes, TRACEFS
 import os
+import re
 import sys
-from unittest import main, TestCase
+import time
+from unittest import main, skipUnless, TestCase
 
 class TestKprobeCnt(TestCase):
     def setUp(self):
@@ -87,5 +89,80 @@ class TestProbeNotExist(TestCase):
         self.b.cleanup()
 
 
+class TestKprobeFunctions(TestCase):
+    def full_scan(self, event_re):
+        # what get_kprobe_functions() did before the index, one regex match
+        # per kallsyms line
+        with open("%s/../kprobes/blacklist" % TRACEFS, "rb") as f:
+            blacklist = set([line.rstrip().split()[1] for line in f])
+        fns = set()
+        in_init = in_irq = 0
+        with open("/proc/kallsyms", "rb") as f:
+            for line in f:
+                (t, fn) = line.rstrip().split()[1:3]
+                if in_init == 0 and fn == b'__init_begin':
+                    in_init = 1
+                    continue
+                elif in_init == 1:
+                    in_init = 2 if fn == b'__init_end' else 1
+                    continue
+                if in_irq == 0 and fn == b'__irqentry_text_start':
+                    in_irq = 1
+                    continue
+                elif in_irq == 1:
+                    in_irq = 2 if fn == b'__irqentry_text_end' else 1
+                    continue
+                if fn.startswith(b'_kbl_addr_') or fn.startswith(b'__perf') \
+                        or fn.startswith(b'perf_'):
+                    continue
+                if t.lower() in [b't', b'w'] and re.match(event_re, fn) \
+                        and fn not in blacklist:
+                    fns.add(fn)
+        return fns
+
+    def test_same_as_full_scan(self):
+        for pattern in [b"^vfs_.*$", b"tcp_", b".*_read$", b"^(vfs|tcp)_r.*",
+                        b"^schedule$", b"do_sys_ope+n"]:
+            self.assertEqual(BPF.get_kprobe_functions(pattern),
+                             self.full_scan(pattern))
+
+    def test_glob_and_prefix(self):
+        vfs = BPF.get_kprobe_functions(b"^vfs_.*$")
+        self.assertGreater(len(vfs), 0)
+        self.assertEqual(BPF.get_kprobe_functions_glob(b"vfs_*"), vfs)
+        self.assertEqual(set(BPF._kprobe_functions.prefix(b"vfs_")), vfs)
+        self.assertEqual(BPF.get_kprobe_functions_glob(b"vfs_rea?"),
+                         set([b"vfs_read"]) & vfs)
+
+    def test_index_reused(self):
+        index = BPF._kprobe_functions
+        BPF.get_kprobe_functions(b"^vfs_.*$")
+        builds = index.builds
+        for pattern in [b"^tcp_.*$", b"^ext4_.*$", b"^vfs_.*$"]:
+            BPF.get_kprobe_functions(pattern)
+        self.assertEqual(index.builds, builds)
+
+    @skipUnless(os.environ.get("BCC_BENCHMARKS"),
+                "set BCC_BENCHMARKS to run benchmarks")
+    def test_funccount_benchmark(self):
+        # funccount 'vfs_*' 'tcp_*' 'ext4_*' turns each glob into a regex
+        patterns = [b"^vfs_.*$", b"^tcp_.*$", b"^ext4_.*$"]
+        start = time.time()
+        expected = [self.full_scan(p) for p in patterns]
+        scan = time.time() - start
+
+        BPF._kprobe_functions.invalidate()
+        start = time.time()
+        cold = [BPF.get_kprobe_functions(p) for p in patterns]
+        cold_time = time.time() - start
+        start = time.time()
+        warm = [BPF.get_kprobe_functions(p) for p in patterns]
+        warm_time = time.time() - start
+
+        sys.stderr.write("\nfull scans %.3fs, index cold %.3fs, warm %.6fs" %
+                         (scan, cold_time, warm_time))
+        self.assertEqual(cold, expected)
+        self.assertEqual(warm, expected)
+
 if __name__ == "__main__":
     main()
@@ -12,7 +12,7 @@
 # 20-Sep-2015   Brendan Gregg   Created this.
 
 from __future__ import print_function
-from bcc import BPF
+from bcc import BPF, SwappableTable
 from time import sleep, strftime
 import argparse
 
@@ -94,18 +94,20 @@ if args.milliseconds:
 else:
     bpf_text = bpf_text.replace('FACTOR', 'delta /= 1000;')
     label = "usecs"
+swappable = BPF.support_map_in_map()
+storage = 'BPF_SWAPPABLE_HISTOGRAM' if swappable else 'BPF_HISTOGRAM'
+increment = SwappableTable.increment_text('dist', 'key', swappable)
 if args.disks:
     bpf_text = bpf_text.replace('STORAGE',
-        'BPF_HISTOGRAM(dist, disk_key_t);')
+        storage + '(dist, disk_key_t);')
     bpf_text = bpf_text.replace('STORE',
         'disk_key_t key = {.slot = bpf_log2l(delta)}; ' +
         'void *__tmp = (void *)req->rq_disk->disk_name; ' +
-        'bpf_probe_read(&key.disk, sizeof(key.disk), __tmp); ' +
-        'dist.increment(key);')
+        'bpf_probe_read(&key.disk, sizeof(key.disk), __tmp); ' + increment)
 else:
-    bpf_text = bpf_text.replace('STORAGE', 'BPF_HISTOGRAM(dist);')
+    bpf_text = bpf_text.replace('STORAGE', storage + '(dist);')
     bpf_text = bpf_text.replace('STORE',
-        'dist.increment(bpf_log2l(delta));')
+        'int key = bpf_log2l(delta); ' + increment)
 if debug or args.ebpf:
     print(bpf_text)
     if args.ebpf:
@@ -126,7 +128,7 @@ print("Tracing block device I/O... Hit Ctrl-C to end.")
 
 # output
 exiting = 0 if args.interval else 1
-dist = b.get_table("dist")
+dist = SwappableTable(b, "dist")
 while (1):
     try:
         sleep(int(args.interval))
@@ -137,8 +139,9 @@ while (1):
     if args.timestamp:
         print("%-8s\n" % strftime("%H:%M:%S"), end="")
 
-    dist.print_log2_hist(label, "disk")
-    dist.clear()
+    hist = dist.swap()
+    hist.print_log2_hist(label, "disk")
+    hist.clear()
 
     countdown -= 1
     if exiting or countdown == 0:
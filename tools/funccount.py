@@ -16,7 +16,7 @@
 # 18-Oct-2016   Sasha Goldshtein    Generalized for uprobes, tracepoints, USDT.
 
 from __future__ import print_function
-from bcc import ArgString, BPF, USDT
+from bcc import ArgString, BPF, SwappableTable, USDT
 from time import sleep, strftime
 import argparse
 import os
@@ -166,7 +166,7 @@ class Probe(object):
 int PROBE_FUNCTION(void *ctx) {
     FILTER
     int loc = LOCATION;
-    u64 *val = counts.lookup(&loc);
+    LOOKUP
     if (!val) {
         return 0;   // Should never happen, # of locations is known
     }
@@ -176,9 +176,25 @@ int PROBE_FUNCTION(void *ctx) {
         """
         bpf_text = b"""#include <uapi/linux/ptrace.h>
 
-BPF_ARRAY(counts, u64, NUMLOCATIONS);
+STORAGE
         """
 
+        if BPF.support_map_in_map():
+            bpf_text = bpf_text.replace(b"STORAGE",
+                b'BPF_SWAPPABLE_TABLE("array", int, u64, counts, NUMLOCATIONS);')
+            trace_count_text = trace_count_text.replace(b"LOOKUP",
+                b"""int zero = 0;
+    void *active = counts.lookup(&zero);
+    if (!active) {
+        return 0;
+    }
+    u64 *val = bpf_map_lookup_elem(active, &loc);""")
+        else:
+            bpf_text = bpf_text.replace(b"STORAGE",
+                b"BPF_ARRAY(counts, u64, NUMLOCATIONS);")
+            trace_count_text = trace_count_text.replace(b"LOOKUP",
+                b"u64 *val = counts.lookup(&loc);")
+
         # We really mean the tgid from the kernel's perspective, which is in
         # the top 32 bits of bpf_get_current_pid_tgid().
         if self.pid:
@@ -200,13 +216,14 @@ BPF_ARRAY(counts, u64, NUMLOCATIONS);
 
         self.bpf = BPF(text=bpf_text,
                        usdt_contexts=[self.usdt] if self.usdt else [])
-        self.clear()    # Initialize all array items to zero
+        self.swappable = SwappableTable(self.bpf, b"counts")
 
     def counts(self):
-        return self.bpf["counts"]
+        # the counts since the previous call
+        return self.swappable.swap()
 
     def clear(self):
-        counts = self.bpf["counts"]
+        counts = self.swappable.idle_table()
         for location, _ in list(self.trace_functions.items()):
             counts[counts.Key(location)] = counts.Leaf()
 
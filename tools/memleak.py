@@ -459,17 +459,18 @@ def print_outstanding():
                         alloc_info[info.stack_id].update(info.size)
                 else:
                         stack = list(stack_traces.walk(info.stack_id))
-                        combined = []
-                        for addr in stack:
-                                combined.append(bpf.sym(addr, pid,
-                                        show_module=True, show_offset=True))
-                        alloc_info[info.stack_id] = Allocation(combined,
+                        alloc_info[info.stack_id] = Allocation(stack,
                                                                info.size)
                 if args.show_allocs:
                         print("\taddr = %x size = %s" %
                               (address.value, info.size))
         to_show = sorted(alloc_info.values(),
                          key=lambda a: a.size)[-top_stacks:]
+        # symbolize the stacks shown only, all at once
+        syms = bpf.sym_stacks([(pid, alloc.stack) for alloc in to_show],
+                              show_module=True, show_offset=True)
+        for alloc, combined in zip(to_show, syms):
+                alloc.stack = combined
         for alloc in to_show:
                 print("\t%d bytes in %d allocations from stack\n\t\t%s" %
                       (alloc.size, alloc.count, b"\n\t\t".join(alloc.stack)))
@@ -478,28 +479,27 @@ def print_outstanding_combined():
         stack_traces = bpf["stack_traces"]
         stacks = sorted(bpf["combined_allocs"].items(),
                         key=lambda a: -a[1].total_size)
-        cnt = 1
-        entries = []
+        stacks = stacks[:top_stacks]
+        walked = []
         for stack_id, info in stacks:
                 try:
-                        trace = []
-                        for addr in stack_traces.walk(stack_id.value):
-                                sym = bpf.sym(addr, pid,
-                                                      show_module=True,
-                                                      show_offset=True)
-                                trace.append(sym)
-                        trace = "\n\t\t".join(trace)
+                        walked.append(list(stack_traces.walk(stack_id.value)))
                 except KeyError:
+                        walked.append(None)
+
+        syms = bpf.sym_stacks([(pid, addrs or []) for addrs in walked],
+                              show_module=True, show_offset=True)
+        entries = []
+        for (stack_id, info), addrs, trace in zip(stacks, walked, syms):
+                if addrs is None:
                         trace = "stack information lost"
+                else:
+                        trace = "\n\t\t".join(trace)
 
                 entry = ("\t%d bytes in %d allocations from stack\n\t\t%s" %
                          (info.total_size, info.number_of_allocs, trace))
                 entries.append(entry)
 
-                cnt += 1
-                if cnt > top_stacks:
-                        break
-
         print("[%s] Top %d stacks with outstanding allocations:" %
               (datetime.now().strftime("%H:%M:%S"), top_stacks))
 
@@ -261,6 +261,7 @@ missing_stacks = 0
 has_enomem = False
 counts = b.get_table("counts")
 stack_traces = b.get_table("stack_traces")
+stacks = []
 for k, v in sorted(counts.items(), key=lambda counts: counts[1].value):
     # handle get_stackid errors
     if not args.user_stacks_only and stack_id_err(k.kernel_stack_id):
@@ -276,11 +277,17 @@ for k, v in sorted(counts.items(), key=lambda counts: counts[1].value):
         stack_traces.walk(k.user_stack_id)
     kernel_stack = [] if k.kernel_stack_id < 0 else \
         stack_traces.walk(k.kernel_stack_id)
+    stacks.append((k, v, list(user_stack), list(kernel_stack)))
+
+syms = b.sym_stacks([(k.tgid, user_stack) for k, _, user_stack, _ in stacks] +
+                    [(-1, kernel_stack) for _, _, _, kernel_stack in stacks])
+
+for i, (k, v, user_stack, kernel_stack) in enumerate(stacks):
+    user_syms = syms[i]
+    kernel_syms = syms[len(stacks) + i]
 
     if folded:
         # print folded stack output
-        user_stack = list(user_stack)
-        kernel_stack = list(kernel_stack)
         line = [k.name.decode('utf-8', 'replace')]
         # if we failed to get the stack is, such as due to no space (-ENOMEM) or
         # hash collision (-EEXIST), we still print a placeholder for consistency
@@ -288,15 +295,15 @@ for k, v in sorted(counts.items(), key=lambda counts: counts[1].value):
             if stack_id_err(k.user_stack_id):
                 line.append("[Missed User Stack]")
             else:
-                line.extend([b.sym(addr, k.tgid).decode('utf-8', 'replace')
-                    for addr in reversed(user_stack)])
+                line.extend([sym.decode('utf-8', 'replace')
+                    for sym in user_syms[::-1]])
         if not args.user_stacks_only:
             line.extend(["-"] if (need_delimiter and k.kernel_stack_id >= 0 and k.user_stack_id >= 0) else [])
             if stack_id_err(k.kernel_stack_id):
                 line.append("[Missed Kernel Stack]")
             else:
-                line.extend([b.ksym(addr).decode('utf-8', 'replace')
-                    for addr in reversed(kernel_stack)])
+                line.extend([sym.decode('utf-8', 'replace')
+                    for sym in kernel_syms[::-1]])
         print("%s %d" % (";".join(line), v.value))
     else:
         # print default multi-line stack output
@@ -304,16 +311,16 @@ for k, v in sorted(counts.items(), key=lambda counts: counts[1].value):
             if stack_id_err(k.kernel_stack_id):
                 print("    [Missed Kernel Stack]")
             else:
-                for addr in kernel_stack:
-                    print("    %s" % b.ksym(addr))
+                for sym in kernel_syms:
+                    print("    %s" % sym)
         if not args.kernel_stacks_only:
             if need_delimiter and k.user_stack_id >= 0 and k.kernel_stack_id >= 0:
                 print("    --")
             if stack_id_err(k.user_stack_id):
                 print("    [Missed User Stack]")
             else:
-                for addr in user_stack:
-                    print("    %s" % b.sym(addr, k.tgid))
+                for sym in user_syms:
+                    print("    %s" % sym)
         print("    %-16s %s (%d)" % ("-", k.name.decode('utf-8', 'replace'), k.pid))
         print("        %d\n" % v.value)
 
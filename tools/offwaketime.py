@@ -294,6 +294,7 @@ counts = b.get_table("counts")
 stack_traces = b.get_table("stack_traces")
 need_delimiter = args.delimited and not (args.kernel_stacks_only or
                                          args.user_stacks_only)
+stacks = []
 for k, v in sorted(counts.items(), key=lambda counts: counts[1].value):
     # handle get_stackid errors
     if not args.user_stacks_only:
@@ -308,13 +309,26 @@ for k, v in sorted(counts.items(), key=lambda counts: counts[1].value):
                      (k.t_u_stack_id == -errno.ENOMEM)
 
     waker_user_stack = [] if k.w_u_stack_id < 1 else \
-        reversed(list(stack_traces.walk(k.w_u_stack_id))[1:])
+        list(stack_traces.walk(k.w_u_stack_id))
     waker_kernel_stack = [] if k.w_k_stack_id < 1 else \
-        reversed(list(stack_traces.walk(k.w_k_stack_id))[1:])
+        list(stack_traces.walk(k.w_k_stack_id))
     target_user_stack = [] if k.t_u_stack_id < 1 else \
-        stack_traces.walk(k.t_u_stack_id)
+        list(stack_traces.walk(k.t_u_stack_id))
     target_kernel_stack = [] if k.t_k_stack_id < 1 else \
-        stack_traces.walk(k.t_k_stack_id)
+        list(stack_traces.walk(k.t_k_stack_id))
+    stacks.append((k, v, [(k.w_tgid, waker_user_stack),
+                          (-1, waker_kernel_stack),
+                          (k.t_tgid, target_user_stack),
+                          (-1, target_kernel_stack)]))
+
+syms = b.sym_stacks([stack for _, _, four in stacks for stack in four])
+
+for i, (k, v, _) in enumerate(stacks):
+    # the first frame of waker stacks is skipped, they are printed reversed
+    waker_user_stack = list(reversed(syms[4 * i][1:]))
+    waker_kernel_stack = list(reversed(syms[4 * i + 1][1:]))
+    target_user_stack = syms[4 * i + 2]
+    target_kernel_stack = syms[4 * i + 3]
 
     if folded:
         # print folded stack output
@@ -323,29 +337,29 @@ for k, v in sorted(counts.items(), key=lambda counts: counts[1].value):
             if stack_id_err(k.t_u_stack_id):
                 line.append("[Missed User Stack]")
             else:
-                line.extend([b.sym(addr, k.t_tgid).decode('utf-8', 'replace')
-                    for addr in reversed(list(target_user_stack)[1:])])
+                line.extend([sym.decode('utf-8', 'replace')
+                    for sym in reversed(target_user_stack[1:])])
         if not args.user_stacks_only:
             line.extend(["-"] if (need_delimiter and k.t_k_stack_id > 0 and k.t_u_stack_id > 0) else [])
             if stack_id_err(k.t_k_stack_id):
                 line.append("[Missed Kernel Stack]")
             else:
-                line.extend([b.ksym(addr).decode('utf-8', 'replace')
-                    for addr in reversed(list(target_kernel_stack)[1:])])
+                line.extend([sym.decode('utf-8', 'replace')
+                    for sym in reversed(target_kernel_stack[1:])])
         line.append("--")
         if not args.user_stacks_only:
             if stack_id_err(k.w_k_stack_id):
                 line.append("[Missed Kernel Stack]")
             else:
-                line.extend([b.ksym(addr).decode('utf-8', 'replace')
-                    for addr in reversed(list(waker_kernel_stack))])
+                line.extend([sym.decode('utf-8', 'replace')
+                    for sym in reversed(waker_kernel_stack)])
         if not args.kernel_stacks_only:
             line.extend(["-"] if (need_delimiter and k.w_u_stack_id > 0 and k.w_k_stack_id > 0) else [])
             if stack_id_err(k.w_u_stack_id):
                 line.append("[Missed User Stack]")
             else:
-                line.extend([b.sym(addr, k.w_tgid).decode('utf-8', 'replace')
-                    for addr in reversed(list(waker_user_stack))])
+                line.extend([sym.decode('utf-8', 'replace')
+                    for sym in reversed(waker_user_stack)])
         line.append(k.waker.decode('utf-8', 'replace'))
         print("%s %d" % (";".join(line), v.value))
     else:
@@ -355,16 +369,16 @@ for k, v in sorted(counts.items(), key=lambda counts: counts[1].value):
             if stack_id_err(k.w_u_stack_id):
                 print("    [Missed User Stack]")
             else:
-                for addr in waker_user_stack:
-                    print("    %s" % b.sym(addr, k.w_tgid))
+                for sym in waker_user_stack:
+                    print("    %s" % sym)
         if not args.user_stacks_only:
             if need_delimiter and k.w_u_stack_id > 0 and k.w_k_stack_id > 0:
                 print("    -")
             if stack_id_err(k.w_k_stack_id):
                 print("    [Missed Kernel Stack]")
             else:
-                for addr in waker_kernel_stack:
-                    print("    %s" % b.ksym(addr))
+                for sym in waker_kernel_stack:
+                    print("    %s" % sym)
 
         # print waker/wakee delimiter
         print("    %-16s %s" % ("--", "--"))
@@ -373,16 +387,16 @@ for k, v in sorted(counts.items(), key=lambda counts: counts[1].value):
             if stack_id_err(k.t_k_stack_id):
                 print("    [Missed Kernel Stack]")
             else:
-                for addr in target_kernel_stack:
-                    print("    %s" % b.ksym(addr))
+                for sym in target_kernel_stack:
+                    print("    %s" % sym)
         if not args.kernel_stacks_only:
             if need_delimiter and k.t_u_stack_id > 0 and k.t_k_stack_id > 0:
                 print("    -")
             if stack_id_err(k.t_u_stack_id):
                 print("    [Missed User Stack]")
             else:
-                for addr in target_user_stack:
-                    print("    %s" % b.sym(addr, k.t_tgid))
+                for sym in target_user_stack:
+                    print("    %s" % sym)
         print("    %-16s %s %s" % ("target:", k.target.decode('utf-8', 'replace'), k.w_pid))
         print("        %d\n" % v.value)
 
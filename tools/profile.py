@@ -279,11 +279,11 @@ except KeyboardInterrupt:
 if not args.folded:
     print()
 
-def aksym(addr):
+def aksyms(syms):
     if args.annotations:
-        return b.ksym(addr) + "_[k]".encode()
+        return [sym + "_[k]".encode() for sym in syms]
     else:
-        return b.ksym(addr)
+        return syms
 
 # output stacks
 missing_stacks = 0
@@ -292,6 +292,7 @@ counts = b.get_table("counts")
 stack_traces = b.get_table("stack_traces")
 need_delimiter = args.delimited and not (args.kernel_stacks_only or
                                          args.user_stacks_only)
+stacks = []
 for k, v in sorted(counts.items(), key=lambda counts: counts[1].value):
     # handle get_stackid errors
     if not args.user_stacks_only and stack_id_err(k.kernel_stack_id):
@@ -302,7 +303,7 @@ for k, v in sorted(counts.items(), key=lambda counts: counts[1].value):
         has_enomem = has_enomem or k.user_stack_id == -errno.ENOMEM
 
     user_stack = [] if k.user_stack_id < 0 else \
-        stack_traces.walk(k.user_stack_id)
+        list(stack_traces.walk(k.user_stack_id))
     kernel_tmp = [] if k.kernel_stack_id < 0 else \
         stack_traces.walk(k.kernel_stack_id)
 
@@ -314,11 +315,17 @@ for k, v in sorted(counts.items(), key=lambda counts: counts[1].value):
         # the later IP checking
         if k.kernel_ip:
             kernel_stack.insert(0, k.kernel_ip)
+    stacks.append((k, v, user_stack, kernel_stack))
+
+syms = b.sym_stacks([(k.pid, user_stack) for k, _, user_stack, _ in stacks] +
+                    [(-1, kernel_stack) for _, _, _, kernel_stack in stacks])
+
+for i, (k, v, user_stack, kernel_stack) in enumerate(stacks):
+    user_syms = syms[i]
+    kernel_syms = aksyms(syms[len(stacks) + i])
 
     if args.folded:
         # print folded stack output
-        user_stack = list(user_stack)
-        kernel_stack = list(kernel_stack)
         line = [k.name]
         # if we failed to get the stack is, such as due to no space (-ENOMEM) or
         # hash collision (-EEXIST), we still print a placeholder for consistency
@@ -326,13 +333,13 @@ for k, v in sorted(counts.items(), key=lambda counts: counts[1].value):
             if stack_id_err(k.user_stack_id):
                 line.append("[Missed User Stack]")
             else:
-                line.extend([b.sym(addr, k.pid) for addr in reversed(user_stack)])
+                line.extend(user_syms[::-1])
         if not args.user_stacks_only:
             line.extend(["-"] if (need_delimiter and k.kernel_stack_id >= 0 and k.user_stack_id >= 0) else [])
             if stack_id_err(k.kernel_stack_id):
                 line.append("[Missed Kernel Stack]")
             else:
-                line.extend([aksym(addr) for addr in reversed(kernel_stack)])
+                line.extend(kernel_syms[::-1])
         print("%s %d" % (b";".join(line).decode('utf-8', 'replace'), v.value))
     else:
         # print default multi-line stack output
@@ -340,16 +347,16 @@ for k, v in sorted(counts.items(), key=lambda counts: counts[1].value):
             if stack_id_err(k.kernel_stack_id):
                 print("    [Missed Kernel Stack]")
             else:
-                for addr in kernel_stack:
-                    print("    %s" % aksym(addr))
+                for sym in kernel_syms:
+                    print("    %s" % sym)
         if not args.kernel_stacks_only:
             if need_delimiter and k.user_stack_id >= 0 and k.kernel_stack_id >= 0:
                 print("    --")
             if stack_id_err(k.user_stack_id):
                 print("    [Missed User Stack]")
             else:
-                for addr in user_stack:
-                    print("    %s" % b.sym(addr, k.pid).decode('utf-8', 'replace'))
+                for sym in user_syms:
+                    print("    %s" % sym.decode('utf-8', 'replace'))
         print("    %-16s %s (%d)" % ("-", k.name.decode('utf-8', 'replace'), k.pid))
         print("        %d\n" % v.value)
 
@@ -25,7 +25,7 @@
 # 07-Feb-2016   Brendan Gregg   Created this.
 
 from __future__ import print_function
-from bcc import BPF
+from bcc import BPF, SwappableTable
 from time import sleep, strftime
 import argparse
 
@@ -219,6 +219,9 @@ if args.milliseconds:
 else:
     bpf_text = bpf_text.replace('FACTOR', 'delta /= 1000;')
     label = "usecs"
+swappable = BPF.support_map_in_map()
+storage = 'BPF_SWAPPABLE_HISTOGRAM' if swappable else 'BPF_HISTOGRAM'
+increment = SwappableTable.increment_text('dist', 'key', swappable)
 if args.pids or args.tids:
     section = "pid"
     pid = "tgid"
@@ -226,22 +229,22 @@ if args.pids or args.tids:
         pid = "pid"
         section = "tid"
     bpf_text = bpf_text.replace('STORAGE',
-        'BPF_HISTOGRAM(dist, pid_key_t);')
+        storage + '(dist, pid_key_t);')
     bpf_text = bpf_text.replace('STORE',
         'pid_key_t key = {.id = ' + pid + ', .slot = bpf_log2l(delta)}; ' +
-        'dist.increment(key);')
+        increment)
 elif args.pidnss:
     section = "pidns"
     bpf_text = bpf_text.replace('STORAGE',
-        'BPF_HISTOGRAM(dist, pidns_key_t);')
+        storage + '(dist, pidns_key_t);')
     bpf_text = bpf_text.replace('STORE', 'pidns_key_t key = ' +
         '{.id = prev->nsproxy->pid_ns_for_children->ns.inum, ' +
-        '.slot = bpf_log2l(delta)}; dist.increment(key);')
+        '.slot = bpf_log2l(delta)}; ' + increment)
 else:
     section = ""
-    bpf_text = bpf_text.replace('STORAGE', 'BPF_HISTOGRAM(dist);')
+    bpf_text = bpf_text.replace('STORAGE', storage + '(dist);')
     bpf_text = bpf_text.replace('STORE',
-        'dist.increment(bpf_log2l(delta));')
+        'int key = bpf_log2l(delta); ' + increment)
 if debug or args.ebpf:
     print(bpf_text)
     if args.ebpf:
@@ -258,7 +261,7 @@ print("Tracing run queue latency... Hit Ctrl-C to end.")
 
 # output
 exiting = 0 if args.interval else 1
-dist = b.get_table("dist")
+dist = SwappableTable(b, "dist")
 while (1):
     try:
         sleep(int(args.interval))
@@ -269,8 +272,9 @@ while (1):
     if args.timestamp:
         print("%-8s\n" % strftime("%H:%M:%S"), end="")
 
-    dist.print_log2_hist(label, section, section_print_fn=int)
-    dist.clear()
+    hist = dist.swap()
+    hist.print_log2_hist(label, section, section_print_fn=int)
+    hist.clear()
 
     countdown -= 1
     if exiting or countdown == 0:
@@ -275,23 +275,22 @@ class Tool(object):
         self.need_delimiter = self.args.delimited and not (
                     self.args.kernel_stacks_only or self.args.user_stacks_only)
 
-    def _print_kframe(self, addr):
-        print("  ", end="")
-        if self.args.verbose:
-            print("%-16x " % addr, end="")
-        if self.args.offset:
-            print("%s" % self.probe.bpf.ksym(addr, show_offset=True))
-        else:
-            print("%s" % self.probe.bpf.ksym(addr))
-
-    def _print_uframe(self, addr, pid):
-        print("  ", end="")
-        if self.args.verbose:
-            print("%-16x " % addr, end="")
-        if self.args.offset:
-            print("%s" % self.probe.bpf.sym(addr, pid, show_offset=True))
-        else:
-            print("%s" % self.probe.bpf.sym(addr, pid))
+    def _print_frames(self, addrs, syms):
+        for addr, sym in zip(addrs, syms):
+            print("  ", end="")
+            if self.args.verbose:
+                print("%-16x " % addr, end="")
+            print("%s" % sym)
+
+    def _print_kframes(self, addrs):
+        addrs = list(addrs)
+        self._print_frames(addrs, self.probe.bpf.ksym_batch(addrs,
+                           show_offset=self.args.offset))
+
+    def _print_uframes(self, addrs, pid):
+        addrs = list(addrs)
+        self._print_frames(addrs, self.probe.bpf.sym_batch(addrs, pid,
+                           show_offset=self.args.offset))
 
     @staticmethod
     def _signal_ignore(signal, frame):
@@ -340,19 +339,16 @@ class Tool(object):
                     user_stack = list(user_stack)
                     kernel_stack = list(kernel_stack)
                     line = [k.name.decode('utf-8', 'replace')] + \
-                        [b.sym(addr, k.tgid) for addr in
-                        reversed(user_stack)] + \
+                        b.sym_batch(user_stack[::-1], k.tgid) + \
                         (self.need_delimiter and ["-"] or []) + \
-                        [b.ksym(addr) for addr in reversed(kernel_stack)]
+                        b.ksym_batch(kernel_stack[::-1])
                     print("%s %d" % (";".join(line), v.value))
                 else:
                     # print multi-line stack output
-                    for addr in kernel_stack:
-                        self._print_kframe(addr)
+                    self._print_kframes(kernel_stack)
                     if self.need_delimiter:
                         print("    --")
-                    for addr in user_stack:
-                        self._print_uframe(addr, k.tgid)
+                    self._print_uframes(user_stack, k.tgid)
                     if not self.args.pid and k.tgid != 0xffffffff:
                         self._print_comm(k.name, k.tgid)
                     print("    %d\n" % v.value)
@@ -528,12 +528,13 @@ BPF_PERF_OUTPUT(%s);
                 return
 
             stack = list(bpf.get_table(self.stacks_name).walk(stack_id))
-            for addr in stack:
+            syms = bpf.sym_batch(stack, tgid, show_module=True,
+                                 show_offset=True)
+            for addr, sym in zip(stack, syms):
                 print("        ", end="")
                 if Probe.print_address:
                     print("%16x " % addr, end="")
-                print("%s" % (bpf.sym(addr, tgid,
-                                     show_module=True, show_offset=True)))
+                print("%s" % sym)
 
         def _format_message(self, bpf, tgid, values):
                 # Replace each %K with kernel sym and %U with user sym in tgid
@@ -699,8 +700,8 @@ trace -I 'linux/fs_struct.h' 'mntns_install "users = %d", $task->fs->users'
                   help="allow to use STRCMP with binary values")
                 parser.add_argument('-s', "--sym_file_list", type=str, \
                   metavar="SYM_FILE_LIST", dest="sym_file_list", \
-                  help="coma separated list of symbol files to use \
-                  for symbol resolution")
+                  help="coma separated list of symbol files, or directories \
+                  of symbol files, to use for symbol resolution")
                 parser.add_argument("-K", "--kernel-stack",
                   action="store_true", help="output kernel stack trace")
                 parser.add_argument("-U", "--user-stack",
@@ -767,7 +768,11 @@ trace -I 'linux/fs_struct.h' 'mntns_install "users = %d", $task->fs->users'
                 self.bpf = BPF(text=self.program, usdt_contexts=usdt_contexts)
                 if self.args.sym_file_list is not None:
                   print("Note: Kernel bpf will report stack map with ip/build_id")
-                  map(lambda x: self.bpf.add_module(x), self.args.sym_file_list.split(','))
+                  for x in self.args.sym_file_list.split(','):
+                    if os.path.isdir(x):
+                      self.bpf.add_module_dir(x)
+                    else:
+                      self.bpf.add_module(x)
                 for probe in self.probes:
                         if self.args.verbose:
                                 print(probe)